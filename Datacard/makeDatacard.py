@@ -19,6 +19,13 @@ from writeToDatacard import DCWriter
 from systematics import theory_systematics, experimental_systematics
 
 
+def get_parser():
+    parser = ArgumentParser(description="Script to create the datacards")
+    parser.add_argument("-pm",  "--parametricModel", help="Signal from the MH-dependent workspaces (makeYields.py --parametricModel)", default=False, action="store_true")
+
+    return parser
+
+
 def main():
     infiles = glob("./yields/*.pkl")
     infiles.sort(key=str.lower)
@@ -68,7 +75,7 @@ def main():
             fdataName = "{}/datacard_{}_runII_{}_{}.txt".format(outDir, decayMode, cat, mass)
             print("[INFO] Creating the data card {}".format(fdataName))
 
-            dcw = DCWriter(fdataName, df_data, cat, mass, years)
+            dcw = DCWriter(fdataName, df_data, cat, mass, years, _parametric=args.parametricModel)
             dcw.writePreamble()
             dcw.writeProcesses()
             for syst in theory_systematics:
@@ -83,4 +90,7 @@ def main():
 
 
 if __name__ == "__main__" :
+    parser = get_parser()
+    args = parser.parse_args()
+
     main()
\ No newline at end of file
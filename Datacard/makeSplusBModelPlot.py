@@ -16,6 +16,7 @@ import json
 from collections import OrderedDict
 # Scripts for plotting
 from plottingTools import getEffSigma, makeSplusBPlot
+from commonTools import dataset_to_numpy
 
 print " ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ HGG MODEL PLOTTER RUN II ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ "
 def leave():
@@ -112,15 +113,16 @@ sb_model, b_model = w.pdf("model_s"), w.pdf("model_b")
 # Extract dataset for opt.cats
 d_obs = w.data("data_obs")
 data_cats = OrderedDict()
-wdata_cats = OrderedDict()
+print " --> Extracting datasets"
+# Bulk extraction of the x-variable per category: each entry is repeated by its (integer) number of events
 for cidx in range(chan.numTypes()):
   chan.setIndex(cidx)
   c = chan.getLabel()
   if(opt.cats!='all')&(c not in opt.cats.split(",")): continue
-  if( opt.doHHMjjFix )&( c in catsfix ): _xvar_argset, _wxvar_argset = xvarfix_argset, wxvarfix_argset
-  else: _xvar_argset, _wxvar_argset = xvar_argset, wxvar_argset
-  data_cats[c] = ROOT.RooDataSet("d_%s"%c,"d_%s"%c,_xvar_argset)
-  wdata_cats[c] = ROOT.RooDataSet("wd_%s"%c,"wd_%s"%c,_wxvar_argset,"weight")
+  if( opt.doHHMjjFix )&( c in catsfix ): _xvarName = xvarfix.GetName()
+  else: _xvarName = xvar.GetName()
+  _columns = dataset_to_numpy(d_obs.reduce("CMS_channel==CMS_channel::%s"%c),[_xvarName])
+  data_cats[c] = np.repeat(_columns[_xvarName],_columns["weight"].astype(int))
 
 # Define cateogries
 cats = data_cats.keys()
@@ -184,17 +186,6 @@ else:
       if not os.path.isdir("./jsons"): os.system("mkdir ./jsons")
       with open("./jsons/catsWeights_sospb%s_%s.json"%(opt.ext,opt.xvar.split(",")[0]),'w') as jsonfile: json.dump(catsWeights,jsonfile)
 
-# Fill datasets
-print " --> Extracting datasets"
-# Loop over bins and add entry for each "weight" to cat datasets 
-for i in range(d_obs.numEntries()):
-  p = d_obs.get(i)
-  if(opt.cats!='all')&(p.getCatLabel("CMS_channel") not in opt.cats.split(",")): continue
-  nent = int(d_obs.weight())
-  for ient in range(nent): data_cats[p.getCatLabel("CMS_channel")].add(p)
-  if opt.doCatWeights: 
-    for ient in range(nent): wdata_cats[p.getCatLabel("CMS_channel")].add(p,catsWeights[p.getCatLabel("CMS_channel")])
-
 # if opt.doBands: make dataframe storing toy yields in each bin
 if opt.doBands:
   if opt.loadToyYields != '':
@@ -272,7 +263,6 @@ if opt.doBands:
 for cidx in range(len(cats)):
   c = cats[cidx]
   d = data_cats[c]
-  wd = wdata_cats[c]
   if c in opt.problematicCats.split(","): continue
   # If HH fix then set up which vars to use
   if( opt.doHHMjjFix )&( c in catsfix ):
@@ -288,13 +278,12 @@ for cidx in range(len(cats)):
   print "    * creating data histogram"
   h_data = _xvar.createHistogram("h_data_%s"%c, ROOT.RooFit.Binning(opt.nBins,xvar.getMin(),xvar.getMax()))
   h_data.SetBinErrorOption(ROOT.TH1.kPoisson)
-  if opt.unblind: d.fillHistogram(h_data,_xvar_arglist)
-  else: d.reduce("%s<%f|%s>%f"%(_xvar.GetName(),blindingRegion[0],_xvar.GetName(),blindingRegion[1])).fillHistogram(h_data,_xvar_arglist)
+  if not opt.unblind: d = d[(d<blindingRegion[0])|(d>blindingRegion[1])]
+  if len(d) > 0: h_data.FillN(len(d),d,np.ones(len(d)))
   if opt.doCatWeights:
     h_wdata = _xvar.createHistogram("h_wdata_%s"%c, ROOT.RooFit.Binning(opt.nBins,xvar.getMin(),xvar.getMax()))
     h_wdata.SetBinErrorOption(ROOT.TH1.kPoisson)
-    if opt.unblind: wd.fillHistogram(h_wdata,_xvar_arglist)
-    else: wd.reduce("%s<%f|%s>%f"%(_xvar.GetName(),blindingRegion[0],_xvar.GetName(),blindingRegion[1])).fillHistogram(h_wdata,_xvar_arglist)
+    if len(d) > 0: h_wdata.FillN(len(d),d,np.full(len(d),catsWeights[c]))
 
   # Scale data histogram
   h_data.Scale(opt.dataScaler)
@@ -1,6 +1,8 @@
 # Script to exrtract yields and some useful information for creating datacard
 # * Uses Pandas dataframe to store all proc x cat yields
 # * per category per dataframe
+# * --mergeYears: one signal process per production mode (year-merged models of signalFit.py --year combined),
+#   the yields of each year are kept in nominal_yield_<year> to merge the per-year systematics
 
 import os, sys
 import ROOT
@@ -10,9 +12,17 @@ import pandas as pd
 from glob import glob
 from argparse import ArgumentParser
 from collections import OrderedDict as od
-from commonObjects import yearsStr, sqrts__, swd__, bwd__, massBaseList, productionModes, decayMode, procToDatacardNameMap, outputWSName__, lumiMap, lumiScaleFactor, category__
+from commonObjects import yearsStr, mergedYear, sqrts__, swd__, bwd__, massBaseList, productionModes, decayMode, procToDatacardNameMap, outputWSName__, lumiMap, lumiScaleFactor, category__
 from commonTools import color
 
+def get_parser():
+    parser = ArgumentParser(description="Script to extract the yields for the datacards")
+    parser.add_argument("-pm",  "--parametricModel", help="Use the MH-dependent signal workspaces (signalFit.py --parametricModel)", default=False, action="store_true")
+    parser.add_argument("-my",  "--mergeYears",      help="Use the year-merged signal models (signalFit.py --year combined)",       default=False, action="store_true")
+
+    return parser
+
+
 def main(cat):
     print(color.GREEN + "Make yield dataframe for {}".format(cat) + color.END)
 
@@ -23,16 +33,20 @@ def main(cat):
     # FILL DATAFRAME: signal
     print("[INFO] Adding signal to dataFrame")
     mass_interp = np.linspace(massBaseList[0], massBaseList[-1], 11, endpoint=True).astype(int)
-    for year in yearsStr:
+    for year in ([mergedYear] if args.mergeYears else yearsStr):
         for mass in mass_interp:
             for proc in productionModes:
                 _procOriginal = proc
                 _proc = "{}_{}_{}".format(procToDatacardNameMap[proc], year, decayMode)
                 _cat = cat
 
-                sigWSDir = "{}/WS/Interpolation/{}".format(swd__, year)
-                _modelWSFile = "{}/CMS_HLLG_Interp_{}_{}_{}_{}.root".format(sigWSDir, mass, proc, year, cat)
-                _model = "{}:NewSigPdf".format(outputWSName__)
+                if args.parametricModel:
+                    _modelWSFile = "{}/WS/Parametric/CMS_HLLG_SigModel_{}_{}.root".format(swd__, year, cat)
+                    _model = "{}:NewSigPdf_{}".format(outputWSName__, proc)
+                else:
+                    sigWSDir = "{}/WS/Interpolation/{}".format(swd__, year)
+                    _modelWSFile = "{}/CMS_HLLG_Interp_{}_{}_{}_{}.root".format(sigWSDir, mass, proc, year, cat)
+                    _model = "{}:NewSigPdf".format(outputWSName__)
                 _rate = float(lumiMap[year]) * lumiScaleFactor
                 df_data.loc[len(df_data)] = [year, "sig", _procOriginal, _proc, _cat, mass, _modelWSFile, _model, _rate]
 
@@ -50,18 +64,36 @@ def main(cat):
 
     # Yields: for each signal row in dataFrame extract the yield
     # Loop over signal rows in dataFrame: extract yields (nominal & systematic variations)
+    # * each WS file is opened once (parametric model: one file for all processes and mass points)
     df_data["nominal_yield"] = "-"
-    for ir, r in df_data[df_data["type"] == "sig"].iterrows():
+    if args.mergeYears:
+        for year in yearsStr:
+            df_data["nominal_yield_{}".format(year)] = "-"
+    for modelWSFile, df_file in df_data[df_data["type"] == "sig"].groupby("modelWSFile", sort=False):
         # open input WS file and extract workspace
-        fin = ROOT.TFile.Open(r["modelWSFile"])
+        fin = ROOT.TFile.Open(modelWSFile)
         if not fin:
             sys.exit(1)
         inputWS = ROOT.RooWorkspace()
         fin.GetObject(outputWSName__, inputWS)
 
-        # Extract nominal yield
-        _yield = inputWS.var("ExpYield").getVal()
-        df_data.at[ir, "nominal_yield"] = _yield
+        # Extract nominal yield, the parametric model is evaluated at the mass point
+        for ir, r in df_file.iterrows():
+            if args.parametricModel:
+                inputWS.var("MH").setVal(float(r["mass"]))
+                _yield = inputWS.function("NewSigPdf_{}_norm".format(r["procOriginal"])).getVal()
+            else:
+                _yield = inputWS.var("ExpYield").getVal()
+            df_data.at[ir, "nominal_yield"] = _yield
+
+            # year-merged model: yields of each year
+            if args.mergeYears:
+                for year in yearsStr:
+                    if args.parametricModel:
+                        _yield = inputWS.function("NewSigPdf_{}_norm_{}".format(r["procOriginal"], year)).getVal()
+                    else:
+                        _yield = inputWS.var("ExpYield_{}".format(year)).getVal()
+                    df_data.at[ir, "nominal_yield_{}".format(year)] = _yield
 
         # Remove the workspace and file from heap
         inputWS.Delete()
@@ -76,6 +108,8 @@ def main(cat):
 
 
 if __name__ == "__main__":
+    parser = get_parser()
+    args = parser.parse_args()
 
     for _c in category__.keys():
         main(_c)
\ No newline at end of file
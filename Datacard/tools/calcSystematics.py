@@ -2,13 +2,51 @@ import sys
 import numpy as np
 import pandas as pd
 from collections import OrderedDict as od
-from commonObjects import swd__
+from commonObjects import swd__, yearsStr, mergedYear
 from glob import glob
 
 
 # sd = "systematics dataframe"
 
 
+# Year-merged signal processes (makeYields.py --mergeYears): the per-year systematics are merged with the yield fractions
+# f_year = nominal_yield_<year> / nominal_yield of the process
+# * lnN: kappa = 1 + sum_year f_year * (kappa_year - 1), years without a value count as 1 (uncorrelated: one year at a time)
+# * param (shape): width = sum_year f_year * width_year
+def yearFractions(_r):
+    total = float(_r["nominal_yield"])
+    return od([(y, float(_r["nominal_yield_{}".format(y)]) / total if total > 0 else 1. / len(yearsStr)) for y in yearsStr])
+
+
+# Function to merge per-year lnN values {year: kappa} of a row, asymmetric values "down/up" are merged side by side
+def mergeKappa(_kappas, _r):
+    fracs = yearFractions(_r)
+    sides = od([(y, [float(v) for v in str(k).split("/")]) for y, k in _kappas.items()])
+    nSides = max([len(v) for v in sides.values()])
+    merged = [1. + sum([fracs[y] * (v[min(i, len(v) - 1)] - 1.) for y, v in sides.items()]) for i in range(nSides)]
+    if nSides == 1:
+        return round(merged[0], 6)
+    return "/".join([str(round(m, 6)) for m in merged])
+
+
+# Function to select the year-merged signal rows, JEC/JER only for VBF and R9 only for R9 related categories
+def mergedRows(sd, _syst):
+    mask = (sd["type"] == "sig") & (sd["year"] == mergedYear)
+    if (_syst["name"] == "CMS_JEC_13TeV" or _syst["name"] == "CMS_JER_13TeV"):
+        mask &= sd["cat"].str.contains("VBF")
+    elif (_syst["name"] == "CMS_R9_13TeV"):
+        mask &= sd["cat"].str.contains("R9")
+    return mask
+
+
+# Function to fill the merged value of the per-year constant values {year: kappa} into column _col
+def addMergedConstant(sd, _syst, _col, _kappas):
+    mask = mergedRows(sd, _syst)
+    if mask.any():
+        sd.loc[mask, _col] = sd[mask].apply(lambda r: mergeKappa(_kappas, r), axis=1)
+    return sd
+
+
 # Add column to dataFrame with default value for constant systematics:
 # eg.
 #   1) "name":"QCDscale_VH", "value":"WH:1.005/0.993,ZH:1.038/0.969" -> {WH:1.005/0.993,ZH:1.038/0.969} (proc as key) -> store in valueDict
@@ -40,6 +78,9 @@ def addConstantSyst(sd, _syst):
             else:
                 sd.loc[(sd["type"] == "sig") & (year == sd["year"]), column_name] = v
 
+            # year-merged processes: share of the year
+            sd = addMergedConstant(sd, _syst, column_name, od([(year, v)]))
+
     elif _syst["correlateAcrossYears"] == 1:
         sd[_syst["name"]] = "-" # initial value
         for k, v in valueDict.iteritems():
@@ -47,6 +88,11 @@ def addConstantSyst(sd, _syst):
         for k, v in onevalueDict.iteritems():
             sd.loc[(sd["type"] == "sig"), k] = v
 
+        # year-merged processes: values per year are merged (values per process already match)
+        yearValues = od([(k, v) for k, v in valueDict.items() if k in yearsStr])
+        if len(yearValues) > 0:
+            sd = addMergedConstant(sd, _syst, _syst["name"], yearValues)
+
     else:
         sd[_syst["name"]] = "-"
         for year, v in valueDict.iteritems():
@@ -59,15 +105,22 @@ def addConstantSyst(sd, _syst):
 
             else:
                 sd.loc[(sd["type"] == "sig") & (sd["year"] == year), _syst["name"]] = v
+
+        # year-merged processes
+        yearValues = od([(k, v) for k, v in valueDict.items() if k in yearsStr])
+        if len(yearValues) > 0:
+            sd = addMergedConstant(sd, _syst, _syst["name"], yearValues)
     return sd
 
 
 def addFactorySyst(sd, _syst):
     # read in the shape uncertainties
     df_list = []
-    for year in sd["year"].unique():
-        if year == "merged":
-            continue
+    merged = (sd["type"] == "sig") & (sd["year"] == mergedYear)
+    shapeYears = [y for y in sd["year"].unique() if y not in ["merged", mergedYear]]
+    if merged.any():
+        shapeYears = sorted(set(shapeYears) | set(yearsStr))
+    for year in shapeYears:
         for cat in sd["cat"].unique():
             shape_file = ""
             if "resol" in _syst["name"]:
@@ -83,7 +136,7 @@ def addFactorySyst(sd, _syst):
     # fill shape uncertainties into systematics dataframe
     sd[_syst["name"]] = "-"
     for year in sd["year"].unique():
-        if year == "merged":
+        if year in ["merged", mergedYear]:
             continue
         for cat in sd["cat"].unique():
             for proc in sd["procOriginal"].unique():
@@ -100,15 +153,30 @@ def addFactorySyst(sd, _syst):
                     except:
                         print("Error: unknown col_name = {} or year = {} in shape uncertainties pkl".format(col_name, year))
                         sys.exit(1)
+
+    # year-merged processes: yield weighted width of the years
+    for ir, r in sd[merged].iterrows():
+        fracs = yearFractions(r)
+        value = 0.
+        for year in yearsStr:
+            col_name = "{}_{}_{}_{}_{}".format(_syst["name"], r["procOriginal"], r["mass"], r["cat"], year)
+            try:
+                idx = df.index[(df["factory"] == col_name) & (df["year"] == year)]
+                value += fracs[year] * df.iloc[idx]["value"].item()
+            except:
+                print("Error: unknown col_name = {} or year = {} in shape uncertainties pkl".format(col_name, year))
+                sys.exit(1)
+        sd.at[ir, _syst["name"]] = value
     return sd
 
 
 def addRateSyst(sd, _syst, _rate_df):
     # fill rate uncertainties into systematics dataframe
     # sd[_syst["name"]] = "-"
+    merged = (sd["type"] == "sig") & (sd["year"] == mergedYear)
     if _syst["correlateAcrossYears"] == 0:
         for year in sd["year"].unique():
-            if year == "merged":
+            if year in ["merged", mergedYear]:
                 continue
 
             col_name = "{}_{}".format(_syst["name"], year)
@@ -130,7 +198,7 @@ def addRateSyst(sd, _syst, _rate_df):
     if _syst["correlateAcrossYears"] == 1:
         sd[_syst["name"]] = "-"
         for year in sd["year"].unique():
-            if year == "merged":
+            if year in ["merged", mergedYear]:
                 continue
             for cat in sd["cat"].unique():
                 for proc in sd["procOriginal"].unique():
@@ -145,4 +213,19 @@ def addRateSyst(sd, _syst, _rate_df):
                         mask2 = (sd["year"] == year) & (sd["cat"] == cat) & (sd["procOriginal"] == proc) & (sd["mass"] == mass)
                         sd.loc[mask2, _syst["name"]] = 1+_rate_df.iloc[idx][_syst["title"]].item() # 1 means central value
 
+    # year-merged processes: rate variations of each year, merged with the yield fractions
+    for ir, r in sd[merged].iterrows():
+        kappas = od()
+        for year in yearsStr:
+            mask1 = (_rate_df["year"] == year) & (_rate_df["cat"] == r["cat"]) & (_rate_df["proc"] == r["procOriginal"]) & (_rate_df["mass"] == r["mass"])
+            kappas[year] = 1+_rate_df.iloc[_rate_df.index[mask1]][_syst["title"]].item()
+        if _syst["correlateAcrossYears"] == 0:
+            for year, k in kappas.items():
+                col_name = "{}_{}".format(_syst["name"], year)
+                if col_name not in sd.columns:
+                    sd[col_name] = "-"
+                sd.at[ir, col_name] = mergeKappa(od([(year, k)]), r)
+        if _syst["correlateAcrossYears"] == 1:
+            sd.at[ir, _syst["name"]] = mergeKappa(kappas, r)
+
     return sd
\ No newline at end of file
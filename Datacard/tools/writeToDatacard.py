@@ -3,13 +3,17 @@ import pandas as pd
 
 
 
+# _parametric: signal from the MH-dependent workspaces of signalFit.py --parametricModel
+# * the signal rate is 1, the normalisation is the NewSigPdf_<proc>_norm function of the workspace
+# * the shape nuisances have no mass in their names (CMS_<decay>_scale_<proc>_<cat>_<year>)
 class DCWriter:
-    def __init__(self, _foutName, _df, _cat, _mass, _years, _auto_space=False):
+    def __init__(self, _foutName, _df, _cat, _mass, _years, _auto_space=False, _parametric=False):
         self.fout   = open(_foutName, "w")  # output file
         self.df     = _df                   # yields dataframe
         self.cat    = _cat                  # category
         self.mass   = _mass                 # mass points
         self.years  = _years                # years
+        self.parametric = _parametric       # MH-dependent signal workspaces
 
         self.auto_space = _auto_space
         self.space0 = 9
@@ -76,6 +80,8 @@ class DCWriter:
             if r["nominal_yield"] == "-":
                 bkgrate = str(round(1.0, 1))
                 lrate += "{:<{sp2}}".format(bkgrate, sp2=self.space2)
+            elif self.parametric:
+                lrate += "{:<{sp2}}".format(str(round(1.0, 1)), sp2=self.space2)
             else:
                 sigrate = str(round(r["nominal_yield"], 7))
                 lrate += "{:<{sp2}}".format(sigrate, sp2=self.space2)
@@ -131,7 +137,10 @@ class DCWriter:
             for ir, r in self.df[self.df["cat"] == self.cat].iterrows():
                 if (r["mass"] != self.mass):
                     continue
-                col_name = "{}_{}_{}_{}_{}".format(s["name"], r["procOriginal"], r["mass"], self.cat, r["year"])
+                if self.parametric:
+                    col_name = "{}_{}_{}_{}".format(s["name"], r["procOriginal"], self.cat, r["year"])
+                else:
+                    col_name = "{}_{}_{}_{}_{}".format(s["name"], r["procOriginal"], r["mass"], self.cat, r["year"])
                 # self.fout.write("{0:{sp0}}{1:<7}{2:<5}{3:<12}\n".format(col_name, "param", str(1), str(round(r[s["name"]], 7)), sp0=self.space0+self.space1+self.space2))
                 self.fout.write("{0:{sp0}}{1:<7}{2:<5}{3:<12}\n".format(col_name, "param", str(1), str(round(r[s["name"]], 7)), sp0=self.space0+self.space1+self.space2))
         # if s["prior"] == "param":
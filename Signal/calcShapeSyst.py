@@ -16,7 +16,7 @@ import pandas as pd
 from sigmaEff import sigmaEff
 from argparse import ArgumentParser
 from commonObjects import productionModes, inputWSName__, swd__, massBaseList, decayMode
-from commonTools import color
+from commonTools import color, dataset_to_numpy
 
 def get_parser():
     parser = ArgumentParser(description="Script to calculate effect of the shape systematic uncertainties")
@@ -29,6 +29,39 @@ def get_parser():
     return parser
 
 
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+shape_variations = [
+    "PhoScaleStat",
+    "PhoScaleSyst",
+    "PhoScaleGain",
+    "PhoSigmaPhi",
+    "PhoSigmaRho",
+    "EleScaleStat",
+    "EleScaleSyst",
+    "EleScaleGain",
+    "EleSigmaPhi",
+    "EleSigmaRho",
+    "EleHDALScale",
+    "EleHDALSmear"
+]
+
+
+# Function to select the scale and resolution variations of a category
+def getShapeVariations(_cat):
+    shape_scale = []
+    shape_resol = []
+    for s in shape_variations:
+        if ("EleScale" in s or "EleSigma" in s) and "Merged" in _cat:
+            continue # reject officail calibration's variation
+        if ("EleHDAL" in s) and "Resolved" in _cat:
+            continue # reject dedicated calibration's variation
+        if "Scale" in s:
+            shape_scale.append(s)
+        elif ("Sigma" in s or "Smear" in s):
+            shape_resol.append(s)
+    return shape_scale, shape_resol
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Function to extact sets from WS
 def getDataSets(_ws, _nominalDataName, _sname):
@@ -76,7 +109,7 @@ def getMeanVar(_sets, _var):
 def getSigmaVar(_sets):
     sigma, sigmaVar = {}, {}
     for stype, s in _sets.iteritems():
-        arr = np.array([s.get(i).find("CMS_higgs_mass").getVal() for i in range(s.numEntries())])
+        arr = dataset_to_numpy(s, "CMS_higgs_mass", False)["CMS_higgs_mass"]
         xmin, xmax, sigma_eff = sigmaEff(arr)
         sigma[stype] = sigma_eff
     for stype in ["Up", "Do"]:
@@ -90,38 +123,10 @@ def getSigmaVar(_sets):
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 def main(mass):
-    shape_variations = [
-        "PhoScaleStat",
-        "PhoScaleSyst",
-        "PhoScaleGain",
-        "PhoSigmaPhi",
-        "PhoSigmaRho",
-        "EleScaleStat",
-        "EleScaleSyst",
-        "EleScaleGain",
-        "EleSigmaPhi",
-        "EleSigmaRho",
-        "EleHDALScale",
-        "EleHDALSmear"
-    ]
-
     # Define dataFrame
-    columns_data_scale = ["proc", "cat", "mass", "year", "inputWSFile", "nominalDataName"]
-    columns_data_resol = ["proc", "cat", "mass", "year", "inputWSFile", "nominalDataName"]
-    shape_scale = []
-    shape_resol = []
-    for s in shape_variations:
-        if ("EleScale" in s or "EleSigma" in s) and "Merged" in args.category:
-            continue # reject officail calibration's variation
-        if ("EleHDAL" in s) and "Resolved" in args.category:
-            continue # reject dedicated calibration's variation
-        for x in ["scale", "resol"]:
-            if (x == "scale" and "Scale" in s):
-                columns_data_scale.append(s)
-                shape_scale.append(s)
-            elif (x == "resol" and ("Sigma" in s or "Smear" in s)):
-                columns_data_resol.append(s)
-                shape_resol.append(s)
+    shape_scale, shape_resol = getShapeVariations(args.category)
+    columns_data_scale = ["proc", "cat", "mass", "year", "inputWSFile", "nominalDataName"] + shape_scale
+    columns_data_resol = ["proc", "cat", "mass", "year", "inputWSFile", "nominalDataName"] + shape_resol
     data_scale = pd.DataFrame(columns=columns_data_scale)
     data_resol = pd.DataFrame(columns=columns_data_resol)
 
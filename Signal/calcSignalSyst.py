@@ -0,0 +1,202 @@
+# Script to calculate the shape and rate systematics of the signal in a single pass
+# * Run script once per (category, year), loops over signal processes and mass points.
+# * Each workspace (or its columnar cache, see tree2ws.py --writeCache) is opened once, nominal and
+#   all Up/Do variations are extracted in bulk, and mean, sigmaEff and rate shifts are computed together.
+# * Outputs are the same pickle files as calcShapeSyst.py and calcYieldSyst.py:
+#   * syst/shape_syst_scale_<cat>_<year>.pkl, syst/shape_syst_resol_<cat>_<year>.pkl
+#   * syst/rate_syst_<cat>_<year>.pkl
+
+import os, sys
+sys.path.append("./tools")
+
+import ROOT
+import pickle
+import numpy as np
+import pandas as pd
+from sigmaEff import sigmaEff
+from argparse import ArgumentParser
+from collections import OrderedDict as od
+from calcShapeSyst import getShapeVariations
+from calcYieldSyst import rate_variations, getYield
+from commonObjects import productionModes, inputWSName__, swd__, massBaseList, decayMode
+from commonTools import dataset_to_numpy, load_cache, cache_dir, cache_variations
+
+
+def get_parser():
+    parser = ArgumentParser(description="Script to calculate the shape and rate systematic uncertainties in a single pass")
+    parser.add_argument("-c",   "--category",        help="RECO category",                                           default="",     type=str)
+    parser.add_argument("-y",   "--year",            help="year",                                                    default="",     type=str)
+    parser.add_argument("-i",   "--inputWSDir",      help="Input WS directory",                                      default="",     type=str)
+    parser.add_argument("-tm",  "--thresholdMean",   help="Reject mean variations if larger than thresholdMean",     default=0.05,   type=float)
+    parser.add_argument("-ts",  "--thresholdSigma",  help="Reject mean variations if larger than thresholdSigma",    default=0.5,    type=float)
+    parser.add_argument("-tr",  "--thresholdRate",   help="Reject mean variations if larger than thresholdRate",     default=0.5,    type=float)
+    parser.add_argument("-uc",  "--useCache",        help="Read the columnar cache written by tree2ws.py --writeCache instead of the WS", default=False, action="store_true")
+    parser.add_argument("-we",  "--weightedSigmaEff",help="Use the event weights in the effective sigma",           default=False,  action="store_true")
+
+    return parser
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Class to read the variations of one (proc, mass) signal sample once
+# * from the RooWorkspace of tree2ws.py (opened once) or from its columnar cache (memory-mapped)
+# * variations are named as in the datasets: "nominal", "PhoScaleStatUp", "puweiDo", ...
+class VariationReader:
+    def __init__(self, _WSFileName, _mass, _cat, _useCache=False):
+        self.WSFileName = _WSFileName
+        self.nominalDataName = "set_%s_%s" %(_mass, _cat)
+        self.cat = _cat
+        self.useCache = _useCache
+        self.arrays = {}
+
+        if self.useCache:
+            self.variations = cache_variations(self.WSFileName)
+            if len(self.variations) == 0:
+                print("Fail to get the cache %s" %(cache_dir(self.WSFileName)))
+                sys.exit(1)
+        else:
+            self.f = ROOT.TFile(self.WSFileName, "READ")
+            if self.f.IsZombie():
+                sys.exit(1)
+            self.ws = self.f.Get(inputWSName__)
+            if not self.ws:
+                print("Fail to get workspace %s" %(inputWSName__))
+                sys.exit(1)
+
+    def dataName(self, _variation):
+        if _variation == "nominal":
+            return self.nominalDataName
+        return "%s_%s" %(self.nominalDataName, _variation)
+
+    # Function to get the (mass, weight) arrays of a variation
+    def getArrays(self, _variation):
+        if _variation not in self.arrays:
+            if self.useCache:
+                if _variation not in self.variations:
+                    print("Fail to get variation %s from the cache %s" %(_variation, cache_dir(self.WSFileName)))
+                    sys.exit(1)
+                events = load_cache(self.WSFileName, _variation, self.cat)
+                self.arrays[_variation] = (events["CMS_higgs_mass"], events["weight"])
+            else:
+                rds = self.ws.data(self.dataName(_variation))
+                if not rds:
+                    print("Fail to get RooDataSet %s" %(self.dataName(_variation)))
+                    sys.exit(1)
+                columns = dataset_to_numpy(rds, "CMS_higgs_mass")
+                self.arrays[_variation] = (columns["CMS_higgs_mass"], columns["weight"])
+        return self.arrays[_variation]
+
+    # Function to get the yield of a variation (dataset or sum of the alternative weights)
+    def getYield(self, _variation):
+        if self.useCache:
+            if _variation in self.variations:
+                return self.getArrays(_variation)[1].sum()
+            nominal = load_cache(self.WSFileName, "nominal", self.cat)
+            if "weight_%s" %_variation not in nominal.dtype.names:
+                print("Fail to get variation %s from the cache %s" %(_variation, cache_dir(self.WSFileName)))
+                sys.exit(1)
+            return nominal["weight_%s" %_variation].sum()
+        return getYield(self.ws, self.dataName(_variation))
+
+    def close(self):
+        if not self.useCache:
+            self.f.Close()
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Function to average the relative Up/Do variations: (|Up - nominal| + |Do - nominal|) / 2 / nominal
+def getRelVar(_values, _threshold, _name):
+    relVar = {}
+    for stype in ["Up", "Do"]:
+        relVar[stype] = (_values[stype] - _values["nominal"]) / _values["nominal"]
+    x = np.float64((abs(relVar["Up"]) + abs(relVar["Do"])) / 2) # average
+    if (np.isnan(x)):
+        print("Get NaN %s variation" %_name)
+        sys.exit(1)
+    return min(x, _threshold)
+
+
+# Names of the Up/Do variations of a shape systematic
+# * for Smearing "PhiUp" and "PhiDown" are currently identical so you would have three templates, "RhoUp","RhoDown","PhiUp".
+def getShapeNames(_sname):
+    if "SigmaPhi" in _sname:
+        return od([("nominal", "nominal"), ("Up", "%sUp" %_sname), ("Do", "%sUp" %_sname)])
+    return od([("nominal", "nominal"), ("Up", "%sUp" %_sname), ("Do", "%sDo" %_sname)])
+
+
+def getMean(_arrays):
+    return np.average(_arrays[0], weights=_arrays[1])
+
+
+def getSigmaEff(_arrays):
+    if args.weightedSigmaEff:
+        return sigmaEff(_arrays[0], weights=_arrays[1])[2]
+    return sigmaEff(_arrays[0])[2]
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def main(mass):
+    shape_scale, shape_resol = getShapeVariations(args.category)
+    rows = []
+    for proc in productionModes:
+        print(" --> Processing ({proc:>4}, {cat}, {m}, {y:<5}) shape and rate uncertainties".format(proc=proc, cat=args.category, m=mass, y=args.year))
+        reader = VariationReader("%s/signal_%s_%s.root" %(args.inputWSDir, proc, mass), mass, args.category, args.useCache)
+
+        row = od([("proc", proc), ("cat", args.category), ("mass", mass), ("year", args.year)])
+        for s in shape_scale:
+            means = od([(stype, getMean(reader.getArrays(v))) for stype, v in getShapeNames(s).items()])
+            row[s] = getRelVar(means, args.thresholdMean, "mean")
+        for s in shape_resol:
+            sigmas = od([(stype, getSigmaEff(reader.getArrays(v))) for stype, v in getShapeNames(s).items()])
+            row[s] = getRelVar(sigmas, args.thresholdSigma, "sigma")
+        for s in rate_variations:
+            yields = od([("nominal", reader.getYield("nominal")), ("Up", reader.getYield("%sUp" %s)), ("Do", reader.getYield("%sDo" %s))])
+            row[s] = getRelVar(yields, args.thresholdRate, "rate")
+        reader.close()
+
+        # root of quadrature sum electron and photon
+        row["TotalScale"] = np.sqrt(np.sum(np.power([row[s] for s in shape_scale], 2)))
+        row["TotalResol"] = np.sqrt(np.sum(np.power([row[s] for s in shape_resol], 2)))
+        rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Function to save pickle files in the formats of calcShapeSyst.py and calcYieldSyst.py
+def savePickle(_df_data, _fname, _what):
+    if not os.path.exists("{}/syst".format(swd__)):
+        os.system("mkdir -p {}/syst".format(swd__))
+    with open("{}/syst/{}".format(swd__, _fname), "wb") as f:
+        pickle.dump(_df_data, f)
+    print(" --> Successfully saved {} systematics as pkl file: {}/syst/{}".format(_what, swd__, _fname))
+
+
+def calcFactory(df):
+    mass_interp = np.linspace(massBaseList[0], massBaseList[-1], 11, endpoint=True).astype(int)
+    df_shape = od([(shape, pd.DataFrame(columns=["proc", "cat", "mass", "year", "factory", "value"])) for shape in ["scale", "resol"]])
+    df_rate = pd.DataFrame(columns=["proc", "cat", "mass", "year"] + rate_variations)
+
+    for proc in df["proc"].unique():
+        df_proc = df[df["proc"] == proc].sort_values("mass")
+        masses = np.array(df_proc["mass"], dtype=float)
+        for shape, column in [("scale", "TotalScale"), ("resol", "TotalResol")]:
+            unc_interp = np.interp(mass_interp, masses, np.array(df_proc[column], dtype=float))
+            for i, _mp in enumerate(mass_interp):
+                factory_name = "CMS_{}_{}_{}_{}_{}_{}".format(decayMode, shape, proc, _mp, args.category, args.year)
+                df_shape[shape].loc[len(df_shape[shape])] = [proc, args.category, _mp, args.year, factory_name, unc_interp[i]]
+
+        unc_interp = od([(s, np.interp(mass_interp, masses, np.array(df_proc[s], dtype=float))) for s in rate_variations])
+        for i, _mp in enumerate(mass_interp):
+            df_rate.loc[len(df_rate)] = [proc, args.category, _mp, args.year] + [unc_interp[s][i] for s in rate_variations]
+
+    for shape, df_data in df_shape.items():
+        savePickle(df_data, "shape_syst_{}_{}_{}.pkl".format(shape, args.category, args.year), shape)
+    savePickle(df_rate, "rate_syst_{}_{}.pkl".format(args.category, args.year), "rate")
+
+
+if __name__ == "__main__" :
+    parser = get_parser()
+    args = parser.parse_args()
+
+    df_mass = pd.concat([main(_m) for _m in massBaseList], ignore_index=True, axis=0, sort=False)
+    calcFactory(df_mass)
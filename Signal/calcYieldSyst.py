@@ -21,37 +21,36 @@ def get_parser():
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-# Function to extact sets from WS
+# Function to extract the yield of one variation from WS
+# * the variation is either a RooDataSet or, for WS made with tree2ws.py --weightColumns,
+#   a per-category sum of weights stored as RooRealVar sumw_<mass>_<cat>_<syst>
+def getYield(_ws, _dataName):
+    rds = _ws.data(_dataName)
+    if rds:
+        return rds.sumEntries()
+    sumw = _ws.var(_dataName.replace("set_", "sumw_", 1))
+    if sumw:
+        return sumw.getVal()
+    print("Fail to get RooDataSet or sum of weights %s" %(_dataName))
+    sys.exit(1)
+
+
+# Function to extact yields from WS
 # ! FIXEDME: up->UP and do->Do for the same naming method
-def getDataSets(_ws, _nominalDataName, _sname):
-    # Define datasets
-    rds_nominal = _ws.data(_nominalDataName)
-    if (not rds_nominal):
-        print("Fail to get RooDataSet %s" %(_nominalDataName))
-        sys.exit(1)
-    rds_up = _ws.data("%s_%sUp" %(_nominalDataName, _sname))
-    if (not rds_up):
-        print("Fail to get RooDataSet %s_%sup" %(_nominalDataName, _sname))
-        sys.exit(1)
-    rds_do = _ws.data("%s_%sDo" %(_nominalDataName, _sname))
-    if (not rds_do):
-        print("Fail to get RooDataSet %s_%sdo" %(_nominalDataName, _sname))
-        sys.exit(1)
-    _sets = {}
-    _sets["nominal"] = rds_nominal
-    _sets["Up"] = rds_up
-    _sets["Do"] = rds_do
-    return _sets
+def getYields(_ws, _nominalDataName, _sname):
+    _yields = {}
+    _yields["nominal"] = getYield(_ws, _nominalDataName)
+    _yields["Up"] = getYield(_ws, "%s_%sUp" %(_nominalDataName, _sname))
+    _yields["Do"] = getYield(_ws, "%s_%sDo" %(_nominalDataName, _sname))
+    return _yields
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Functions to extract rate variations
-def getRateVar(_sets):
-    rate, rateVar = {}, {}
-    for stype, s in _sets.iteritems():
-        rate[stype] = s.sumEntries()
+def getRateVar(_yields):
+    rateVar = {}
     for stype in ["Up", "Do"]:
-        rateVar[stype] = (rate[stype] - rate["nominal"]) / rate["nominal"]
+        rateVar[stype] = (_yields[stype] - _yields["nominal"]) / _yields["nominal"]
     x = np.float64((abs(rateVar["Up"]) + abs(rateVar["Do"])) / 2) # average
     if (np.isnan(x)):
         print("Get NaN rate variation")
@@ -59,20 +58,20 @@ def getRateVar(_sets):
     return min(x, args.thresholdRate)
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-def main(mass):
-    global rate_variations
-    rate_variations = [
-        "puwei",
-        "l1pf",
-        "hlt",
-        "recoE",
-        "eleID",
-        "phoID",
-        "csev",
-        "JER",
-        "JEC"
-    ]
+rate_variations = [
+    "puwei",
+    "l1pf",
+    "hlt",
+    "recoE",
+    "eleID",
+    "phoID",
+    "csev",
+    "JER",
+    "JEC"
+]
+
 
+def main(mass):
     # Define dataFrame
     columns_data = ["proc", "cat", "mass", "year", "inputWSFile", "nominalDataName"]
     for s in rate_variations:
@@ -97,8 +96,8 @@ def main(mass):
             sys.exit(1)
         # Add values to dataFrame
         for s in rate_variations:
-            sets = getDataSets(inputWS, r["nominalDataName"], s)
-            _rateVar = getRateVar(sets)
+            yields = getYields(inputWS, r["nominalDataName"], s)
+            _rateVar = getRateVar(yields)
             data.at[ir, s] = _rateVar
         # close file
         f.Close()
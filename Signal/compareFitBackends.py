@@ -0,0 +1,83 @@
+# Script to validate the numpy fit backend (tools/dcbModel.py) against RooFit
+# * fits the same nominal datasets with both backends of simpleFit and compares parameters, errors, NLL and timing
+# * Run from Signal/, e.g. python compareFitBackends.py --category Resolved --year 2017 --inputWSDir ../Tree2WS/WS/2017
+
+import sys
+sys.path.append("./tools")
+
+import time
+import ROOT
+import numpy as np
+from simpleFit import simpleFit
+from dcbModel import dcbPars
+from argparse import ArgumentParser
+from collections import OrderedDict as od
+from commonObjects import inputWSName__, productionModes, massBaseList
+from commonTools import color, argset_to_dict, argset_errors_to_dict
+
+
+def get_parser():
+    parser = ArgumentParser(description="Script to compare the RooFit and numpy signal fit backends")
+    parser.add_argument("-c",   "--category",        help="RECO category",                                   default="",     type=str)
+    parser.add_argument("-y",   "--year",            help="Year",                                            default="",     type=str)
+    parser.add_argument("-i",   "--inputWSDir",      help="Input WS directory",                              default="",     type=str)
+    parser.add_argument("-p",   "--process",         help="Production mode (default: all)",                  default="all",  type=str)
+    parser.add_argument("-m",   "--mass",            help="Mass point (default: all)",                       default="all",  type=str)
+
+    return parser
+
+
+# Function to fit one dataset with one backend, returns ({par: value}, {par: error}, min NLL, wall time)
+def runBackend(_data, _xvar, _mass, _backend):
+    fit = simpleFit(_data, _xvar, _mass, 110, 170)
+    fit.buildDCB()
+    fit.setBackend(_backend)
+    start = time.time()
+    fres = fit.runFit()
+    elapsed = time.time() - start
+    return argset_to_dict(fres.floatParsFinal()), argset_errors_to_dict(fres.floatParsFinal()), fres.minNll(), elapsed
+
+
+def main():
+    procs = productionModes if args.process == "all" else [args.process]
+    masses = massBaseList if args.mass == "all" else [int(args.mass)]
+    timing = od([("roofit", 0.), ("numpy", 0.)])
+    maxPull = 0.
+
+    for proc in procs:
+        for mass in masses:
+            WSFileName = "%s/signal_%s_%d.root" %(args.inputWSDir, proc, mass)
+            f = ROOT.TFile(WSFileName)
+            if f.IsZombie():
+                sys.exit(1)
+            inputWS = f.Get(inputWSName__)
+            if not inputWS:
+                print("Fail to get workspace %s" %(inputWSName__))
+                sys.exit(1)
+            xvar = inputWS.var("CMS_higgs_mass")
+            data = inputWS.data("set_%d_%s"%(mass, args.category))
+
+            res = od([(b, runBackend(data, xvar, mass, b)) for b in timing.keys()])
+            for b in timing.keys():
+                timing[b] += res[b][3]
+
+            print(color.GREEN + "--> {} @ {}GeV, {} {}: {} events, sumw = {:.4f}".format(proc, mass, args.category, args.year, data.numEntries(), data.sumEntries()) + color.END)
+            print("  {:>10}  {:>24}  {:>24}  {:>10}".format("par", "roofit", "numpy", "diff/err"))
+            for p in dcbPars:
+                pull = (res["numpy"][0][p] - res["roofit"][0][p]) / res["roofit"][1][p] if res["roofit"][1][p] > 0 else 0.
+                maxPull = max(maxPull, abs(pull))
+                print("  {:>10}  {:11.5f} +/- {:8.5f}  {:11.5f} +/- {:8.5f}  {:10.3f}".format(
+                    p, res["roofit"][0][p], res["roofit"][1][p], res["numpy"][0][p], res["numpy"][1][p], pull))
+            print("  NLL: roofit {:.4f}, numpy {:.4f}; time: roofit {:.3f}s, numpy {:.3f}s".format(res["roofit"][2], res["numpy"][2], res["roofit"][3], res["numpy"][3]))
+            print("")
+            f.Close()
+
+    print(color.GREEN + "Total fit time: roofit {:.2f}s, numpy {:.2f}s (x{:.1f}), max |diff/err| = {:.3f}".format(
+        timing["roofit"], timing["numpy"], timing["roofit"] / max(timing["numpy"], 1e-9), maxPull) + color.END)
+
+
+if __name__ == "__main__" :
+    parser = get_parser()
+    args = parser.parse_args()
+
+    main()
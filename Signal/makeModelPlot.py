@@ -1,23 +1,31 @@
 # Script to draw the signal models
 # * draw the model per category, proc and mass point, combine all three years
+# * the models are sampled from their stored parameters (tools/dcbModel.py), no RooFit evaluation
+# * --batch: all categories (and processes) in one job, each signal workspace is read once per (year, proc, mass)
+#   and the plots are drawn by --nCPUs worker processes from the extracted arrays
 
 import sys, os
 sys.path.append("./tools")
 import ROOT
 import numpy as np
+from multiprocessing import Pool
 from argparse import ArgumentParser
 from collections import OrderedDict as od
 from CMS_lumi import CMS_lumi
 from sigmaEff import sigmaEff
-from commonObjects import inputWSName__, twd__, swd__, outputWSName__, yearsStr
+from commonObjects import inputWSName__, twd__, swd__, outputWSName__, yearsStr, category__, productionModes
+from dcbModel import sampleModel, fwhmModel
+from commonTools import dataset_to_numpy, argset_to_dict
 
 
 def get_parser():
     parser = ArgumentParser(description="Script to plot the final signal model")
-    parser.add_argument("-c",   "--category",  help="RECO category",                type=str)
-    parser.add_argument("-p",   "--process",   help="process",                      type=str)
-    parser.add_argument("-m",   "--mass",      help="mass point[120, 125, 130]",    default=125,  type=int)
-    parser.add_argument("-n",   "--nBins",     help="number of bins",               default=60,   type=int)
+    parser.add_argument("-c",   "--category",  help="RECO category (--batch: comma separated, default = all)",   type=str)
+    parser.add_argument("-p",   "--process",   help="process (--batch: comma separated, default = all)",         type=str)
+    parser.add_argument("-m",   "--mass",      help="mass point[120, 125, 130]",                                 default=125,    type=int)
+    parser.add_argument("-n",   "--nBins",     help="number of bins",                                            default=60,     type=int)
+    parser.add_argument("-b",   "--batch",     help="Draw all categories and processes in one job",              default=False,  action="store_true")
+    parser.add_argument("-nc",  "--nCPUs",     help="Number of worker processes drawing the plots (--batch)",    default=1,      type=int)
 
     return parser
 
@@ -32,7 +40,7 @@ def get_ws(fwname, wname):
     return inWS
 
 
-def plot_signal(hists, xmin, xmax, eff_sigma, outName, cat, process, offset=0.03):
+def plot_signal(hists, xmin, xmax, eff_sigma, fwhm, outName, cat, process, offset=0.03):
     ROOT.gStyle.SetPadTickX(1)
     ROOT.gStyle.SetPadTickY(1)
     ROOT.gStyle.SetOptStat(0)
@@ -88,9 +96,8 @@ def plot_signal(hists, xmin, xmax, eff_sigma, outName, cat, process, offset=0.03
     vline_effSigma_low.Draw("Same")
     vline_effSigma_high.Draw("Same")
 
-    # Extract FWHM and set style
-    fwhm_low = hists["pdf"].GetBinCenter(hists["pdf"].FindFirstBinAbove(0.5*hists["pdf"].GetMaximum()))
-    fwhm_high = hists["pdf"].GetBinCenter(hists["pdf"].FindLastBinAbove(0.5*hists["pdf"].GetMaximum()))
+    # FWHM and set style
+    fwhm_low, fwhm_high = fwhm
     fwhmArrow = ROOT.TArrow(fwhm_low, 0.5*hists["pdf"].GetMaximum(), fwhm_high,0.5*hists["pdf"].GetMaximum(), 0.02, "<>")
     fwhmArrow.SetLineWidth(2)
     fwhmArrow.Draw("Same <>")
@@ -165,70 +172,107 @@ def plot_signal(hists, xmin, xmax, eff_sigma, outName, cat, process, offset=0.03
     canv.Close()
 
 
-def main():
-    # container
-    hists, hpdfs, data = od(), od(), od()
-
-    # build data histogram
-    CMS_higgs_mass = ROOT.RooRealVar("CMS_higgs_mass", "CMS_higgs_mass", 110, 170, "GeV")
-    CMS_higgs_mass.setRange("NormRange", 110, 170)
-    CMS_higgs_mass.setMin(110)
-    CMS_higgs_mass.setMax(170)
-    hists["data"] = CMS_higgs_mass.createHistogram("h_data", ROOT.RooFit.Binning(args.nBins)) # create a empty histogram for dataset
+# Function to extract the inputs of one plot from the workspaces of one year
+# * dataset of the category as arrays (mass, weight) and the parameters of the final model
+def extract_inputs(_inputWSSet, _cat, _proc, _mass, _year):
+    data = _inputWSSet.data("set_{}_{}".format(_mass, _cat))
+    if not data:
+        print("[ERROR] No dataset set_{}_{} for {} {}".format(_mass, _cat, _proc, _year))
+        sys.exit(1)
+    arrays = dataset_to_numpy(data, "CMS_higgs_mass")
+
+    fpdfname = "{}/WS/Interpolation/{}/CMS_HLLG_Interp_{}_{}_{}_{}.root".format(swd__, _year, _mass, _proc, _year, _cat)
+    inputWSPdf = get_ws(fpdfname, outputWSName__)
+    pars = argset_to_dict(inputWSPdf.set("SigPdfParams"))
+    return arrays["CMS_higgs_mass"], arrays["weight"], pars
+
+
+# Function to collect the inputs of all plots, each signal workspace is opened once per (year, proc, mass)
+# * returns a list of plot tasks (cat, proc, mass, nBins, {year: (mass values, weights, model parameters)})
+def collect_tasks(_cats, _procs, _mass, _nBins):
+    inputs = od([((cat, proc), od()) for proc in _procs for cat in _cats])
+    for proc in _procs:
+        for year in yearsStr:
+            fsetname = "{}/WS/{}/signal_{}_{}.root".format(twd__, year, proc, _mass)
+            inputWSSet = get_ws(fsetname, inputWSName__)
+            for cat in _cats:
+                inputs[(cat, proc)][year] = extract_inputs(inputWSSet, cat, proc, _mass, year)
+    return [(cat, proc, _mass, _nBins, _inputs) for (cat, proc), _inputs in inputs.items()]
+
+
+# Function to draw one plot from its extracted inputs, see collect_tasks
+def make_plot(_task):
+    cat, proc, mass, nBins, inputs = _task
+    ROOT.TH1.AddDirectory(False)
+    xlo, xhi = 110., 170.
+
+    # data histogram
+    hists = od()
+    hists["data"] = ROOT.TH1D("h_data", "", nBins, xlo, xhi)
+
+    # model curves: sampled at the centres of the fine bins, normalised to the yield per bin of the data histogram
+    ScaleNumber = 20 # use to create smooth histogram
+    hists["pdf"] = ROOT.TH1D("h_pdf", "", nBins * ScaleNumber, xlo, xhi)
+    grid = np.array([hists["pdf"].GetBinCenter(i + 1) for i in range(hists["pdf"].GetNbinsX())])
+    binWidth = hists["data"].GetBinWidth(1)
+    curves = od()
 
     # datasets and eff_sigma
-    ScaleNumber = 400 # use to create smooth histogram
     xmin, xmax, eff_sigma = od(), od(), od()
-    vall = []
     for year in yearsStr:
-        # extract the dataset
-        fsetname = "{}/WS/{}/signal_{}_{}.root".format(twd__, year, args.process, args.mass)
-        inputWSSet = get_ws(fsetname, inputWSName__)
-        dname = "set_{}_{}".format(args.mass, args.category)
-        data[year] = inputWSSet.data(dname)
-        data[year].fillHistogram(hists["data"], ROOT.RooArgList(CMS_higgs_mass)) # fill the histogram for dataset
+        v, w, pars = inputs[year]
+        hists["data"].FillN(len(v), v, w)
 
         # calculate the effective sigma per year
-        v = []
-        for i in range(data[year].numEntries()):
-            ods_value = data[year].get(i).getRealValue(CMS_higgs_mass.GetName())
-            v.append(ods_value)
-            vall.append(ods_value)
-        xmin["{}".format(year)], xmax["{}".format(year)], eff_sigma["{}".format(year)] = sigmaEff(np.array(v))
-
-        # extract the final models per year
-        fpdfname = "{}/WS/Interpolation/{}/CMS_HLLG_Interp_{}_{}_{}_{}.root".format(swd__, year, args.mass, args.process, year, args.category)
-        inputWSPdf = get_ws(fpdfname, outputWSName__)
-        pdf = inputWSPdf.pdf("SigPdf")
-        hpdfs[year] = pdf.createHistogram("h_pdf_%s"%year, CMS_higgs_mass, ROOT.RooFit.Binning(args.nBins * ScaleNumber))
+        xmin[year], xmax[year], eff_sigma[year] = sigmaEff(v)
 
-    # calculate the effective sigma for 3 years
-    xmin["all"], xmax["all"], eff_sigma["all"] = sigmaEff(np.array(vall))
+        # sample the final models per year
+        curves[year] = np.sum(w) * binWidth * sampleModel(pars, grid, xlo, xhi)["total"]
 
-    # Sum pdf histograms
-    for k, p in hpdfs.iteritems():
-        if "pdf" not in hists:
-            hists["pdf"] = p.Clone("h_pdf")
-            hists["pdf"].Reset()
-        hists["pdf"] += p
-    hists["pdf"].Scale(hists["data"].Integral() * ScaleNumber / hists["pdf"].Integral())
+    # calculate the effective sigma for 3 years
+    xmin["all"], xmax["all"], eff_sigma["all"] = sigmaEff(np.concatenate([inputs[year][0] for year in yearsStr]))
 
-    # Per-year pdf histograms
+    # Per-year and combined pdf histograms, the combined model is the sum of the per-year models
     for year in yearsStr:
-        if "pdf_{}".format(year) not in hists:
-            hists["pdf_{}".format(year)] = hists["pdf"].Clone()
-            hists["pdf_{}".format(year)].Reset()
-        for i, p in hpdfs.iteritems():
-            if year == i:
-                hists["pdf_{}".format(year)] += p
-        hists["pdf_{}".format(year)].Scale(data[year].sumEntries() * ScaleNumber / hists["pdf_{}".format(year)].Integral())
+        hists["pdf_{}".format(year)] = hists["pdf"].Clone("h_pdf_{}".format(year))
+        hists["pdf_{}".format(year)].FillN(len(grid), grid, curves[year])
+    curves["all"] = np.sum([curves[year] for year in yearsStr], axis=0)
+    hists["pdf"].FillN(len(grid), grid, curves["all"])
+    fwhm = fwhmModel(grid, curves["all"])
 
     # draw the signal model
     outPlot = "{}/plots/final".format(swd__)
     if not os.path.exists(outPlot):
-        os.makedirs(outPlot)
-    outName = "{}/FinalModel_{}_{}_{}.pdf".format(outPlot, args.mass, args.category, args.process)
-    plot_signal(hists, xmin, xmax, eff_sigma, outName, args.category, args.process)
+        os.system("mkdir -p {}".format(outPlot))
+    outName = "{}/FinalModel_{}_{}_{}.pdf".format(outPlot, mass, cat, proc)
+    plot_signal(hists, xmin, xmax, eff_sigma, fwhm, outName, cat, proc)
+    return outName
+
+
+def main():
+    if args.batch:
+        cats = list(category__.keys()) if args.category in [None, "all"] else args.category.split(",")
+        procs = productionModes if args.process in [None, "all"] else args.process.split(",")
+    else:
+        if args.category is None or args.process is None:
+            print("[ERROR] --category and --process are required without --batch")
+            sys.exit(1)
+        cats, procs = [args.category], [args.process]
+
+    ROOT.gROOT.SetBatch(True)
+    tasks = collect_tasks(cats, procs, args.mass, args.nBins)
+    if len(tasks) == 1 or args.nCPUs <= 1:
+        for task in tasks:
+            make_plot(task)
+        return
+
+    # the workers only draw, the inputs are already extracted
+    print("INFO: Draw {} signal models using {} cores".format(len(tasks), args.nCPUs))
+    pool = Pool(args.nCPUs)
+    for outName in pool.imap_unordered(make_plot, tasks):
+        print(" --> Saved {}".format(outName))
+    pool.close()
+    pool.join()
 
 
 if __name__ == "__main__" :
@@ -236,4 +280,4 @@ if __name__ == "__main__" :
     parser = get_parser()
     args = parser.parse_args()
 
-    main()
\ No newline at end of file
+    main()
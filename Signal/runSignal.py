@@ -1,26 +1,81 @@
 import os
+import re
+from glob import glob
 from ROOT import gSystem
-from tqdm import tqdm
 from pprint import pprint
-from multiprocessing import Pool
 from argparse import ArgumentParser
 from collections import OrderedDict as od
-from commonTools import color
-from commonObjects import massBaseList, years, category__, twd__, productionModes
+from commonTools import color, entries_file, read_entries
+from jobScheduler import shell_job, run_jobs
+from commonObjects import massBaseList, years, category__, twd__, mergedYear
 
 
 def get_parser():
     parser = ArgumentParser(description="Script for submitting signal fitting jobs for finalfitslite")
-    parser.add_argument("-s",  "--script",          help="Which script to run. Options: [signalFit, makeModelPlot, calcShapeSyst, calcYieldSyst]",      default="",     type=str)
+    parser.add_argument("-s",  "--script",          help="Which script to run. Options: [signalFit, signalPlots, makeModelPlot, calcShapeSyst, calcYieldSyst, calcSignalSyst]", default="", type=str)
     parser.add_argument("-y",  "--year",            help="specify the year [2016, 2017, 2018, all], default = all",                                     default="all",  type=str)
     parser.add_argument("-n",  "--nCPUs",           help="Number of CPUs used to submit signal jobs(default: 10)",                                      default=10,     type=int)
     parser.add_argument("-ds", "--doSystematics",   help="Estimate the shape uncertainties (only for signalFit)",                                       default=False,  action="store_true")
+    parser.add_argument("-fb", "--fitBackend",      help="Fit backend [roofit, numpy] (only for signalFit)",                                            default="roofit", type=str)
+    parser.add_argument("-bm", "--batchMode",       help="RooFit vectorised batch evaluation (only for signalFit)",                                     default=False,  action="store_true")
+    parser.add_argument("-nc", "--fitNCPU",         help="Split the RooFit likelihood over N CPUs (only for signalFit)",                                default=1,      type=int)
+    parser.add_argument("-mn", "--minimizer",       help="RooFit minimizer [Minuit, Minuit2] (only for signalFit)",                                     default="Minuit", type=str)
+    parser.add_argument("-st", "--strategy",        help="RooFit minimizer strategy, -1: default (only for signalFit)",                                 default=-1,     type=int)
+    parser.add_argument("-sm", "--simultaneous",    help="Fit all mass points at once with MH-dependent DCB parameters (only for signalFit)",           default=False,  action="store_true")
+    parser.add_argument("-po", "--polOrder",        help="Polynomial order in MH of the simultaneous fit (only for signalFit)",                         default=1,      type=int)
+    parser.add_argument("-ns", "--noSeedCache",     help="Start all fits from the static parameter table (only for signalFit)",                         default=False,  action="store_true")
+    parser.add_argument("-nf", "--noFitCache",      help="Refit all datasets, do not use the stored fit results (only for signalFit)",                  default=False,  action="store_true")
+    parser.add_argument("-nw", "--nWorkers",        help="Processes per signalFit job fitting the (proc, mass) points (only for signalFit)",           default=1,      type=int)
+    parser.add_argument("-rf", "--resetFitCache",   help="Drop the stored fit results before fitting (only for signalFit)",                             default=False,  action="store_true")
+    parser.add_argument("-pm", "--parametricModel", help="One MH-dependent signal workspace per category and year (only for signalFit)",              default=False,  action="store_true")
+    parser.add_argument("-dp", "--deferPlots",      help="Save plotting artifacts instead of drawing, render with -s signalPlots (only for signalFit)",   default=False,  action="store_true")
+    parser.add_argument("-np", "--noPlots",         help="No plots nor plotting artifacts (only for signalFit)",                                        default=False,  action="store_true")
+    parser.add_argument("-my", "--mergeYears",      help="One year-merged model per category, fit of all years at once (only for signalFit, signalPlots)", default=False, action="store_true")
+    parser.add_argument("-ct", "--categories",      help="Comma separated categories to render, default = all (only for signalPlots)",                  default="all",  type=str)
+    parser.add_argument("-uc", "--useCache",        help="Read the columnar cache of tree2ws instead of the WS (only for calcSignalSyst)",              default=False,  action="store_true")
+    parser.add_argument("-we", "--weightedSigmaEff",help="Use the event weights in the effective sigma (only for calcSignalSyst)",                      default=False,  action="store_true")
 
     return parser
 
 
+# Function to run a command in a subprocess, a non-zero exit status fails the job
 def execute(cmd):
-    gSystem.Exec(cmd)
+    rc = gSystem.Exec(cmd)
+    if rc != 0:
+        raise RuntimeError("{} exited with {}".format(cmd, rc))
+
+
+# Kinds of dataset variations read by each script (see the entries sidecars written by tree2ws)
+stageVariations = {
+    "signalFit":      ["nominal"],
+    "signalPlots":    ["nominal"],
+    "makeModelPlot":  ["nominal"],
+    "calcShapeSyst":  ["nominal", "shape"],
+    "calcYieldSyst":  ["nominal", "weight"],
+    "calcSignalSyst": ["nominal", "weight", "shape"],
+}
+
+
+# Function to list the Tree2WS signal workspaces of some years
+def signal_workspaces(_years):
+    return sum([glob("{}/WS/{}/signal_*.root".format(twd__, y)) for y in _years], [])
+
+
+# Function to get the input size of a job: entries of the datasets it reads
+# * entries of its category (all categories without a category) summed over the procs and masses of its year
+#   (all years without a year or for the year-merged model) and over the variations read by the script
+def input_size(cmd):
+    match = re.search(r"--year (\S+)", cmd)
+    _years = [match.group(1)] if match and match.group(1) != mergedYear else [str(y) for y in years]
+    match = re.search(r"--category (\S+)", cmd)
+    cats = [match.group(1)] if match else list(category__.keys())
+    size = 0
+    for fname in signal_workspaces(_years):
+        entries = read_entries(fname)
+        for kind in stageVariations[script]:
+            for catEntries in entries.get(kind, {}).values():
+                size += sum([catEntries.get(cat, 0) for cat in cats])
+    return size
 
 
 def main():
@@ -51,34 +106,74 @@ def main():
             else:
                 queue.append("python calcYieldSyst.py --category {} --inputWSDir {} --year {} &> ./logger/calcYieldSyst_{}_{}.txt".format(cat, inWS[i], years[i], cat, years[i]))
 
+    if script == "calcSignalSyst":
+        opts = ""
+        if args.useCache:
+            opts += " --useCache"
+        if args.weightedSigmaEff:
+            opts += " --weightedSigmaEff"
+        for cat in category__.keys():
+            for _y in (years if year == "all" else [year]):
+                queue.append("python calcSignalSyst.py --category {} --inputWSDir {}/WS/{} --year {}{} &> ./logger/calcSignalSyst_{}_{}.txt".format(cat, twd__, _y, _y, opts, cat, _y))
+
     if script == "signalFit":
+        opts = " --doInterpolation"
+        if doSystematics:
+            opts += " --doSystematics"
+        if args.fitBackend != "roofit":
+            opts += " --fitBackend {}".format(args.fitBackend)
+        if args.batchMode:
+            opts += " --batchMode"
+        if args.fitNCPU > 1:
+            opts += " --fitNCPU {}".format(args.fitNCPU)
+        if args.minimizer != "Minuit":
+            opts += " --minimizer {}".format(args.minimizer)
+        if args.strategy >= 0:
+            opts += " --strategy {}".format(args.strategy)
+        if args.simultaneous:
+            opts += " --simultaneous --polOrder {}".format(args.polOrder)
+        if args.noSeedCache:
+            opts += " --noSeedCache"
+        if args.parametricModel:
+            opts += " --parametricModel"
+        if args.noFitCache:
+            opts += " --noFitCache"
+        if args.deferPlots:
+            opts += " --deferPlots"
+        if args.noPlots:
+            opts += " --noPlots"
+        if args.resetFitCache:
+            opts += " --resetFitCache"
+        if args.nWorkers > 1:
+            opts += " --nWorkers {}".format(args.nWorkers)
         for cat in category__.keys():
-            if year == "all":
+            if args.mergeYears:
+                queue.append("python signalFit.py --category {} --year {} --inputWSDir {}/WS{} &> ./logger/signalFit_{}_{}.txt".format(cat, mergedYear, twd__, opts, cat, mergedYear))
+            elif year == "all":
                 for i in range(len(years)):
-                    if doSystematics:
-                        queue.append("python signalFit.py --category {} --year {} --inputWSDir {} --doInterpolation --doSystematics &> ./logger/signalFit_{}_{}.txt".format(cat, years[i], inWS[i], cat, years[i]))
-                    else:
-                        queue.append("python signalFit.py --category {} --year {} --inputWSDir {} --doInterpolation &> ./logger/signalFit_{}_{}.txt".format(cat, years[i], inWS[i], cat, years[i]))
+                    queue.append("python signalFit.py --category {} --year {} --inputWSDir {}{} &> ./logger/signalFit_{}_{}.txt".format(cat, years[i], inWS[i], opts, cat, years[i]))
             else:
-                if doSystematics:
-                    queue.append("python signalFit.py --category {} --year {} --inputWSDir {} --doInterpolation --doSystematics &> ./logger/signalFit_{}_{}.txt".format(cat, year, inWS, cat, year))
-                else:
-                    queue.append("python signalFit.py --category {} --year {} --inputWSDir {} --doInterpolation &> ./logger/signalFit_{}_{}.txt".format(cat, year, inWS, cat, year))
+                queue.append("python signalFit.py --category {} --year {} --inputWSDir {}{} &> ./logger/signalFit_{}_{}.txt".format(cat, year, inWS, opts, cat, year))
+
+    if script == "signalPlots":
+        cats = category__.keys() if args.categories == "all" else args.categories.split(",")
+        for cat in cats:
+            for _y in ([mergedYear] if args.mergeYears else years if year == "all" else [year]):
+                queue.append("python signalFit.py --plots --category {} --year {} &> ./logger/signalPlots_{}_{}.txt".format(cat, _y, cat, _y))
 
     if script == "makeModelPlot":
-        for cat in category__.keys():
-            for proc in productionModes:
-                queue.append("python makeModelPlot.py --category {} --process {} &> ./logger/makeModelPlot_{}_{}.txt".format(cat, proc, cat, proc))
+        # one job: the workspaces are read once and the plots are drawn by n workers
+        queue.append("python makeModelPlot.py --batch --nCPUs {} &> ./logger/makeModelPlot.txt".format(n))
 
     print(color.GREEN + "Executing the following commands using {} cores".format(n) + color.END)
     pprint(queue)
 
-    # submit the process
-    pool = Pool(n)
-    for i in tqdm(pool.imap_unordered(execute, queue), total=len(queue)):
-        pass
-    pool.close()
-    pool.join()
+    missing = [f for f in signal_workspaces([str(y) for y in years]) if not os.path.exists(entries_file(f))]
+    if len(missing) > 0:
+        print(color.YELLOW + "[WARNING] No entries sidecar for {} workspaces (rerun runTree2WS.py), the job costs ignore them".format(len(missing)) + color.END)
+
+    # submit the process: longest first from the wall times of the previous runs
+    run_jobs("runSignal_{}".format(script), [shell_job(cmd, input_size(cmd)) for cmd in queue], execute, n)
 
 
 
@@ -91,7 +186,7 @@ if __name__ == "__main__" :
     doSystematics   = args.doSystematics
     n               = args.nCPUs
 
-    if script not in ["signalFit", "makeModelPlot", "calcShapeSyst", "calcYieldSyst"]:
+    if script not in ["signalFit", "signalPlots", "makeModelPlot", "calcShapeSyst", "calcYieldSyst", "calcSignalSyst"]:
         parser.print_help()
         gSystem.Exit(1)
 
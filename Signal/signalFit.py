@@ -1,80 +1,339 @@
 # Script to perform the signal fit
 # * Run script once per category per year, loops over signal processes and mass points(120, 125, 130)
+# * --year combined: one fit of the concatenated datasets of all years, --inputWSDir is then the directory of the per-year WS dirs
 
-import sys
+import os, sys
 sys.path.append("./tools")
 
 import ROOT
-from simpleFit import simpleFit
+import pickle
+import pandas as pd
+from multiprocessing import Pool
+from simpleFit import simpleFit, fitSimultaneous
 from Interpolation import Interpolator
+from fitCache import SeedCache, FitCache, fit_fingerprint, to_table, refMass
+from plotArtifacts import save_artifact, load_artifacts, render
 from argparse import ArgumentParser
 from collections import OrderedDict as od
-from commonObjects import inputWSName__, productionModes, swd__, massBaseList, outputWSName__
-from commonTools import color
+from commonObjects import inputWSName__, productionModes, swd__, massBaseList, outputWSName__, yearsStr, mergedYear
+from commonTools import color, argset_to_dict
 
 
 def get_parser():
     parser = ArgumentParser(description="Script to perform the signal fit")
     parser.add_argument("-c",   "--category",        help="RECO category",                                   default="",     type=str)
-    parser.add_argument("-y",   "--year",            help="Year",                                            default="",     type=str)
-    parser.add_argument("-i",   "--inputWSDir",      help="Input WS directory",                              default="",     type=str)
+    parser.add_argument("-y",   "--year",            help="Year, combined: fit the datasets of all years at once", default="", type=str)
+    parser.add_argument("-i",   "--inputWSDir",      help="Input WS directory (--year combined: parent of the year directories)", default="", type=str)
     parser.add_argument("-ds",  "--doSystematics",   help="Estimate the shape uncertainties",                default=False,  action="store_true")
     parser.add_argument("-di",  "--doInterpolation", help="Do the interpolation(intermediate signal model)", default=False,  action="store_true")
+    parser.add_argument("-fb",  "--fitBackend",      help="Fit backend [roofit, numpy]",                     default="roofit", type=str)
+    parser.add_argument("-bm",  "--batchMode",       help="RooFit backend: vectorised batch evaluation",     default=False,  action="store_true")
+    parser.add_argument("-nc",  "--fitNCPU",         help="RooFit backend: split the likelihood over N CPUs",default=1,      type=int)
+    parser.add_argument("-mn",  "--minimizer",       help="RooFit backend: minimizer [Minuit, Minuit2]",     default="Minuit", type=str)
+    parser.add_argument("-st",  "--strategy",        help="RooFit backend: minimizer strategy (-1: default)",default=-1,     type=int)
+    parser.add_argument("-sm",  "--simultaneous",    help="Fit all mass points at once, DCB parameters polynomial in MH (numpy)", default=False, action="store_true")
+    parser.add_argument("-po",  "--polOrder",        help="Simultaneous fit: polynomial order of the parameters in MH", default=1, type=int)
+    parser.add_argument("-ns",  "--noSeedCache",     help="Start all fits from the static parameter table",  default=False,  action="store_true")
+    parser.add_argument("-nf",  "--noFitCache",      help="Do not reuse (nor store) the results of unchanged fits", default=False, action="store_true")
+    parser.add_argument("-pm",  "--parametricModel", help="Save one MH-dependent workspace per category and year instead of one file per mass point", default=False, action="store_true")
+    parser.add_argument("-dp",  "--deferPlots",      help="Save plotting artifacts instead of drawing, see --plots", default=False, action="store_true")
+    parser.add_argument("-np",  "--noPlots",         help="No plots nor plotting artifacts",                 default=False,  action="store_true")
+    parser.add_argument("-pl",  "--plots",           help="Only render the plotting artifacts of --deferPlots", default=False, action="store_true")
+    parser.add_argument("-nw",  "--nWorkers",        help="Fit the (proc, mass) points with N processes (not with --simultaneous)", default=1, type=int)
+    parser.add_argument("-rf",  "--resetFitCache",   help="Drop the stored fit results of the category and year before fitting", default=False, action="store_true")
 
     return parser
 
 
+# Function to save the fit summary (backend, wall time, status) of the category and year
+def saveFitSummary(_summary):
+    outDir = "{}/fitSummary".format(swd__)
+    if not os.path.exists(outDir):
+        os.system("mkdir -p {}".format(outDir))
+    fname = "{}/fitSummary_{}_{}.pkl".format(outDir, args.category, args.year)
+    with open(fname, "wb") as f:
+        pickle.dump(pd.DataFrame(_summary), f)
+    print(" --> Successfully saved the fit summary as pkl file: {}".format(fname))
+
+
+# Function to open the workspace of a (proc, mass) signal sample, returns (TFile, dataset, mass variable)
+def openWS(_proc, _mass, _inputWSDir):
+    WSFileName = "%s/signal_%s_%d.root" %(_inputWSDir, _proc, _mass)
+    f = ROOT.TFile(WSFileName)
+    if f.IsZombie():
+        sys.exit(1)
+    inputWS = f.Get(inputWSName__)
+    if not inputWS:
+        print("Fail to get workspace %s" %(inputWSName__))
+        sys.exit(1)
+
+    # Get dataset and var from workspace
+    nominalDataName = "set_%d_%s"%(_mass, args.category)
+    xvar = inputWS.var("CMS_higgs_mass")
+    data = inputWS.data(nominalDataName)
+    return f, data, xvar
+
+
+# Function to open the input of a (proc, mass) fit, returns ([TFile], dataset, mass variable, {year: yield})
+# * --year combined: the datasets of all years are concatenated, the files stay open until the fit is done
+def openInputs(_proc, _mass):
+    if args.year != mergedYear:
+        f, data, xvar = openWS(_proc, _mass, args.inputWSDir)
+        return [f], data, xvar, od([(args.year, data.sumEntries())])
+
+    files, yearYields, data = [], od(), None
+    for year in yearsStr:
+        f, yearData, xvar = openWS(_proc, _mass, "{}/{}".format(args.inputWSDir, year))
+        files.append(f)
+        yearYields[year] = yearData.sumEntries()
+        if data is None:
+            data = yearData.Clone("set_{}_{}_{}".format(_mass, args.category, mergedYear))
+        else:
+            data.append(yearData)
+    return files, data, xvar, yearYields
+
+
+# Function to get the seed of a (proc, mass) fit, returns ({par: value}, source), (None, None) without the seed cache
+def getSeed(_seeds, _proc, _mass):
+    if _seeds is None:
+        return None, None
+    return _seeds.get(_proc, _mass)
+
+
+# Function to seed a fit from the parameters of previous converged fits (before building the pdf)
+def seedFit(_fit, _seed, _source, _proc, _mass):
+    if _source is None:
+        return
+    if _seed is None:
+        print("INFO: no fit seed for {} @ {}GeV, start from the static parameter table".format(_proc, _mass))
+        return
+    print("INFO: seed the fit of {} @ {}GeV from {}".format(_proc, _mass, _source))
+    _fit.setSeeds(_seed)
+
+
+# Function to store the parameters of a converged fit as seed of the following fits
+def storeSeed(_seeds, _proc, _mass, _fres):
+    if _seeds is None or _fres.status() != 0:
+        return
+    _seeds.update(_proc, _mass, argset_to_dict(_fres.floatParsFinal()))
+
+
+# Function to draw a plotting artifact, save it (--deferPlots) or skip it (--noPlots)
+def drawArtifact(_artifact):
+    if _artifact is None:
+        return
+    if args.deferPlots:
+        save_artifact(_artifact)
+    else:
+        render(_artifact)
+
+
+# Function to draw a plot (simpleFit or Interpolator), save its artifact (--deferPlots) or skip it (--noPlots)
+def makePlot(_obj, *_args):
+    if args.noPlots:
+        return
+    drawArtifact(_obj.plotArtifact(*_args))
+
+
+# Function to render the plotting artifacts of the category and year (--plots)
+def renderPlots():
+    artifacts = load_artifacts(args.year, args.category)
+    if len(artifacts) == 0:
+        print("Error: no plotting artifacts of {} {}, run with --deferPlots first".format(args.category, args.year))
+        sys.exit(1)
+    for artifact in artifacts:
+        render(artifact)
+    print(" --> Successfully rendered {} plots of {} {}".format(len(artifacts), args.category, args.year))
+
+
+# Function to collect the output of the fit of one mass point: plain python content, sent back by the workers of --nWorkers
+def fitOutput(_fit, _proc, _mass, _yearYields, _key=None):
+    outName = "{}/plots/signalFit/{}/CMS_HLLG_sigfit_{}_{}_{}_{}.pdf".format(swd__, args.year, _mass, _proc, args.year, args.category)
+    return od([
+        ("proc", _proc), ("mass", _mass), ("fitres", to_table(_fit.FitResults)), ("yield", _fit.data.sumEntries()),
+        ("yearYields", _yearYields), ("key", _key), ("backend", _fit.backendLabel()), ("fitTime", _fit.fitTime),
+        ("cached", _fit.fromCache),
+        ("artifact", None if args.noPlots else _fit.plotArtifact(args.year, "M_{ee#gamma} [GeV]", args.category, _proc, outName))
+    ])
+
+
+# Function to fit one mass point of a process, run in the main process or by the workers of --nWorkers
+# * _task: (proc, mass, seed, seed source, FitCache or None), the caches are only read here, see collectFit
+def fitMassPoint(_task):
+    proc, mass, seed, source, cache = _task
+    print(color.GREEN + "--> Performing the nominal signal fitting of {} @ {}GeV".format(proc, mass) + color.END)
+    # Open ROOT file and extract workspace
+    files, data, xvar, yearYields = openInputs(proc, mass)
+
+    # FIT: unbinned ML fit
+    fit = simpleFit(data, xvar, mass, 110, 170)
+    # fit.buildDCBplusGaussian()
+    fit.buildDCB()
+    fit.setBackend(args.fitBackend)
+    fit.setRooFitOptions(args.batchMode, args.fitNCPU, args.minimizer, args.strategy)
+
+    # unchanged dataset, pdf and options: reuse the stored result instead of minimising
+    key = None if cache is None else fit_fingerprint(fit)
+    cached = None if cache is None else cache.get(key)
+    if cached is not None:
+        print("INFO: reuse the stored fit result of {} @ {}GeV".format(proc, mass))
+        fit.setFitResult(cached)
+        fit.fromCache = True
+    else:
+        seedFit(fit, seed, source, proc, mass)
+        fit.runFit()
+    output = fitOutput(fit, proc, mass, yearYields, key)
+
+    # Close the input workspace file
+    for f in files:
+        f.Close()
+    return output
+
+
+# Function to store, print, summarise and draw the fit of one mass point (in the main process)
+def collectFit(_output, _seeds, _cache, _summary):
+    proc, mass, fres = _output["proc"], _output["mass"], _output["fitres"]
+    if _cache is not None and not _output["cached"] and fres.status() == 0:
+        _cache.update(_output["key"], proc, mass, fres)
+    storeSeed(_seeds, proc, mass, fres)
+
+    fres.Print()
+    print("INFO: {} fit of {} @ {}GeV in {:.2f}s".format(_output["backend"], proc, mass, _output["fitTime"]))
+    _summary.append(od([("proc", proc), ("mass", mass), ("cat", args.category), ("year", args.year), ("backend", _output["backend"]),
+                        ("fitTime", _output["fitTime"]), ("status", fres.status()), ("minNll", fres.minNll()),
+                        ("cached", _output["cached"])]))
+
+    # VISUALIZATION: draw the fitting
+    drawArtifact(_output["artifact"])
+    print("")
+
+
+# Function to get the size of the input files of a (proc, mass) fit, used to order the fits
+def inputSize(_proc, _mass):
+    dirs = ["{}/{}".format(args.inputWSDir, y) for y in yearsStr] if args.year == mergedYear else [args.inputWSDir]
+    fnames = ["%s/signal_%s_%d.root" %(d, _proc, _mass) for d in dirs]
+    return sum([os.path.getsize(f) for f in fnames if os.path.exists(f)])
+
+
+# Function to fit all (proc, mass) points with --nWorkers processes, returns {proc: {mass: fit output}}
+# * two waves: the 125GeV fits, then the other mass points seeded from them
+# * largest inputs first in each wave (longest fits first, the short ones fill the gaps at the end)
+# * the workers only fit, the seed and fit caches are updated here
+def runParallelFits(_seeds, _cache, _summary):
+    outputs = od([(proc, od()) for proc in productionModes])
+    waves = [[refMass], [m for m in massBaseList if m != refMass]]
+    pool = Pool(args.nWorkers)
+    for wave in waves:
+        points = sorted([(proc, mass) for proc in productionModes for mass in wave], key=lambda pm: inputSize(*pm), reverse=True)
+        tasks = [(proc, mass) + tuple(getSeed(_seeds, proc, mass)) + (_cache,) for proc, mass in points]
+        print("INFO: Fit {} mass points with {} workers".format(len(tasks), args.nWorkers))
+        for output in pool.imap_unordered(fitMassPoint, tasks, 1):
+            collectFit(output, _seeds, _cache, _summary)
+            outputs[output["proc"]][output["mass"]] = output
+    pool.close()
+    pool.join()
+    return outputs
+
+
+# Function to save the MH-dependent signal models of all processes (one file per category and year)
+def saveParametricModel(_ws):
+    outWSDir = "{}/WS/Parametric".format(swd__)
+    if not os.path.exists(outWSDir):
+        os.system("mkdir -p {}".format(outWSDir))
+    outWSName = "{}/CMS_HLLG_SigModel_{}_{}.root".format(outWSDir, args.year, args.category)
+    print("INFO: Save the MH-dependent signal models in {}".format(outWSName))
+    fws = ROOT.TFile(outWSName, "RECREATE")
+    fws.cd()
+    _ws.Write()
+    fws.Close()
+
+
 def main():
-    for proc in productionModes:
-        yields, fitres = od(), od()
-        for mass in massBaseList:
-            print(color.GREEN + "--> Performing the nominal signal fitting of {} @ {}GeV".format(proc, mass) + color.END)
-            # Open ROOT file and extract workspace
-            WSFileName = "%s/signal_%s_%d.root" %(args.inputWSDir, proc, mass)
-            f = ROOT.TFile(WSFileName)
-            if f.IsZombie():
-                sys.exit(1)
-            inputWS = f.Get(inputWSName__)
-            if not inputWS:
-                print("Fail to get workspace %s" %(inputWSName__))
-                sys.exit(1)
-
-            # Get dataset and var from workspace
-            nominalDataName = "set_%d_%s"%(mass, args.category)
-            xvar = inputWS.var("CMS_higgs_mass")
-            data = inputWS.data(nominalDataName)
-
-            # FIT: unbinned ML fit
-            fit = simpleFit(data, xvar, mass, 110, 170)
-            # fit.buildDCBplusGaussian()
-            fit.buildDCB()
-            fitres[mass] = fit.runFit()
-            fitres[mass].Print()
-            yields[mass] = data.sumEntries()
+    if args.plots:
+        renderPlots()
+        return
 
-            # VISUALIZATION: draw the fitting
-            outName = "{}/plots/signalFit/{}/CMS_HLLG_sigfit_{}_{}_{}_{}.pdf".format(swd__, args.year, mass, proc, args.year, args.category)
-            fit.visualize(args.year, "M_{ee#gamma} [GeV]", args.category, proc, outName)
+    if args.parametricModel and not args.doInterpolation:
+        print("Error: --parametricModel is built from the interpolation, use it with --doInterpolation")
+        sys.exit(1)
+
+    # MH-dependent signal models of all processes are collected in one workspace
+    if args.parametricModel:
+        paramWS = ROOT.RooWorkspace(outputWSName__, outputWSName__)
+        MH = ROOT.RooRealVar("MH", "MH", refMass, massBaseList[0], massBaseList[-1])
+        MH.setConstant(True)
+
+    summary = []
+    seeds = None if args.noSeedCache else SeedCache(args.category, args.year)
+    cache = None if args.noFitCache else FitCache(args.category, args.year, _reset=args.resetFitCache)
+    outputs, models = od([(proc, od()) for proc in productionModes]), od()
+    if args.simultaneous:
+        for proc in productionModes:
+            # FIT: one unbinned ML fit to the datasets of all mass points, the files stay open until the fit is drawn
+            print(color.GREEN + "--> Performing the simultaneous signal fitting of {} @ {}GeV (pol{})".format(proc, massBaseList, args.polOrder) + color.END)
+            files, fits, yearYields = od(), od(), od()
+            for mass in massBaseList:
+                files[mass], data, xvar, yearYields[mass] = openInputs(proc, mass)
+                fits[mass] = simpleFit(data, xvar, mass, 110, 170)
+                fits[mass].buildDCB()
+                seed, source = getSeed(seeds, proc, mass)
+                seedFit(fits[mass], seed, source, proc, mass)
+            models[proc] = fitSimultaneous(fits, args.polOrder)
+            models[proc].Print()
 
-            # Close the input workspace file
-            f.Close()
-            print("")
+            for mass in massBaseList:
+                outputs[proc][mass] = fitOutput(fits[mass], proc, mass, yearYields[mass])
+                for f in files[mass]:
+                    f.Close()
+                collectFit(outputs[proc][mass], seeds, None, summary)
+
+    elif args.nWorkers > 1:
+        outputs = runParallelFits(seeds, cache, summary)
+
+    else:
+        # the 125GeV fit goes first and seeds 120 and 130GeV
+        fitOrder = sorted(massBaseList, key=lambda m: m != refMass)
+        for proc in productionModes:
+            for mass in fitOrder:
+                seed, source = getSeed(seeds, proc, mass)
+                outputs[proc][mass] = fitMassPoint((proc, mass, seed, source, cache))
+                collectFit(outputs[proc][mass], seeds, cache, summary)
+
+    for proc in productionModes:
+        # the Interpolator expects increasing mass points
+        masses = sorted(outputs[proc].keys())
+        fitres = od([(m, outputs[proc][m]["fitres"]) for m in masses])
+        yields = od([(m, outputs[proc][m]["yield"]) for m in masses])
+        yearYields = od([(m, outputs[proc][m]["yearYields"]) for m in masses])
 
         if args.doInterpolation:
             # INTERPOLATRION: The signal models are gotten from the interpolation of the fittings pdfs @ 120, 125 and 130 GeV
+            # (or evaluated from the mass-parametrised model of the simultaneous fit)
             # specify save=True to save the final signal models
             outWSDir = "{}/WS/Interpolation/{}".format(swd__, args.year)
-            interp = Interpolator(yields, fitres, 110, 170, args.year, proc, args.category)
+            # (--year combined: the per-year yields are saved along, makeYields.py --mergeYears weights the systematics with them)
+            interp = Interpolator(yields, fitres, 110, 170, args.year, proc, args.category, _model=models.get(proc),
+                                  _yearYields=yearYields if args.year == mergedYear else None)
             interp.calcPolation()
             interp.buildFinalPdfs(
-                save=True,
+                save=not args.parametricModel,
                 outWS=outputWSName__, outWSDir=outWSDir,
                 doSystematics=args.doSystematics
             )
+            if args.parametricModel:
+                interp.buildParametricPdf(paramWS, MH, args.doSystematics)
 
             # VISUALIZATION: draw the fitting
             outPlotName = "{}/plots/Interpolation/{}/CMS_HLLG_Interp_{}_{}_{}.pdf".format(swd__, args.year, proc, args.year, args.category)
-            interp.visualize("M_{ee#gamma} [GeV]", outPlotName)
+            makePlot(interp, "M_{ee#gamma} [GeV]", outPlotName)
+
+    if args.parametricModel:
+        saveParametricModel(paramWS)
+    saveFitSummary(summary)
+    if seeds is not None:
+        seeds.save()
+    if cache is not None:
+        cache.save()
 
 
 if __name__ == "__main__" :
@@ -1,13 +1,12 @@
 import sys, os
 import ROOT
 import numpy as np
-from CMS_lumi import CMS_lumi
 from commonObjects import decayMode
-from commonTools import rooiter
+from commonTools import rooiter, argset_to_dict, argset_errors_to_dict
 from collections import OrderedDict as od
 
 class Interpolator:
-    def __init__(self, _yields, _fitres, _MHLow, _MHHigh, _year, _proc, _cat, _useDCB=True):
+    def __init__(self, _yields, _fitres, _MHLow, _MHHigh, _year, _proc, _cat, _useDCB=True, _model=None, _yearYields=None):
         self.MHLow      = _MHLow    # lower bound of mass point
         self.MHHigh     = _MHHigh   # upper bound of mass point
         self.yields     = _yields   # dict contains yields @ 120, 125 and 130 GeV
@@ -20,6 +19,8 @@ class Interpolator:
         self.proc       = _proc     # production modes
         self.cat        = _cat      # category
         self.useDCB     = _useDCB
+        self.model      = _model    # mass-parametrised model of a simultaneous fit (dcbModel.DCBMassModel)
+        self.yearYields = _yearYields # year-merged model: dict contains {year: yield} @ 120, 125 and 130 GeV
 
         # intermediate mass points
         # set num = 11 to have 1 GeV a step: 120, 121, 122 ... 130
@@ -30,35 +31,50 @@ class Interpolator:
         self.Pars       = od()
         self.ParsErr    = od()
         self.FinalPdfs  = od()
+        self.FinalVars  = od()
 
-        # store the interpolated yields
+        # store the interpolated yields (and those of each year of a year-merged model)
         self.norms = []
+        self.yearNorms = od()
 
         # setup the xvar
         self.xvar = ROOT.RooRealVar("CMS_higgs_mass", "CMS_higgs_mass", self.MHLow, self.MHHigh, "GeV")
         self.xvar.setRange("NormRange", self.MHLow, self.MHHigh)
         self.xvar.setMin(self.MHLow)
         self.xvar.setMax(self.MHHigh)
-        self.xframe = self.xvar.frame(self.MHLow, self.MHHigh)
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def calcPolation(self):
+        # the yields are interpolated in all cases
+        self.norms = np.interp(self.xmass_intp, self.xmass, self.yields.values())
+        if self.yearYields is not None:
+            for year in self.yearYields[self.xmass[0]].keys():
+                self.yearNorms[year] = np.interp(self.xmass_intp, self.xmass, [self.yearYields[m][year] for m in self.xmass])
+
+        # mass-parametrised model: evaluate the parameters and their propagated errors at each mass
+        if self.model is not None:
+            pars = self.model.parameters(self.xmass_intp[0]).keys()
+            self.Pars = od([(p, np.array([self.model.parameters(m)[p] for m in self.xmass_intp])) for p in pars])
+            self.ParsErr = od([(p, np.array([self.model.errors(m)[p] for m in self.xmass_intp])) for p in pars])
+            return
+
         # extract the parameter from the first fit result
-        pars = [i.GetName() for i in rooiter(self.fitres[self.xmass[0]].floatParsFinal())]
+        pars = argset_to_dict(self.fitres[self.xmass[0]].floatParsFinal()).keys()
 
         # fill the par values in the fit results into dict
         par_dict = od([(p, [1.]*len(self.xmass)) for p in pars])
         parErr_dict = od([(p, [0.]*len(self.xmass)) for p in pars])
         for imass in range(len(self.xmass)):
+            vals = argset_to_dict(self.fitres[self.xmass[imass]].floatParsFinal())
+            errs = argset_errors_to_dict(self.fitres[self.xmass[imass]].floatParsFinal())
             for p in pars:
-                par_dict[p][imass] = self.fitres[self.xmass[imass]].floatParsFinal().find(p).getValV()
-                parErr_dict[p][imass] = self.fitres[self.xmass[imass]].floatParsFinal().find(p).getError()
+                par_dict[p][imass] = vals[p]
+                parErr_dict[p][imass] = errs[p]
 
         par_dict_intp = od([(p, [1.]*len(self.xmass_intp)) for p in pars])
         parErr_dict_intp = od([(p, [0.]*len(self.xmass_intp)) for p in pars])
 
         # interpolation: https://numpy.org/doc/stable/reference/generated/numpy.interp.html
-        self.norms = np.interp(self.xmass_intp, self.xmass, self.yields.values())
         for p in pars:
             par_dict_intp[p] = np.interp(self.xmass_intp, self.xmass, par_dict[p])
             parErr_dict_intp[p] = np.interp(self.xmass_intp, self.xmass, parErr_dict[p])
@@ -72,6 +88,7 @@ class Interpolator:
             os.system("mkdir -p %s" %outWSDir)
 
         self.FinalPdfs = od()
+        self.FinalVars = od()
         for imass, mass in enumerate(self.xmass_intp):
             Vars = od()
             for p in self.Pars.keys():
@@ -84,35 +101,9 @@ class Interpolator:
                 dcbPdf = ROOT.RooDoubleCB("DCB", "DCB", self.xvar, Vars["mean_dcb"], Vars["sigma_dcb"], Vars["a1_dcb"], Vars["n1_dcb"], Vars["a2_dcb"], Vars["n2_dcb"])
                 gauPdf = ROOT.RooGaussian("Gaus", "Gaus", self.xvar, Vars["mean_dcb"], Vars["sigma_gaus"])
                 self.FinalPdfs[mass] = ROOT.RooAddPdf("SigPdf", "SigPdf", dcbPdf, gauPdf, Vars["frac_dcb"])
-
-            if (mass != 120) and (mass != 125) and (mass != 130):
-                self.FinalPdfs[mass].plotOn(
-                    self.xframe, ROOT.RooFit.Range("NormRange"),
-                    ROOT.RooFit.Normalization(self.norms[imass], ROOT.RooAbsReal.NumEvent),
-                    ROOT.RooFit.LineColor(ROOT.TColor.GetColorPalette(imass * 20)),
-                    ROOT.RooFit.LineStyle(7)
-                )
-            if mass == 120:
-                self.FinalPdfs[mass].plotOn(
-                    self.xframe, ROOT.RooFit.Range("NormRange"),
-                    ROOT.RooFit.Normalization(self.norms[imass], ROOT.RooAbsReal.NumEvent),
-                    ROOT.RooFit.LineColor(ROOT.TColor.GetColor("#0F52BA")),
-                    ROOT.RooFit.LineWidth(4), ROOT.RooFit.Name("120")
-                )
-            if mass == 125:
-                self.FinalPdfs[mass].plotOn(
-                    self.xframe, ROOT.RooFit.Range("NormRange"),
-                    ROOT.RooFit.Normalization(self.norms[imass], ROOT.RooAbsReal.NumEvent),
-                    ROOT.RooFit.LineColor(ROOT.TColor.GetColor("#1C7747")),
-                    ROOT.RooFit.LineWidth(4), ROOT.RooFit.Name("125")
-                )
-            if mass == 130:
-                self.FinalPdfs[mass].plotOn(
-                    self.xframe, ROOT.RooFit.Range("NormRange"),
-                    ROOT.RooFit.Normalization(self.norms[imass], ROOT.RooAbsReal.NumEvent),
-                    ROOT.RooFit.LineColor(ROOT.TColor.GetColor("#E23E57")),
-                    ROOT.RooFit.LineWidth(4), ROOT.RooFit.Name("130")
-                )
+                Vars["DCB"], Vars["Gaus"] = dcbPdf, gauPdf
+            # keep the parameters (and components) alive as long as the pdf, see plotArtifact()
+            self.FinalVars[mass] = Vars
 
             if save == True:
                 # create the output dir
@@ -132,6 +123,10 @@ class Interpolator:
                 ws.imp = getattr(ws, "import")
                 ws.imp(self.FinalPdfs[mass])
                 ws.imp(ExpYield)
+                for year, yearNorm in self.yearNorms.items():
+                    yearYield = ROOT.RooRealVar("ExpYield_{}".format(year), "ExpYield_{}".format(year), yearNorm[imass], "GeV")
+                    yearYield.setConstant(True)
+                    ws.imp(yearYield)
 
                 # define params set
                 aset = ROOT.RooArgSet()
@@ -161,62 +156,71 @@ class Interpolator:
                 ws.Write()
                 fws.Close()
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # import the MH-dependent signal model of the process into a workspace shared by all processes
+    # * every parameter is a function of MH: linear spline through the interpolated points (as np.interp),
+    #   or the polynomial of the simultaneous fit
+    # * the pdf NewSigPdf_<proc> is normalised by NewSigPdf_<proc>_norm, a linear spline of the yields
+    #   (year-merged model: NewSigPdf_<proc>_norm_<year> hold the yields of each year)
+    # * shape nuisances do not depend on the mass: CMS_<decay>_scale_<proc>_<cat>_<year>
+    def buildParametricPdf(self, ws, MH, doSystematics=False):
+        ws.imp = getattr(ws, "import")
+        xnodes = np.array(self.xmass_intp, dtype=float)
+
+        Funcs = od()
+        for p in self.Pars.keys():
+            name = "{}_{}".format(p, self.proc)
+            if self.model is not None:
+                Funcs[p] = ROOT.RooFormulaVar(name, name, self.model.formula(p), ROOT.RooArgList(MH))
+            else:
+                Funcs[p] = ROOT.RooSpline1D(name, name, MH, len(xnodes), xnodes, np.array(self.Pars[p], dtype=float), "LINEAR")
+
+        # shape uncertainties: mean_dcb * scale, sigma_dcb * resol (initial values 1)
+        mean, sigma = Funcs["mean_dcb"], Funcs["sigma_dcb"]
+        if doSystematics:
+            scale_var = "CMS_{}_scale_{}_{}_{}".format(decayMode, self.proc, self.cat, self.year)
+            resol_var = "CMS_{}_resol_{}_{}_{}".format(decayMode, self.proc, self.cat, self.year)
+            Funcs["scale"] = ROOT.RooRealVar(scale_var, scale_var, 1.)
+            Funcs["resol"] = ROOT.RooRealVar(resol_var, resol_var, 1.)
+            mean = ROOT.RooProduct("new_mean_dcb_{}".format(self.proc), "", ROOT.RooArgList(Funcs["mean_dcb"], Funcs["scale"]))
+            sigma = ROOT.RooProduct("new_sigma_dcb_{}".format(self.proc), "", ROOT.RooArgList(Funcs["sigma_dcb"], Funcs["resol"]))
+
+        pdfName = "NewSigPdf_{}".format(self.proc)
+        if self.useDCB:
+            pdf = ROOT.RooDoubleCB(pdfName, pdfName, self.xvar, mean, sigma, Funcs["a1_dcb"], Funcs["n1_dcb"], Funcs["a2_dcb"], Funcs["n2_dcb"])
+        else:
+            dcbPdf = ROOT.RooDoubleCB("DCB_{}".format(self.proc), "DCB", self.xvar, mean, sigma, Funcs["a1_dcb"], Funcs["n1_dcb"], Funcs["a2_dcb"], Funcs["n2_dcb"])
+            gauPdf = ROOT.RooGaussian("Gaus_{}".format(self.proc), "Gaus", self.xvar, mean, Funcs["sigma_gaus"])
+            pdf = ROOT.RooAddPdf(pdfName, pdfName, dcbPdf, gauPdf, Funcs["frac_dcb"])
+        norm = ROOT.RooSpline1D("{}_norm".format(pdfName), "", MH, len(xnodes), xnodes, np.array(self.norms, dtype=float), "LINEAR")
+
+        print("INFO: Add the MH-dependent signal model {} to workspace {}".format(pdfName, ws.GetName()))
+        ws.imp(pdf, ROOT.RooFit.RecycleConflictNodes())
+        ws.imp(norm, ROOT.RooFit.RecycleConflictNodes())
+        for year, yearNorm in self.yearNorms.items():
+            yearNormName = "{}_norm_{}".format(pdfName, year)
+            ws.imp(ROOT.RooSpline1D(yearNormName, "", MH, len(xnodes), xnodes, np.array(yearNorm, dtype=float), "LINEAR"), ROOT.RooFit.RecycleConflictNodes())
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # plotting artifact of the interpolated pdfs (see plotArtifacts.py), drawn by visualize() or rendered later
+    # * the pdfs (dcbModel.sampleModel) are normalised to the yields per 1/100 of the range
+    def plotArtifact(self, xName, outName):
+        from plotArtifacts import nGrid
+        from dcbModel import sampleModel
+        grid = np.linspace(self.MHLow, self.MHHigh, nGrid)
+        binWidth = (self.MHHigh - self.MHLow) / 100.
+        curves = od()
+        for imass, mass in enumerate(self.xmass_intp):
+            pars = od([(p, self.Pars[p][imass]) for p in self.Pars.keys()])
+            curves[int(mass)] = self.norms[imass] * binWidth * sampleModel(pars, grid, self.MHLow, self.MHHigh)["total"]
+        return od([
+            ("kind", "Interpolation"), ("year", self.year), ("cat", self.cat), ("proc", self.proc),
+            ("xName", xName), ("outName", outName), ("grid", grid), ("curves", curves)
+        ])
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # xName: x-axis label
     # outName: path to save the plot
     def visualize(self, xName, outName):
-        # set up the canvas to draw
-        # self.xframe.SetAxisRange(xRange[0], xRange[1], "X")
-        self.xframe.SetTitle("")
-
-        self.xframe.GetXaxis().SetTickSize(0.03)
-        self.xframe.GetXaxis().SetTitleSize(0.04)
-        self.xframe.GetXaxis().SetLabelSize(0.04)
-        self.xframe.GetXaxis().SetLabelOffset(0.02)
-        self.xframe.GetXaxis().SetTitleOffset(1.4)
-        self.xframe.GetXaxis().SetTitle(xName)
-
-        self.xframe.GetYaxis().SetTitle("Signal shape")
-        self.xframe.GetYaxis().SetNdivisions(510)
-        self.xframe.GetYaxis().SetTickSize(0.03)
-        self.xframe.GetYaxis().SetTitleSize(0.04)
-        self.xframe.GetYaxis().SetLabelSize(0.04)
-        self.xframe.GetYaxis().SetTitleOffset(1.8)
-
-        self.xframe.SetMaximum(self.xframe.GetMaximum() * 500.)
-        self.xframe.SetMinimum(self.xframe.GetMaximum() * 0.00000001)
-
-        c = ROOT.TCanvas("c", "", 900, 900)
-        c.cd()
-        c.SetLogy()
-        c.SetRightMargin(0.05)
-        c.SetTopMargin(0.07)
-        c.SetLeftMargin(0.14)
-        c.SetBottomMargin(0.12)
-        self.xframe.Draw()
-
-        catProc = ROOT.TLatex()
-        catProc.SetTextFont(42)
-        catProc.SetNDC()
-        catProc.SetTextSize(0.037)
-        catProc.DrawLatex(0.53, 0.86, "%s, %s" %(self.proc, self.cat))
-
-        leg1 = ROOT.TLegend(0.53, 0.7, 0.83, 0.84)
-        leg1.SetTextFont(42)
-        leg1.SetTextSize(0.035)
-        leg1.SetFillColor(0)
-        leg1.SetLineColor(0)
-        leg1.AddEntry(self.xframe.findObject("120"), "PDF-120 GeV ", "l")
-        leg1.AddEntry(self.xframe.findObject("125"), "PDF-125 GeV ", "l")
-        leg1.AddEntry(self.xframe.findObject("130"), "PDF-130 GeV ", "l")
-        leg1.Draw()
-
-        CMS_lumi(c, 4, 11, "", self.year, True, "Simulation", "H #rightarrow #gamma*#gamma #rightarrow ee#gamma", "")
-
-        # create the output dir
-        outDir = os.path.dirname(outName)
-        if not os.path.exists(outDir):
-            os.system("mkdir -p %s" %outDir)
-
-        c.Print(outName)
-        c.Close()
\ No newline at end of file
+        from plotArtifacts import render
+        render(self.plotArtifact(xName, outName))
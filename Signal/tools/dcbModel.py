@@ -0,0 +1,437 @@
+# Vectorised double-sided Crystal Ball (DCB) model in NumPy
+# * same shape as RooDoubleCB (HiggsAnalysis/CombinedLimit):
+#     t = (x - mean) / sigma
+#     f = exp(-t^2/2)                                       for -a1 < t < a2
+#     f = exp(-a1^2/2) * (1 - a1 * (t + a1) / n1)^(-n1)     for t <= -a1
+#     f = exp(-a2^2/2) * (1 + a2 * (t - a2) / n2)^(-n2)     for t >= a2
+# * analytic normalisation over [xlo, xhi] and analytic gradients of the log-likelihood
+# * unbinned weighted ML fit with a quasi-Newton minimiser (L-BFGS-B), SumW2 corrected errors as RooFit
+
+import sys
+import math
+import numpy as np
+from collections import OrderedDict as od
+
+# order of the parameters in the parameter vectors
+dcbPars = ["mean_dcb", "sigma_dcb", "a1_dcb", "n1_dcb", "a2_dcb", "n2_dcb"]
+
+# a and n must stay strictly positive in the tail formulas
+minTailPar = 1e-3
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# expm1(z)/z and (exp(z)*(z-1)+1)/z^2, stable around z = 0
+def _h1(z):
+    z = np.asarray(z, dtype=np.float64)
+    small = np.abs(z) < 1e-5
+    zs = np.where(small, 1., z)
+    return np.where(small, 1. + z / 2. + z * z / 6., np.expm1(zs) / zs)
+
+
+def _h2(z):
+    z = np.asarray(z, dtype=np.float64)
+    small = np.abs(z) < 1e-3
+    zs = np.where(small, 1., z)
+    return np.where(small, 0.5 + z / 3. + z * z / 8., (np.exp(zs) * (zs - 1.) + 1.) / (zs * zs))
+
+
+# Integrals of one tail, written in the variable B = 1 + a * u / n (u: distance from the junction in sigma units)
+# * the tail is exp(-a^2/2) * B^(-n) and dt = (n/a) dB, B runs over [_Blo, _Bhi]
+# * returns the integral over t and its derivatives with respect to a and n (t range fixed)
+def _tailIntegrals(_a, _n, _Blo, _Bhi):
+    y2, y1 = math.log(_Blo), math.log(_Bhi)
+    D = y1 - y2
+    if D <= 0.:
+        return 0., 0., 0.
+
+    # J(q) = int B^(q-1) dB, K(q) = int B^(q-1) log(B) dB
+    def J(q):
+        return math.exp(q * y2) * D * float(_h1(q * D))
+
+    def K(q):
+        return math.exp(q * y2) * (y2 * D * float(_h1(q * D)) + D * D * float(_h2(q * D)))
+
+    E = math.exp(-0.5 * _a * _a)
+    c = _n / _a
+    Jn, Jn1, Kn = J(1. - _n), J(-_n), K(1. - _n)
+    I = E * c * Jn
+    dIda = -_a * I + E * c * ((c + _a) * Jn1 - c * Jn)
+    dIdn = -E * c * Kn - E * c * (Jn1 - Jn)
+    return I, dIda, dIdn
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Function to evaluate the unnormalised DCB (vectorised in x)
+def dcb(_x, _mean, _sigma, _a1, _n1, _a2, _n2):
+    return np.exp(logDCB(_x, [_mean, _sigma, _a1, _n1, _a2, _n2]))
+
+
+# Function to evaluate log of the unnormalised DCB and, if _grad, its gradient (6, N) with respect to the parameters
+def logDCB(_x, _theta, _grad=False):
+    mean, sigma, a1, n1, a2, n2 = _theta
+    t = (np.asarray(_x, dtype=np.float64) - mean) / sigma
+    left, right = (t <= -a1), (t >= a2)
+    core = ~(left | right)
+
+    B = np.where(left, 1. - a1 * (t + a1) / n1, 1.)
+    C = np.where(right, 1. + a2 * (t - a2) / n2, 1.)
+    logB, logC = np.log(B), np.log(C)
+    logf = np.where(core, -0.5 * t * t, 0.)
+    logf = np.where(left, -0.5 * a1 * a1 - n1 * logB, logf)
+    logf = np.where(right, -0.5 * a2 * a2 - n2 * logC, logf)
+    if not _grad:
+        return logf
+
+    # d log f / dt per region
+    dfdt = np.where(core, -t, 0.)
+    dfdt = np.where(left, a1 / B, dfdt)
+    dfdt = np.where(right, -a2 / C, dfdt)
+
+    grad = np.zeros((6, len(t)))
+    grad[0] = -dfdt / sigma
+    grad[1] = -dfdt * t / sigma
+    grad[2] = np.where(left, -a1 + (t + 2. * a1) / B, 0.)
+    grad[3] = np.where(left, -logB - (1. - B) / B, 0.)
+    grad[4] = np.where(right, -a2 - (t - 2. * a2) / C, 0.)
+    grad[5] = np.where(right, -logC - (1. - C) / C, 0.)
+    return logf, grad
+
+
+# Function to compute the integral of the unnormalised DCB over [_xlo, _xhi] and its gradient
+def integralDCB(_theta, _xlo, _xhi):
+    mean, sigma, a1, n1, a2, n2 = _theta
+    tlo, thi = (_xlo - mean) / sigma, (_xhi - mean) / sigma
+
+    # core: gaussian between the junctions
+    c1, c2 = min(max(-a1, tlo), thi), max(min(a2, thi), tlo)
+    Icore = math.sqrt(math.pi / 2.) * (math.erf(c2 / math.sqrt(2.)) - math.erf(c1 / math.sqrt(2.))) if c2 > c1 else 0.
+
+    # tails, in terms of B (left) and C (right)
+    IL, dILda, dILdn = 0., 0., 0.
+    if tlo < -a1:
+        tL = min(thi, -a1)
+        IL, dILda, dILdn = _tailIntegrals(a1, n1, 1. - a1 * (tL + a1) / n1, 1. - a1 * (tlo + a1) / n1)
+    IR, dIRda, dIRdn = 0., 0., 0.
+    if thi > a2:
+        tR = max(tlo, a2)
+        IR, dIRda, dIRdn = _tailIntegrals(a2, n2, 1. + a2 * (tR - a2) / n2, 1. + a2 * (thi - a2) / n2)
+
+    I = Icore + IL + IR
+    glo, ghi = np.exp(logDCB(np.array([_xlo, _xhi]), _theta))
+    grad = np.array([
+        glo - ghi,                          # the range is fixed in x, only the t bounds move with mean
+        I + tlo * glo - thi * ghi,          # and sigma
+        sigma * dILda, sigma * dILdn,
+        sigma * dIRda, sigma * dIRdn
+    ])
+    return sigma * I, grad
+
+
+# Function to evaluate the normalised DCB pdf over [_xlo, _xhi]
+def pdfDCB(_x, _theta, _xlo, _xhi):
+    norm, _ = integralDCB(_theta, _xlo, _xhi)
+    return np.exp(logDCB(_x, _theta)) / norm
+
+
+# Weighted negative log-likelihood and its gradient
+# * NLL = - sum_i w_i log f(x_i) + sum_i w_i log N, as RooFit for weighted datasets
+def nllDCB(_theta, _x, _w, _xlo, _xhi):
+    logf, glogf = logDCB(_x, _theta, True)
+    norm, gnorm = integralDCB(_theta, _xlo, _xhi)
+    sumw = _w.sum()
+    nll = -np.dot(_w, logf) + sumw * math.log(norm)
+    grad = -np.dot(glogf, _w) + sumw * gnorm / norm
+    return nll, grad
+
+
+# Hessian from central differences of an analytic gradient (_gradFcn: theta -> gradient)
+def _hessian(_gradFcn, _theta):
+    npar = len(_theta)
+    hess = np.zeros((npar, npar))
+    for j in range(npar):
+        step = 1e-5 * max(abs(_theta[j]), 1.)
+        up, do = np.array(_theta, dtype=np.float64), np.array(_theta, dtype=np.float64)
+        up[j] += step
+        do[j] -= step
+        hess[:, j] = (_gradFcn(up) - _gradFcn(do)) / (2. * step)
+    return 0.5 * (hess + hess.T)
+
+
+# Covariance of the fitted parameters, SumW2 corrected if _gradW2Fcn (gradient of the NLL with weights w^2) is given
+# * returns the covariance and its quality (3: ok, 0: singular hessian)
+def _covariance(_gradFcn, _gradW2Fcn, _theta):
+    try:
+        hinv = np.linalg.inv(_hessian(_gradFcn, _theta))
+    except np.linalg.LinAlgError:
+        return np.zeros((len(_theta), len(_theta))), 0
+    if _gradW2Fcn is None:
+        return hinv, 3
+    return hinv.dot(_hessian(_gradW2Fcn, _theta)).dot(hinv), 3
+
+
+# Function to get the box bounds and the starting point of the DCB parameters from a parameter table
+# * _pars: {par name: [initial, lower, upper]}, the lower bounds of a and n are raised to minTailPar
+def _boundsAndStart(_pars):
+    bounds = []
+    for p in dcbPars:
+        lo, hi = _pars[p][1], _pars[p][2]
+        if p not in ["mean_dcb", "sigma_dcb"]:
+            lo = max(lo, minTailPar)
+        bounds.append((lo, hi))
+    x0 = np.array([min(max(_pars[p][0], b[0]), b[1]) for p, b in zip(dcbPars, bounds)])
+    return bounds, x0
+
+
+def _minimize(_fcn, _x0, _bounds):
+    try:
+        from scipy.optimize import minimize
+    except ImportError:
+        print("[ERROR] The numpy fit backend requires scipy")
+        sys.exit(1)
+    res = minimize(_fcn, _x0, jac=True, method="L-BFGS-B", bounds=_bounds, options={"ftol": 1e-13, "gtol": 1e-9, "maxiter": 5000})
+    return res.x, (0 if res.success else 1)
+
+
+def _inRange(_x, _w, _xlo, _xhi):
+    x = np.asarray(_x, dtype=np.float64)
+    w = np.asarray(_w, dtype=np.float64)
+    inRange = (x >= _xlo) & (x <= _xhi)
+    return x[inRange], w[inRange]
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Container of a fit result with the interface of RooFitResult used downstream
+# * plain python/numpy content (picklable), floatParsFinal() builds the RooArgList on demand
+class FitResultTable:
+    def __init__(self, _names, _values, _errors, _covariance, _bounds, _minNll, _status, _covQual=3):
+        self.names      = list(_names)
+        self.values     = od(zip(self.names, [float(v) for v in _values]))
+        self.errors     = od(zip(self.names, [float(e) for e in _errors]))
+        self.covariance = np.array(_covariance)
+        self.bounds     = od(zip(self.names, [tuple(b) for b in _bounds]))
+        self.nll        = float(_minNll)
+        self.fitStatus  = int(_status)
+        self.quality    = int(_covQual)
+        self._parList   = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_parList"] = None
+        return state
+
+    def status(self):
+        return self.fitStatus
+
+    def minNll(self):
+        return self.nll
+
+    def covQual(self):
+        return self.quality
+
+    def floatParsFinal(self):
+        if self._parList is None:
+            import ROOT
+            self._vars = []
+            self._parList = ROOT.RooArgList()
+            for p in self.names:
+                var = ROOT.RooRealVar(p, p, self.values[p], self.bounds[p][0], self.bounds[p][1])
+                var.setError(self.errors[p])
+                self._vars.append(var)
+                self._parList.add(var)
+        return self._parList
+
+    def Print(self, _opt=""):
+        print("")
+        print("  FitResultTable: minimized FCN value: {}, covariance matrix quality: {}".format(self.nll, self.quality))
+        print("                  Status : {}".format(self.fitStatus))
+        print("")
+        print("    Floating Parameter    FinalValue +/-  Error   ")
+        print("  --------------------  --------------------------")
+        for p in self.names:
+            print("  {:>20}  {:12.4e} +/-  {:.2e}".format(p, self.values[p], self.errors[p]))
+        print("")
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Function to fit the DCB to (weighted) events
+# * _pars: {par name: [initial, lower, upper]} for the names in dcbPars
+# * _sumW2Error: errors from H_w^-1 H_w2 H_w^-1 (H_w/H_w2: hessians of the NLL with weights w/w^2), as RooFit SumW2Error
+def fitDCB(_x, _w, _pars, _xlo, _xhi, _sumW2Error=True):
+    x, w = _inRange(_x, _w, _xlo, _xhi)
+    bounds, x0 = _boundsAndStart(_pars)
+
+    # minimise the NLL per unit weight for a well conditioned problem
+    sumw = w.sum()
+    def fcn(theta):
+        nll, grad = nllDCB(theta, x, w, _xlo, _xhi)
+        return nll / sumw, grad / sumw
+
+    theta, status = _minimize(fcn, x0, bounds)
+    gradW2 = (lambda t: nllDCB(t, x, w * w, _xlo, _xhi)[1]) if _sumW2Error else None
+    cov, covQual = _covariance(lambda t: nllDCB(t, x, w, _xlo, _xhi)[1], gradW2, theta)
+    errors = np.sqrt(np.clip(np.diag(cov), 0., None))
+
+    return FitResultTable(dcbPars, theta, errors, cov, bounds, nllDCB(theta, x, w, _xlo, _xhi)[0], status, covQual)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Lagrange basis of the mass nodes evaluated at _mh: par(_mh) = sum_k L_k(_mh) * par(node_k)
+def lagrangeWeights(_nodes, _mh):
+    weights = []
+    for k, nk in enumerate(_nodes):
+        lk = 1.
+        for j, nj in enumerate(_nodes):
+            if j != k:
+                lk *= (_mh - nj) / float(nk - nj)
+        weights.append(lk)
+    return np.array(weights)
+
+
+# Mass-parametrised DCB: every parameter is a polynomial in MH, defined by its values at the mass nodes
+# * polynomial order 1: nodes at the first and last mass point, the parameters are linear in MH and stay
+#   within the box bounds of the nodes between them
+# * polynomial order 2: nodes at the first, central and last mass point
+class DCBMassModel:
+    def __init__(self, _nodes, _values, _covariance, _bounds, _minNll, _status, _covQual=3):
+        self.nodes      = list(_nodes)
+        self.values     = np.array(_values).reshape(len(dcbPars), len(self.nodes)) # [par, node]
+        self.covariance = np.array(_covariance)                                    # order of values.ravel()
+        self.bounds     = od(zip(dcbPars, [tuple(b) for b in _bounds]))
+        self.nll        = float(_minNll)
+        self.fitStatus  = int(_status)
+        self.quality    = int(_covQual)
+
+    def polOrder(self):
+        return len(self.nodes) - 1
+
+    def names(self):
+        return ["%s_MH%s" %(p, n) for p in dcbPars for n in self.nodes]
+
+    # Jacobian of the parameters at _mh with respect to the node values
+    def jacobian(self, _mh):
+        L = lagrangeWeights(self.nodes, _mh)
+        jac = np.zeros((len(dcbPars), self.values.size))
+        for i in range(len(dcbPars)):
+            jac[i, i * len(self.nodes):(i + 1) * len(self.nodes)] = L
+        return jac
+
+    # DCB parameters at _mh as {par: value}
+    # * parameters are kept within their bounds (only relevant outside the node range or for order 2)
+    def parameters(self, _mh):
+        values = self.values.dot(lagrangeWeights(self.nodes, _mh))
+        return od([(p, min(max(v, self.bounds[p][0]), self.bounds[p][1])) for p, v in zip(dcbPars, values)])
+
+    # expression of a parameter as polynomial in _var (e.g. for a RooFormulaVar of MH), without the bounds of parameters()
+    def formula(self, _par, _var="@0"):
+        i = dcbPars.index(_par)
+        terms = []
+        for k, nk in enumerate(self.nodes):
+            factors = ["(%s-%s)/(%s)" %(_var, nj, float(nk - nj)) for j, nj in enumerate(self.nodes) if j != k]
+            terms.append("*".join(["(%.12g)" %self.values[i, k]] + factors))
+        return "+".join(terms)
+
+    # covariance of the DCB parameters at _mh, propagated from the node values
+    def parCovariance(self, _mh):
+        jac = self.jacobian(_mh)
+        return jac.dot(self.covariance).dot(jac.T)
+
+    def errors(self, _mh):
+        return od(zip(dcbPars, np.sqrt(np.clip(np.diag(self.parCovariance(_mh)), 0., None))))
+
+    # fit result of the model at _mh (same interface as the fit at a single mass point)
+    def fitResult(self, _mh):
+        return FitResultTable(dcbPars, self.parameters(_mh).values(), self.errors(_mh).values(), self.parCovariance(_mh),
+                              self.bounds.values(), self.nll, self.fitStatus, self.quality)
+
+    def Print(self, _opt=""):
+        print("")
+        print("  DCBMassModel: polynomial order {}, nodes at MH = {}".format(self.polOrder(), self.nodes))
+        print("                minimized FCN value: {}, covariance matrix quality: {}, Status : {}".format(self.nll, self.quality, self.fitStatus))
+        print("")
+        errors = np.sqrt(np.clip(np.diag(self.covariance), 0., None))
+        for name, v, e in zip(self.names(), self.values.ravel(), errors):
+            print("  {:>20}  {:12.4e} +/-  {:.2e}".format(name, v, e))
+        print("")
+
+
+# Function to fit the mass-parametrised DCB to the samples of all mass points in one likelihood
+# * _samples: {mass: (x, w)}, _pars: {mass: parameter table as in fitDCB}
+# * the node values start from and are bounded by the parameter tables of the node masses
+def fitDCBSimultaneous(_samples, _pars, _xlo, _xhi, _polOrder=1, _sumW2Error=True):
+    masses = sorted(_samples.keys())
+    if _polOrder + 1 > len(masses):
+        print("[ERROR] Polynomial order {} needs at least {} mass points".format(_polOrder, _polOrder + 1))
+        sys.exit(1)
+    nodes = [masses[int(round(i * (len(masses) - 1) / float(_polOrder)))] for i in range(_polOrder + 1)]
+
+    samples = od([(m, _inRange(_samples[m][0], _samples[m][1], _xlo, _xhi)) for m in masses])
+    basis = od([(m, lagrangeWeights(nodes, m)) for m in masses])
+
+    nodeBounds = [_boundsAndStart(_pars[n]) for n in nodes]
+    bounds = [nodeBounds[k][0][i] for i in range(len(dcbPars)) for k in range(len(nodes))]
+    x0 = np.array([nodeBounds[k][1][i] for i in range(len(dcbPars)) for k in range(len(nodes))])
+    parBounds = [(min(b[0][i][0] for b in nodeBounds), max(b[0][i][1] for b in nodeBounds)) for i in range(len(dcbPars))]
+
+    # total NLL and its gradient with respect to the node values
+    def nllTotal(_theta, _power=1):
+        values = _theta.reshape(len(dcbPars), len(nodes))
+        nll, grad = 0., np.zeros_like(values)
+        for m, (x, w) in samples.items():
+            nllm, gradm = nllDCB(values.dot(basis[m]), x, w ** _power, _xlo, _xhi)
+            nll += nllm
+            grad += np.outer(gradm, basis[m])
+        return nll, grad.ravel()
+
+    sumw = sum(w.sum() for x, w in samples.values())
+    def fcn(theta):
+        nll, grad = nllTotal(theta)
+        return nll / sumw, grad / sumw
+
+    theta, status = _minimize(fcn, x0, bounds)
+    gradW2 = (lambda t: nllTotal(t, 2)[1]) if _sumW2Error else None
+    cov, covQual = _covariance(lambda t: nllTotal(t)[1], gradW2, theta)
+
+    return DCBMassModel(nodes, theta, cov, parBounds, nllTotal(theta)[0], status, covQual)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Function to sample the signal model on a grid of x (plots of makeModelPlot, simpleFit and Interpolator)
+# * _pars: {par: value} with the names of the fit ("mean_dcb", ..., and "sigma_gaus", "frac_dcb" for DCB + Gaus)
+# * returns {"total": pdf} normalised over [_xlo, _xhi], plus the components "DCB" and "Gaus" for DCB + Gaus
+def sampleModel(_pars, _grid, _xlo, _xhi):
+    grid = np.asarray(_grid, dtype=np.float64)
+    curves = od([("total", pdfDCB(grid, [_pars[p] for p in dcbPars], _xlo, _xhi))])
+    if "frac_dcb" in _pars:
+        mean, sigma, frac = _pars["mean_dcb"], _pars["sigma_gaus"], _pars["frac_dcb"]
+        zlo, zhi = (_xlo - mean) / (math.sqrt(2.) * sigma), (_xhi - mean) / (math.sqrt(2.) * sigma)
+        norm = sigma * math.sqrt(math.pi / 2.) * (math.erf(zhi) - math.erf(zlo))
+        curves["DCB"] = frac * curves["total"]
+        curves["Gaus"] = (1. - frac) * np.exp(-0.5 * ((grid - mean) / sigma) ** 2) / norm
+        curves["total"] = curves["DCB"] + curves["Gaus"]
+    return curves
+
+
+# Function to compute the effective sigma of a sampled pdf from its cumulative integral (trapezoidal rule)
+# * half width of the narrowest interval containing threshold of the probability, the upper edge is
+#   interpolated linearly in the cumulative integral
+# * returns (xmin, xmax, effSigma) as sigmaEff
+def effSigmaModel(_grid, _pdf, _threshold=0.683):
+    grid, pdf = np.asarray(_grid, dtype=np.float64), np.asarray(_pdf, dtype=np.float64)
+    cdf = np.concatenate([[0.], np.cumsum(0.5 * (pdf[1:] + pdf[:-1]) * np.diff(grid))])
+    cdf /= cdf[-1]
+    start = np.nonzero(cdf + _threshold <= 1.)[0]
+    stop = np.interp(cdf[start] + _threshold, cdf, grid)
+    width = stop - grid[start]
+    pos = np.argmin(width)
+    return grid[start[pos]], stop[pos], width[pos] * 0.5
+
+
+# Function to compute the full width at half maximum of a sampled pdf, returns the half maximum crossings (xlow, xhigh)
+def fwhmModel(_grid, _pdf):
+    grid, pdf = np.asarray(_grid, dtype=np.float64), np.asarray(_pdf, dtype=np.float64)
+    half = 0.5 * np.max(pdf)
+    above = np.nonzero(pdf >= half)[0]
+    lo, hi = above[0], above[-1]
+    xlow = grid[lo] if lo == 0 else np.interp(half, [pdf[lo - 1], pdf[lo]], [grid[lo - 1], grid[lo]])
+    xhigh = grid[hi] if hi == len(grid) - 1 else np.interp(half, [pdf[hi + 1], pdf[hi]], [grid[hi + 1], grid[hi]])
+    return xlow, xhigh
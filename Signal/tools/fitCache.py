@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import numpy as np
+from dcbModel import FitResultTable
+from collections import OrderedDict as od
+from commonObjects import swd__, yearsStr
+from commonTools import rooiter, read_json, write_json
+
+# Mass point whose fit seeds the other mass points
+refMass = 125
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Class to store the converged parameters of the signal fits and reuse them as starting values
+# * one JSON file per (category, year): {proc: {mass: {par: value}}}, parameter names as in simpleFit.Vars
+# * lookup order for (proc, mass):
+#   1. (proc, mass) of this year
+#   2. (proc, 125) of this year, mean shifted by mass - 125
+#   3. the same two lookups in the other years
+#   4. None: simpleFit keeps its static parameter table
+class SeedCache:
+    def __init__(self, _cat, _year, _cacheDir=""):
+        self.cat = _cat
+        self.year = str(_year)
+        self.cacheDir = _cacheDir if _cacheDir else "{}/fitCache/seeds".format(swd__)
+        self.seeds = read_json(self.fileName(self.year))
+        self.otherSeeds = od([(y, read_json(self.fileName(y))) for y in yearsStr if y != self.year])
+
+    def fileName(self, _year):
+        return "{}/seeds_{}_{}.json".format(self.cacheDir, self.cat, _year)
+
+    def _lookup(self, _seeds, _proc, _mass):
+        entries = _seeds.get(_proc, {})
+        if str(_mass) in entries:
+            return od(entries[str(_mass)]), "{}GeV".format(_mass)
+        if str(refMass) in entries:
+            seed = od(entries[str(refMass)])
+            if "mean_dcb" in seed:
+                seed["mean_dcb"] += _mass - refMass
+            return seed, "{}GeV shifted".format(refMass)
+        return None, ""
+
+    # Function to get the seed of (proc, mass), returns ({par: value}, source) or (None, "")
+    def get(self, _proc, _mass):
+        seed, source = self._lookup(self.seeds, _proc, _mass)
+        if seed is not None:
+            return seed, "{} {}".format(self.year, source)
+        for y, seeds in self.otherSeeds.items():
+            seed, source = self._lookup(seeds, _proc, _mass)
+            if seed is not None:
+                return seed, "{} {}".format(y, source)
+        return None, ""
+
+    # Function to store the converged parameters of (proc, mass), takes effect for the following get()
+    def update(self, _proc, _mass, _values):
+        if _proc not in self.seeds:
+            self.seeds[_proc] = od()
+        self.seeds[_proc][str(_mass)] = od([(p, float(v)) for p, v in _values.items()])
+
+    def save(self):
+        write_json(self.fileName(self.year), self.seeds)
+        print(" --> Successfully saved the fit seeds: {}".format(self.fileName(self.year)))
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Function to compute the fingerprint of a simpleFit, call after building the pdf and before seeding
+# * dataset: entries, sum of weights and sha1 of the (mass, weight) events
+# * pdf type, fit range, static parameter table and backend with its options
+def fit_fingerprint(_fit):
+    x, w = _fit.getArrays()
+    content = hashlib.sha1()
+    content.update(np.ascontiguousarray(x, dtype=np.float64).tobytes())
+    content.update(np.ascontiguousarray(w, dtype=np.float64).tobytes())
+    payload = od([
+        ("entries", len(x)), ("sumw", round(float(np.sum(w)), 10)), ("content", content.hexdigest()),
+        ("pdf", "DCB" if _fit.useDCB else "DCBplusGaussian"), ("range", [_fit.MHLow, _fit.MHHigh]),
+        ("pars", _fit.pars), ("backend", _fit.backendLabel())
+    ])
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# Function to convert a fit result (RooFitResult or dcbModel.FitResultTable) to a FitResultTable
+def to_table(_fres):
+    if isinstance(_fres, FitResultTable):
+        return _fres
+    pars = list(rooiter(_fres.floatParsFinal()))
+    cov = _fres.covarianceMatrix()
+    return FitResultTable(
+        [v.GetName() for v in pars], [v.getVal() for v in pars], [v.getError() for v in pars],
+        [[cov(i, j) for j in range(len(pars))] for i in range(len(pars))],
+        [(v.getMin(), v.getMax()) for v in pars], _fres.minNll(), _fres.status(), _fres.covQual()
+    )
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Class to store the results of the signal fits keyed by their fingerprint (fit_fingerprint)
+# * one JSON file per (category, year): {fingerprint: {proc, mass, names, values, errors, covariance, ...}}
+# * a cache hit returns a FitResultTable, the minimisation is skipped
+# * only the latest result of each (proc, mass) is kept
+class FitCache:
+    def __init__(self, _cat, _year, _cacheDir="", _reset=False):
+        self.cacheDir = _cacheDir if _cacheDir else "{}/fitCache/results".format(swd__)
+        self.fname = "{}/fits_{}_{}.json".format(self.cacheDir, _cat, _year)
+        self.entries = od() if _reset else read_json(self.fname)
+
+    # Function to get the cached result of a fingerprint, returns a FitResultTable or None
+    def get(self, _key):
+        if _key not in self.entries:
+            return None
+        e = self.entries[_key]
+        return FitResultTable(e["names"], e["values"], e["errors"], e["covariance"], e["bounds"], e["minNll"], e["status"], e["covQual"])
+
+    def update(self, _key, _proc, _mass, _fres):
+        for key in [k for k, e in self.entries.items() if e["proc"] == _proc and e["mass"] == _mass]:
+            del self.entries[key]
+        table = to_table(_fres)
+        self.entries[_key] = od([
+            ("proc", _proc), ("mass", _mass), ("names", table.names),
+            ("values", list(table.values.values())), ("errors", list(table.errors.values())),
+            ("covariance", table.covariance.tolist()), ("bounds", [list(b) for b in table.bounds.values()]),
+            ("minNll", table.minNll()), ("status", table.status()), ("covQual", table.covQual())
+        ])
+
+    def save(self):
+        write_json(self.fname, self.entries)
+        print(" --> Successfully saved the fit cache: {}".format(self.fname))
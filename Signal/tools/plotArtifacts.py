@@ -0,0 +1,199 @@
+import os
+import pickle
+import numpy as np
+from glob import glob
+from collections import OrderedDict as od
+from commonObjects import swd__
+
+# Plotting artifacts of the signal fits: plain python/numpy content, rendered later without the fit
+# * signalFit: binned data (sum of weights and of squared weights) and the fitted pdf on a grid of x
+# * Interpolation: the interpolated pdfs on a grid of x, normalised to their yields
+# * stored as {swd__}/plots/artifacts/<year>/<cat>/<plot name>.pkl, the pdf path to render is in "outName"
+
+nGrid = 600
+
+
+def artifact_dir(_year, _cat):
+    return "{}/plots/artifacts/{}/{}".format(swd__, _year, _cat)
+
+
+# Function to save an artifact next to the others of its year and category
+def save_artifact(_artifact):
+    outDir = artifact_dir(_artifact["year"], _artifact["cat"])
+    if not os.path.exists(outDir):
+        os.system("mkdir -p {}".format(outDir))
+    fname = "{}/{}.pkl".format(outDir, os.path.splitext(os.path.basename(_artifact["outName"]))[0])
+    with open(fname, "wb") as f:
+        pickle.dump(_artifact, f)
+    return fname
+
+
+def load_artifacts(_year, _cat):
+    artifacts = []
+    for fname in sorted(glob("{}/*.pkl".format(artifact_dir(_year, _cat)))):
+        with open(fname, "rb") as f:
+            artifacts.append(pickle.load(f))
+    return artifacts
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Function to render an artifact (simpleFit.visualize / Interpolator.visualize draw through it as well)
+def render(_artifact):
+    if _artifact["kind"] == "signalFit":
+        render_fit(_artifact)
+    elif _artifact["kind"] == "Interpolation":
+        render_interpolation(_artifact)
+    else:
+        print("Error: unknown plot artifact: {}".format(_artifact["kind"]))
+
+
+def _graph(_x, _y, _color, _width=4, _style=1):
+    import ROOT
+    g = ROOT.TGraph(len(_x), np.ascontiguousarray(_x, dtype=np.float64), np.ascontiguousarray(_y, dtype=np.float64))
+    g.SetLineColor(_color)
+    g.SetLineWidth(_width)
+    g.SetLineStyle(_style)
+    return g
+
+
+def _style_axes(_frame, _xName, _yName, _yTitleOffset):
+    _frame.SetTitle("")
+    _frame.GetXaxis().SetTickSize(0.03)
+    _frame.GetXaxis().SetTitleSize(0.04)
+    _frame.GetXaxis().SetLabelSize(0.04)
+    _frame.GetXaxis().SetLabelOffset(0.02)
+    _frame.GetXaxis().SetTitleOffset(1.4)
+    _frame.GetXaxis().SetTitle(_xName)
+    _frame.GetYaxis().SetTitle(_yName)
+    _frame.GetYaxis().SetNdivisions(510)
+    _frame.GetYaxis().SetTickSize(0.03)
+    _frame.GetYaxis().SetTitleSize(0.04)
+    _frame.GetYaxis().SetLabelSize(0.04)
+    _frame.GetYaxis().SetTitleOffset(_yTitleOffset)
+
+
+def _canvas():
+    import ROOT
+    ROOT.gStyle.SetPadTickX(1)
+    ROOT.gStyle.SetPadTickY(1)
+    ROOT.gStyle.SetOptStat(0)
+    c = ROOT.TCanvas("c", "", 900, 900)
+    c.cd()
+    c.SetRightMargin(0.05)
+    c.SetTopMargin(0.07)
+    c.SetLeftMargin(0.14)
+    c.SetBottomMargin(0.12)
+    c.SetLogy()
+    return c
+
+
+def _print(_c, _outName):
+    outDir = os.path.dirname(_outName)
+    if not os.path.exists(outDir):
+        os.system("mkdir -p %s" %outDir)
+    _c.Print(_outName)
+    _c.Close()
+
+
+def render_fit(_a):
+    import ROOT
+    from CMS_lumi import CMS_lumi
+    edges = np.asarray(_a["edges"], dtype=np.float64)
+    hist = ROOT.TH1D("set", "", len(edges) - 1, edges)
+    for i in range(len(edges) - 1):
+        hist.SetBinContent(i + 1, _a["sumw"][i])
+        hist.SetBinError(i + 1, np.sqrt(_a["sumw2"][i]))
+    hist.SetMarkerStyle(ROOT.kFullCircle)
+    hist.SetMarkerSize(1.5)
+    hist.SetLineColor(ROOT.kBlack)
+
+    curves = od()
+    curves["sigfit"] = _graph(_a["grid"], _a["curves"]["sigfit"], ROOT.TColor.GetColor("#5893D4"))
+    if not _a["useDCB"]:
+        curves["DCB"] = _graph(_a["grid"], _a["curves"]["DCB"], ROOT.TColor.GetColor("#1C7747"), _style=7)
+        curves["Gaus"] = _graph(_a["grid"], _a["curves"]["Gaus"], ROOT.TColor.GetColor("#E23E57"), _style=7)
+
+    c = _canvas()
+    frame = hist.Clone("frame")
+    frame.Reset()
+    ymax = max(np.max(_a["sumw"]), np.max(_a["curves"]["sigfit"])) * 500.
+    frame.SetMaximum(ymax)
+    frame.SetMinimum(ymax * 0.00000001)
+    _style_axes(frame, _a["xName"], "Signal shape / ({} GeV)".format(edges[1] - edges[0]), 1.6)
+    frame.Draw("AXIS")
+    for g in curves.values():
+        g.Draw("L SAME")
+    hist.Draw("PE X0 SAME")
+
+    CMS_lumi(c, 4, 11, "", _a["year"], True, "Simulation", "H #rightarrow #gamma* #gamma #rightarrow ee#gamma", "")
+    c.Update()
+    c.RedrawAxis()
+
+    ltx = ROOT.TLatex()
+    ltx.SetNDC()
+    ltx.SetTextFont(42)
+    ltx.SetTextSize(0.037)
+    ltx.DrawLatex(0.53, 0.86, "{}, {}".format(_a["proc"], _a["cat"]))
+
+    leg1 = ROOT.TLegend(0.53, 0.7, 0.9, 0.83)
+    leg1.SetTextFont(42)
+    leg1.SetTextSize(0.037)
+    leg1.SetFillColor(0)
+    leg1.SetLineColor(0)
+    leg1.AddEntry(hist, "Simulation", "ep")
+    leg1.AddEntry(curves["sigfit"], "Parametric model", "l")
+    leg1.Draw()
+
+    if not _a["useDCB"]:
+        leg2 = ROOT.TLegend(0.61, 0.62, 0.9, 0.7)
+        leg2.SetTextFont(42)
+        leg2.SetTextSize(0.033)
+        leg2.SetFillColor(0)
+        leg2.SetLineColor(0)
+        leg2.AddEntry(curves["DCB"], "DCB", "l")
+        leg2.AddEntry(curves["Gaus"], "Gauss", "l")
+        leg2.Draw("same")
+
+    _print(c, _a["outName"])
+
+
+def render_interpolation(_a):
+    import ROOT
+    from CMS_lumi import CMS_lumi
+    colors = {120: ROOT.TColor.GetColor("#0F52BA"), 125: ROOT.TColor.GetColor("#1C7747"), 130: ROOT.TColor.GetColor("#E23E57")}
+    curves = od()
+    for imass, (mass, y) in enumerate(_a["curves"].items()):
+        if mass in colors:
+            curves[mass] = _graph(_a["grid"], y, colors[mass])
+        else:
+            curves[mass] = _graph(_a["grid"], y, ROOT.TColor.GetColorPalette(imass * 20), _style=7)
+
+    c = _canvas()
+    ymax = max([np.max(y) for y in _a["curves"].values()]) * 500.
+    frame = c.DrawFrame(_a["grid"][0], ymax * 0.00000001, _a["grid"][-1], ymax)
+    _style_axes(frame, _a["xName"], "Signal shape", 1.8)
+    for mass, g in curves.items():
+        if mass not in colors:
+            g.Draw("L SAME")
+    for mass in colors:
+        if mass in curves:
+            curves[mass].Draw("L SAME")
+
+    catProc = ROOT.TLatex()
+    catProc.SetTextFont(42)
+    catProc.SetNDC()
+    catProc.SetTextSize(0.037)
+    catProc.DrawLatex(0.53, 0.86, "%s, %s" %(_a["proc"], _a["cat"]))
+
+    leg1 = ROOT.TLegend(0.53, 0.7, 0.83, 0.84)
+    leg1.SetTextFont(42)
+    leg1.SetTextSize(0.035)
+    leg1.SetFillColor(0)
+    leg1.SetLineColor(0)
+    for mass in colors:
+        if mass in curves:
+            leg1.AddEntry(curves[mass], "PDF-{} GeV ".format(mass), "l")
+    leg1.Draw()
+
+    CMS_lumi(c, 4, 11, "", _a["year"], True, "Simulation", "H #rightarrow #gamma*#gamma #rightarrow ee#gamma", "")
+    _print(c, _a["outName"])
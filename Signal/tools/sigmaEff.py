@@ -1,8 +1,58 @@
 import numpy as np
-from numba import jit
 
-@jit
-def sigmaEff(v, threshold=0.683):
+# Effective sigma: half width of the narrowest interval containing a fraction threshold of the events
+# * the values are sorted once, every window of Max = int(threshold * N) steps is evaluated in one
+#   vectorised pass (O(N log N) overall)
+# * weights: event weights; the window then has to contain threshold of the total weight (see sigmaEffWeighted)
+def sigmaEff(v, threshold=0.683, weights=None):
+	if weights is not None:
+		return sigmaEffWeighted(v, weights, threshold)
+
+	v = np.sort(v)
+
+	total = len(v)
+	Max = int(threshold * total)
+
+	# windows [i, i+Max], only those ending before the last value (as in the original loop)
+	width = v[Max:total-1] - v[:total-1-Max]
+
+	minwidth = np.amin(width)
+	pos = np.argmin(width)
+
+	xmin = v[pos]
+	xmax = v[pos+Max]
+
+	return xmin, xmax, minwidth*0.5
+
+
+# Weighted effective sigma from the cumulative sum of the event weights
+# * for each start i, the window ends at the first j where the weight of [i, j] reaches threshold of the total
+# * negative weights: the end is searched on the running maximum of the cumulative sum
+def sigmaEffWeighted(v, weights, threshold=0.683):
+	v = np.asarray(v, dtype=np.float64)
+	weights = np.asarray(weights, dtype=np.float64)
+	order = np.argsort(v, kind="mergesort")
+	v, weights = v[order], weights[order]
+
+	cumw = np.cumsum(weights)
+	target = (cumw - weights) + threshold * cumw[-1]
+	stop = np.searchsorted(np.maximum.accumulate(cumw), target, side="left")
+
+	start = np.nonzero(stop < len(v))[0]
+	stop = stop[start]
+	width = v[stop] - v[start]
+
+	minwidth = np.amin(width)
+	pos = np.argmin(width)
+
+	xmin = v[start[pos]]
+	xmax = v[stop[pos]]
+
+	return xmin, xmax, minwidth*0.5
+
+
+# Original O(N^2) implementation, kept as a reference for the benchmark below
+def _sigmaEffLoop(v, threshold=0.683):
 	v = np.sort(v)
 
 	total = len(v)
@@ -35,6 +85,21 @@ def sigmaEff(v, threshold=0.683):
 
 	return xmin, xmax, minwidth*0.5
 
-# np.random.seed(2020)
-# data = np.random.normal(0, 15, 1000)
-# print(sigmaEff(data, 0.683))
\ No newline at end of file
+
+# Micro-benchmark: python sigmaEff.py
+if __name__ == "__main__":
+	import timeit
+	np.random.seed(2020)
+	for n in [500, 1000, 2000, 4000]:
+		data = np.random.normal(125, 2, n)
+		assert _sigmaEffLoop(data) == sigmaEff(data)
+		tloop = min(timeit.repeat(lambda: _sigmaEffLoop(data), number=1, repeat=3))
+		tvec = min(timeit.repeat(lambda: sigmaEff(data), number=10, repeat=3)) / 10.
+		tw = min(timeit.repeat(lambda: sigmaEff(data, weights=np.ones(n)), number=10, repeat=3)) / 10.
+		print("N = {:5d}: loop {:9.3f} ms, vectorised {:7.3f} ms, weighted {:7.3f} ms (x{:.0f})".format(n, tloop*1e3, tvec*1e3, tw*1e3, tloop/tvec))
+
+	data = np.random.normal(125, 2, 1000000)
+	weights = np.random.uniform(0.5, 1.5, len(data))
+	tvec = min(timeit.repeat(lambda: sigmaEff(data), number=1, repeat=3))
+	tw = min(timeit.repeat(lambda: sigmaEff(data, weights=weights), number=1, repeat=3))
+	print("N = 1e6: vectorised {:.1f} ms, weighted {:.1f} ms".format(tvec*1e3, tw*1e3))
@@ -1,7 +1,9 @@
-import os
+import os, sys
+import time
 import ROOT
+import numpy as np
 from collections import OrderedDict as od
-from CMS_lumi import CMS_lumi
+from commonTools import dataset_to_numpy
 
 class simpleFit:
     def __init__(self, _data, _xvar, _MH, _MHLow, _MHHigh):
@@ -45,6 +47,15 @@ class simpleFit:
         # Fit containers
         self.nBins = 60
         self.FitResult = None
+        self.backend = "roofit"
+        self.fitTime = 0.
+        self.fromCache = False
+
+        # RooFit evaluation options (see setRooFitOptions)
+        self.batchMode = False
+        self.nCPU = 1
+        self.minimizer = "Minuit"
+        self.strategy = -1
 
         # setup the xvar
         self.xvar.setUnit("GeV")
@@ -52,6 +63,22 @@ class simpleFit:
         self.xvar.setMax(self.MHHigh)
         self.xvar.setRange("NormRange", self.MHLow, self.MHHigh)
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # replace the nominal values of the parameter lookup table (and of the RooRealVars once built) by seeds
+    # * _seeds: {par: value} with the names of the RooRealVars ("sigma_dcb", "sigma_gaus", ...), see fitCache.SeedCache
+    # * seeds outside of the parameter range are ignored
+    def setSeeds(self, _seeds):
+        groups = {"dcb": "DCB", "gaus": "Gaus"}
+        for k, v in _seeds.items():
+            f, group = k.rsplit("_", 1)
+            if groups.get(group) not in self.pars or f not in self.pars[groups[group]]:
+                continue
+            par = self.pars[groups[group]][f]
+            if par[1] < v < par[2]:
+                par[0] = v
+                if k in self.Vars:
+                    self.Vars[k].setVal(v)
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def buildDCBplusGaussian(self, floatingParm="all"):
         # build double sided crystalball
@@ -75,14 +102,103 @@ class simpleFit:
         self.Pdfs["SigPdf"] = ROOT.RooDoubleCB("SigPdf", "SigPdf", self.xvar, self.Vars["mean_dcb"], self.Vars["sigma_dcb"], self.Vars["a1_dcb"], self.Vars["n1_dcb"], self.Vars["a2_dcb"], self.Vars["n2_dcb"])
         self.useDCB = True
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # specify the fit backend
+    # * roofit: unbinned fitTo of the RooFit pdf (default)
+    # * numpy: vectorised DCB likelihood of dcbModel.py (DCB only), returns a dcbModel.FitResultTable
+    def setBackend(self, backend):
+        if backend not in ["roofit", "numpy"]:
+            print("Error: unknown fit backend: {}, available backends [roofit, numpy]".format(backend))
+            sys.exit(1)
+        self.backend = backend
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # specify the evaluation options of the RooFit backend
+    # * batchMode: vectorised likelihood evaluation (RooFit::BatchMode, ROOT >= 6.20)
+    # * nCPU: split the likelihood over n processes (RooFit::NumCPU)
+    # * minimizer: "Minuit" (default) or "Minuit2", with the minimisation strategy (-1: default of the minimizer)
+    def setRooFitOptions(self, batchMode=False, nCPU=1, minimizer="Minuit", strategy=-1):
+        if minimizer not in ["Minuit", "Minuit2"]:
+            print("Error: unknown minimizer: {}, available minimizers [Minuit, Minuit2]".format(minimizer))
+            sys.exit(1)
+        if batchMode and not hasattr(ROOT.RooFit, "BatchMode"):
+            print("WARNING: RooFit batch mode is not available in ROOT {}, use the scalar evaluation".format(ROOT.gROOT.GetVersion()))
+            batchMode = False
+        self.batchMode = batchMode
+        self.nCPU = nCPU
+        self.minimizer = minimizer
+        self.strategy = strategy
+
+    # label of the fit backend and its options (fit summary)
+    def backendLabel(self):
+        if self.backend.startswith("numpy"):
+            return self.backend
+        label = "roofit_{}".format(self.minimizer)
+        if self.strategy >= 0:
+            label += "_strategy{}".format(self.strategy)
+        if self.batchMode:
+            label += "_batch"
+        if self.nCPU > 1:
+            label += "_cpu{}".format(self.nCPU)
+        return label
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def runFit(self):
-        fRes = self.Pdfs["SigPdf"].fitTo(
-            self.data,
+        start = time.time()
+        if self.backend == "numpy":
+            self.runNumpyFit()
+            self.fitTime = time.time() - start
+            return self.FitResults
+
+        # fit options are collected in a RooLinkedList (fitTo takes at most 8 RooCmdArgs)
+        cmds = [
             ROOT.RooFit.Save(ROOT.kTRUE),
-            ROOT.RooFit.Range("NormRange"), ROOT.RooFit.Minimizer("Minuit", "minimize"),
+            ROOT.RooFit.Range("NormRange"),
+            ROOT.RooFit.Minimizer(self.minimizer, "minimize" if self.minimizer == "Minuit" else "migrad"),
             ROOT.RooFit.SumW2Error(ROOT.kTRUE), ROOT.RooFit.PrintLevel(-1)
-        )
+        ]
+        if self.strategy >= 0:
+            cmds.append(ROOT.RooFit.Strategy(self.strategy))
+        if self.nCPU > 1:
+            cmds.append(ROOT.RooFit.NumCPU(self.nCPU))
+        if self.batchMode:
+            cmds.append(ROOT.RooFit.BatchMode(True))
+        fitOpts = ROOT.RooLinkedList()
+        for cmd in cmds:
+            fitOpts.Add(cmd)
+
+        fRes = self.Pdfs["SigPdf"].fitTo(self.data, fitOpts)
+        self.fitTime = time.time() - start
+        self.FitResults = fRes
+        return self.FitResults
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # unbinned weighted fit of the DCB with the numpy backend, same range and SumW2 errors as runFit
+    # * the fitted values are copied to the RooRealVars, so visualize() and getChi2() use the fitted pdf
+    def runNumpyFit(self):
+        import dcbModel
+        if not self.useDCB:
+            print("Error: the numpy fit backend only supports the DCB model (buildDCB)")
+            sys.exit(1)
+
+        x, w = self.getArrays()
+        fRes = dcbModel.fitDCB(x, w, self.getDCBPars(), self.MHLow, self.MHHigh)
+        return self.setFitResult(fRes)
+
+    # events (mass, weight) of the dataset as numpy arrays
+    def getArrays(self):
+        columns = dataset_to_numpy(self.data, self.xvar.GetName())
+        return columns[self.xvar.GetName()], columns["weight"]
+
+    # parameter lookup table of the DCB with the names of the RooRealVars
+    def getDCBPars(self):
+        return od([("%s_dcb"%f, self.pars["DCB"][f]) for f in ["mean", "sigma", "n1", "n2", "a1", "a2"]])
+
+    # set a fit result of the numpy backend (dcbModel.FitResultTable), its values are copied to the RooRealVars
+    def setFitResult(self, fRes):
+        for p in fRes.names:
+            self.Vars[p].setVal(fRes.values[p])
+            self.Vars[p].setError(fRes.errors[p])
         self.FitResults = fRes
         return self.FitResults
 
@@ -101,104 +217,60 @@ class simpleFit:
         return chi2.getVal()
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # plotting artifact of the fit (see plotArtifacts.py), drawn by visualize() or rendered later
+    # * data binned in nBins, pdfs sampled on a grid (dcbModel.sampleModel) and normalised to the events per bin
+    # year: year put on the plot
     # xName: x-axis label
     # catName: name of category put on the plot
     # procName: name of process put on the plot
     # outName: path to save the plot
-    def visualize(self, year, xName, catName, procName, outName):
-        ROOT.gStyle.SetPadTickX(1)
-        ROOT.gStyle.SetPadTickY(1)
-        ROOT.gStyle.SetOptStat(0)
-
-        xframe = self.xvar.frame(self.MHLow, self.MHHigh)
-        self.data.plotOn(
-            xframe, ROOT.RooFit.Name("set"),
-            ROOT.RooFit.Binning(self.nBins),
-            ROOT.RooFit.MarkerStyle(ROOT.kFullCircle), ROOT.RooFit.MarkerSize(1.5), ROOT.RooFit.XErrorSize(10e-5),
-            ROOT.RooFit.DataError(ROOT.RooDataSet.SumW2)
-        )
-
-        self.Pdfs["SigPdf"].plotOn(
-            xframe, ROOT.RooFit.Name("sigfit"),
-            ROOT.RooFit.LineColor(ROOT.TColor.GetColor("#5893D4")), ROOT.RooFit.LineWidth(4)
-        )
+    def plotArtifact(self, year, xName, catName, procName, outName):
+        from plotArtifacts import nGrid
+        from dcbModel import sampleModel
+        x, w = self.getArrays()
+        edges = np.linspace(self.MHLow, self.MHHigh, self.nBins + 1)
+        sumw = np.histogram(x, edges, weights=w)[0]
+        sumw2 = np.histogram(x, edges, weights=w**2)[0]
 
+        grid = np.linspace(self.MHLow, self.MHHigh, nGrid)
+        scale = np.sum(sumw) * (edges[1] - edges[0])
+        model = sampleModel(od([(k, v.getVal()) for k, v in self.Vars.items()]), grid, self.MHLow, self.MHHigh)
+        curves = od([("sigfit", scale * model["total"])])
         if not self.useDCB:
-            self.Pdfs["SigPdf"].plotOn(
-                xframe, ROOT.RooFit.Components("DCB"), ROOT.RooFit.Name("DCB"),
-                ROOT.RooFit.LineColor(ROOT.TColor.GetColor("#1C7747")), ROOT.RooFit.LineWidth(4), ROOT.RooFit.LineStyle(7)
-            )
-
-            self.Pdfs["SigPdf"].plotOn(
-                xframe, ROOT.RooFit.Components("Gaus"), ROOT.RooFit.Name("Gaus"),
-                ROOT.RooFit.LineColor(ROOT.TColor.GetColor("#E23E57")), ROOT.RooFit.LineWidth(4), ROOT.RooFit.LineStyle(7)
-            )
-
-        self.data.plotOn(
-            xframe, ROOT.RooFit.Name("set"),
-            ROOT.RooFit.Binning(self.nBins),
-            ROOT.RooFit.MarkerStyle(ROOT.kFullCircle), ROOT.RooFit.MarkerSize(1.5), ROOT.RooFit.XErrorSize(10e-5),
-            ROOT.RooFit.DataError(ROOT.RooDataSet.SumW2)
-        )
-
-        xframe.SetTitle("")
-        xframe.GetXaxis().SetTickSize(0.03)
-        xframe.GetXaxis().SetTitleSize(0.04)
-        xframe.GetXaxis().SetLabelSize(0.04)
-        xframe.GetXaxis().SetLabelOffset(0.02)
-        xframe.GetXaxis().SetTitleOffset(1.4)
-        xframe.GetXaxis().SetTitle(xName)
-        xframe.GetYaxis().SetTitle("Signal shape / ({} GeV)".format((self.MHHigh - self.MHLow)/self.nBins))
-        xframe.GetYaxis().SetNdivisions(510)
-        xframe.GetYaxis().SetTickSize(0.03)
-        xframe.GetYaxis().SetTitleSize(0.04)
-        xframe.GetYaxis().SetLabelSize(0.04)
-        xframe.GetYaxis().SetTitleOffset(1.6)
-        xframe.SetMaximum(xframe.GetMaximum() * 500.)
-        xframe.SetMinimum(xframe.GetMaximum() * 0.00000001)
-
-        c = ROOT.TCanvas("c", "", 900, 900)
-        c.cd()
-        c.SetRightMargin(0.05)
-        c.SetTopMargin(0.07)
-        c.SetLeftMargin(0.14)
-        c.SetBottomMargin(0.12)
-        c.SetLogy()
-        xframe.Draw()
-
-        CMS_lumi(c, 4, 11, "", year, True, "Simulation", "H #rightarrow #gamma* #gamma #rightarrow ee#gamma", "")
-        c.Update()
-        c.RedrawAxis()
-
-        ltx = ROOT.TLatex()
-        ltx.SetNDC()
-        ltx.SetTextFont(42)
-        ltx.SetTextSize(0.037)
-        ltx.DrawLatex(0.53, 0.86, "{}, {}".format(procName, catName))
-
-        leg1 = ROOT.TLegend(0.53, 0.7, 0.9, 0.83)
-        leg1.SetTextFont(42)
-        leg1.SetTextSize(0.037)
-        leg1.SetFillColor(0)
-        leg1.SetLineColor(0)
-        leg1.AddEntry(xframe.findObject("set"), "Simulation", "ep")
-        leg1.AddEntry(xframe.findObject("sigfit"), "Parametric model", "l")
-        leg1.Draw()
+            curves["DCB"] = scale * model["DCB"]
+            curves["Gaus"] = scale * model["Gaus"]
 
-        if not self.useDCB:
-            leg2 = ROOT.TLegend(0.61, 0.62, 0.9, 0.7)
-            leg2.SetTextFont(42)
-            leg2.SetTextSize(0.033)
-            leg2.SetFillColor(0)
-            leg2.SetLineColor(0)
-            leg2.AddEntry(xframe.findObject("DCB"), "DCB", "l")
-            leg2.AddEntry(xframe.findObject("Gaus"), "Gauss", "l")
-            leg2.Draw("same")
-
-        # create the output dir
-        outDir = os.path.dirname(outName)
-        if not os.path.exists(outDir):
-            os.system("mkdir -p %s" %outDir)
-
-        c.Print(outName)
-        c.Close()
\ No newline at end of file
+        return od([
+            ("kind", "signalFit"), ("year", year), ("cat", catName), ("proc", procName), ("mass", self.MH),
+            ("xName", xName), ("outName", outName), ("useDCB", self.useDCB),
+            ("edges", edges), ("sumw", sumw), ("sumw2", sumw2), ("grid", grid), ("curves", curves)
+        ])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def visualize(self, year, xName, catName, procName, outName):
+        from plotArtifacts import render
+        render(self.plotArtifact(year, xName, catName, procName, outName))
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Simultaneous fit of the DCB to the datasets of all mass points, the parameters are polynomials in MH
+# * _fits: {mass: simpleFit with buildDCB()}, the fit range is taken from the first fit
+# * every simpleFit gets the model evaluated at its mass point, returns the dcbModel.DCBMassModel
+def fitSimultaneous(_fits, _polOrder=1):
+    import dcbModel
+    for fit in _fits.values():
+        if not fit.useDCB:
+            print("Error: the simultaneous fit only supports the DCB model (buildDCB)")
+            sys.exit(1)
+    first = list(_fits.values())[0]
+    samples = od([(mass, fit.getArrays()) for mass, fit in _fits.items()])
+    pars = od([(mass, fit.getDCBPars()) for mass, fit in _fits.items()])
+
+    start = time.time()
+    model = dcbModel.fitDCBSimultaneous(samples, pars, first.MHLow, first.MHHigh, _polOrder)
+    elapsed = time.time() - start
+    for mass, fit in _fits.items():
+        fit.setFitResult(model.fitResult(mass))
+        fit.backend = "numpy_simultaneous_pol{}".format(_polOrder)
+        fit.fitTime = elapsed / len(_fits)
+    return model
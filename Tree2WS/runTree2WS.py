@@ -1,11 +1,14 @@
 import os, sys
 import subprocess
-from tqdm import tqdm
+import re
+import traceback
 from pprint import pprint
-from multiprocessing import Pool
 from argparse import ArgumentParser
+from importlib import import_module
+from collections import OrderedDict as od
 from commonObjects import massBaseList, years, productionModes
-from commonTools import color
+from commonTools import color, is_up_to_date, entries_file
+from jobScheduler import shell_job, files_size, run_jobs
 
 
 def get_parser():
@@ -16,12 +19,117 @@ def get_parser():
     parser.add_argument("-m",  "--mass",            help="mass point [120, 125, 130]",                                  default="all", type=str)
     parser.add_argument("-p",  "--productionMode",  help="Production mode [ggH, VBF, WH, ZH, ttH, bbH]",                default="all", type=str)
     parser.add_argument("-ds", "--doSystematics",   help="Add systematics datasets to output WS",                       default=False, action="store_true")
+    parser.add_argument("-wc", "--weightColumns",   help="Store weight systematics as per-category sums of weights",    default=False, action="store_true")
+    parser.add_argument("-cs", "--chunkSize",       help="Stream the input trees in chunks of N entries, bounds the input arrays, the datasets are filled in the workspace (0: read at once)", default=0, type=int)
+    parser.add_argument("-wk", "--writeCache",      help="Also write a columnar (.npy) cache of the signal datasets",   default=False, action="store_true")
     parser.add_argument("-n",  "--nCPUs",           help="Number of CPUs used to convert tree to ws(default: 10)",      default=10,    type=int)
+    parser.add_argument("-ip", "--inProcess",       help="Run tree2ws conversions in-process in a persistent worker pool", default=False, action="store_true")
+    parser.add_argument("-mt", "--maxTasksPerChild",help="Recycle a worker of the in-process pool after N conversions",  default=4,     type=int)
+    parser.add_argument("-ic", "--incremental",     help="Skip the outputs whose inputs and config are unchanged",      default=False, action="store_true")
     return parser
 
 
+# Function to run a conversion in a subprocess, a non-zero exit status fails the job
 def convert(cmd):
-    os.system(cmd)
+    rc = os.system(cmd)
+    if rc != 0:
+        raise RuntimeError("{} exited with {}".format(cmd, rc))
+
+
+# Function to check if an output workspace can be kept (incremental mode)
+# * the fingerprint of the current inputs/config is compared with the one recorded next to the output
+def up_to_date(_outputWSFile, _fingerprint):
+    try:
+        return is_up_to_date(_outputWSFile, _fingerprint())
+    except OSError as e:
+        print(color.YELLOW + "[WARNING] Fail to fingerprint {}: {}".format(_outputWSFile, e) + color.END)
+        return False
+
+
+# Function to list the (year, productionMode, mass) conversions to run
+# * with --incremental, the conversions with an unchanged fingerprint are skipped
+#   (not the outputs without the entries sidecar, the signal runner estimates its job costs from it)
+def signal_jobs():
+    jobs = []
+    cfg = import_module(re.sub(".py","", config)).trees2ws_cfg if incremental else None
+    if incremental:
+        from tree2ws import output_fingerprint
+    for y in year:
+        for p in productionMode:
+            for m in mass:
+                if incremental:
+                    c = cfg[m][y]
+                    if os.path.exists(entries_file(c["outputWSFiles"][p])) and up_to_date(c["outputWSFiles"][p], lambda: output_fingerprint(c, p, m, doSystematics, weightColumns, writeCache)):
+                        print("[INFO] Skip unchanged {} {} {}".format(y, p, m))
+                        continue
+                jobs.append((y, p, m))
+    return jobs
+
+
+# Function to get the cost proxy of a conversion: size of the input trees x number of variations
+def job_size(_cfg, y, p, m):
+    nVariations = 1 + len(_cfg[m][y]["systematics"]) if doSystematics else 1
+    return files_size(_cfg[m][y]["inputTreeFiles"][p]) * nVariations
+
+
+# Function to check if the data conversion can be skipped (incremental mode)
+def data_job():
+    if not incremental:
+        return True
+    from tree2ws_data import output_fingerprint
+    cfg = import_module(re.sub(".py","", config)).trees2ws_cfg
+    if up_to_date(cfg["outputWSFile"], lambda: output_fingerprint(cfg)):
+        print("[INFO] Skip unchanged data")
+        return False
+    return True
+
+
+# Function to run one tree2ws conversion inside the pool worker
+# * tree2ws (ROOT, pandas, root_numpy) is imported once per worker and reused by the following tasks
+# * stdout/stderr of python and ROOT are redirected to the log file of the task
+# * a failure is written to the log file and re-raised, run_jobs reports it
+def convert_in_process(job):
+    y, p, m, logName = job
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    stdout, stderr = os.dup(1), os.dup(2)
+    log = open(logName, "w")
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    try:
+        import tree2ws
+        tree2ws.convert(config, y, p, m, doSystematics, weightColumns, chunkSize, writeCache)
+    except (Exception, SystemExit):
+        print(traceback.format_exc())
+        raise
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(stdout, 1)
+        os.dup2(stderr, 2)
+        os.close(stdout)
+        os.close(stderr)
+        log.close()
+
+
+def main_in_process():
+    # create the dir to put log file
+    if not os.path.exists("./logger"):
+        os.system("mkdir ./logger")
+
+    queue = []
+    cfg = import_module(re.sub(".py","", config)).trees2ws_cfg
+    for y, p, m in signal_jobs():
+        key = "tree2ws_{}_{}_{}".format(y, p, m)
+        queue.append(od([("key", key), ("task", (y, p, m, "./logger/{}.txt".format(key))), ("size", job_size(cfg, y, p, m))]))
+
+    print(color.GREEN + "Converting in-process (workers recycled every {} tasks)".format(maxTasksPerChild) + color.END)
+    pprint([q["task"][:3] for q in queue])
+
+    # submit the conversions to the persistent pool, longest first (same history as the conversions in subprocesses)
+    # * run_jobs reports the failed conversions and exits 1
+    run_jobs("runTree2WS_tree2ws", queue, convert_in_process, n, maxTasksPerChild)
 
 
 def main():
@@ -31,26 +139,28 @@ def main():
 
     # create the queue to be submitted
     queue = []
+    opts = ""
+    if chunkSize > 0:
+        opts += " --chunkSize {}".format(chunkSize)
     if script == "tree2ws":
-        for y in year:
-            for p in productionMode:
-                for m in mass:
-                    if (doSystematics):
-                        queue.append("python tree2ws.py --config {} --year {} --productionMode {} --mass {} --doSystematics &> ./logger/tree2ws_{}_{}_{}.txt".format(config, y, p, m, y, p, m))
-                    else:
-                        queue.append("python tree2ws.py --config {} --year {} --productionMode {} --mass {} &> ./logger/tree2ws_{}_{}_{}.txt".format(config, y, p, m, y, p, m))
-    if script == "tree2ws_data":
-        queue.append("python tree2ws_data.py --config {} &> ./logger/tree2ws_data.txt".format(config))
+        if doSystematics:
+            opts += " --doSystematics"
+        if weightColumns:
+            opts += " --weightColumns"
+        if writeCache:
+            opts += " --writeCache"
+        cfg = import_module(re.sub(".py","", config)).trees2ws_cfg
+        for y, p, m in signal_jobs():
+            cmd = "python tree2ws.py --config {} --year {} --productionMode {} --mass {}{} &> ./logger/tree2ws_{}_{}_{}.txt".format(config, y, p, m, opts, y, p, m)
+            queue.append(shell_job(cmd, job_size(cfg, y, p, m)))
+    if script == "tree2ws_data" and data_job():
+        queue.append(shell_job("python tree2ws_data.py --config {} --nWorkers {}{} &> ./logger/tree2ws_data.txt".format(config, n, opts)))
 
     print(color.GREEN + "Executing the following commands" + color.END)
-    pprint(queue)
+    pprint([q["task"] for q in queue])
 
-    # submit the process
-    pool = Pool(n)
-    for i in tqdm(pool.imap_unordered(convert, queue), total=len(queue)):
-        pass
-    pool.close()
-    pool.join()
+    # submit the process: longest first from the wall times of the previous runs
+    run_jobs("runTree2WS_{}".format(script), queue, convert, n)
 
 
 if __name__ == "__main__" :
@@ -80,6 +190,14 @@ if __name__ == "__main__" :
     year            = [int(args.year)] if args.year != "all" else years
     productionMode  = [args.productionMode] if args.productionMode != "all" else productionModes
     doSystematics   = args.doSystematics
+    weightColumns   = args.weightColumns
+    chunkSize       = args.chunkSize
     n               = args.nCPUs
+    maxTasksPerChild= args.maxTasksPerChild
+    incremental     = args.incremental
+    writeCache      = args.writeCache
 
-    main()
\ No newline at end of file
+    if args.inProcess and script == "tree2ws":
+        main_in_process()
+    else:
+        main()
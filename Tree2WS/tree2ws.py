@@ -8,15 +8,17 @@ import ROOT
 import sys
 import os
 import re
+import numpy as np
 import pandas as pd
 from pprint import pprint
 from argparse import ArgumentParser
 from collections import OrderedDict as od
-from root_numpy import array2tree
-from root_pandas import read_root
+from root_numpy import tree2array
 from importlib import import_module
-from commonObjects import inputWSName__, category__, productionModes
-from commonTools import color
+from commonObjects import inputWSName__, category__, categoryCode__, productionModes
+from commonTools import color, partition_by_category, numpy_to_dataset, fill_dataset
+from commonTools import conversion_fingerprint, write_fingerprint, clear_fingerprint, write_cache, clear_cache
+from commonTools import append_cache_part, merge_cache_parts, write_entries
 
 def get_parser():
     parser = ArgumentParser(description="Script to convert data trees to RooWorkspace (compatible for finalFits)")
@@ -25,6 +27,9 @@ def get_parser():
     parser.add_argument("-m",  "--mass",            help="mass point",                                                  default=125,  type=int)
     parser.add_argument("-p",  "--productionMode",  help="Production mode [ggH, VBF, WH, ZH, ttH, bbH]",                default="ggH",type=str)
     parser.add_argument("-ds", "--doSystematics",   help="Add systematics datasets to output WS",                       default=False,action="store_true")
+    parser.add_argument("-wc", "--weightColumns",   help="Store weight systematics as per-category sums of weights",    default=False,action="store_true")
+    parser.add_argument("-cs", "--chunkSize",       help="Stream the input trees in chunks of N entries, bounds the input arrays, the datasets are filled in the workspace (0: read at once)", default=0,  type=int)
+    parser.add_argument("-wk", "--writeCache",      help="Also write a columnar (.npy) cache of the datasets",          default=False,action="store_true")
     return parser
 
 
@@ -58,38 +63,125 @@ def make_argset(_ws, _varNames):
     return _aset
 
 
-def main():
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # 1) Convert tree to pandas dataframe
-    # Create dataframe to store all events in file
-    data = pd.DataFrame()
-    if doSystematics:
-        sdata = pd.DataFrame()
-    print("[INFO] Read file:")
-    pprint(inputTreeFile)
-    data = read_root(inputTreeFile, inputTreeName, columns=TreeVars)
-    data["type"] = "nominal"
+# Function to make a weighted RooDataSet from the columns of a dataframe
+# * _weightColumn: column used as event weight (the alternative weight for weight variations)
+def make_dataset(_ws, _dname, _varNames, _df, _weightColumn="weight"):
+    aset = make_argset(_ws, _varNames)
+    columns = od([(v, _df[v].values) for v in _varNames if v != "weight"])
+    return numpy_to_dataset(_dname, aset, columns, _df[_weightColumn].values)
+
+
+# Function to sum the alternative weights of the events in the mass range of the nominal dataset
+def sum_of_weights(_df, _xvar):
+    inRange = (_df["CMS_higgs_mass"] >= _xvar.getMin()) & (_df["CMS_higgs_mass"] <= _xvar.getMax())
+    return od([(sw, _df.loc[inRange, sw].sum()) for sw in systWeis])
+
+
+# Function to import the sum of an alternative weight of one category into the workspace
+def import_sum_of_weights(_ws, _cat, _systWei, _sumw):
+    vname = "sumw_%d_%s_%s" %(mass, _cat, _systWei.replace("weight_", ""))
+    sumw = ROOT.RooRealVar(vname, vname, float(_sumw))
+    sumw.setConstant(True)
+    getattr(_ws, "import")(sumw, ROOT.RooFit.Silence())
+
+
+# Function to name the dataset of a variation
+def dataset_name(_variation, _cat):
+    if _variation == "nominal":
+        return "set_%d_%s" %(mass, _cat)
+    return "set_%d_%s_%s" %(mass, _cat, _variation)
+
+
+# Function to list the fields of the cache array of a variation
+# * _extraColumns: additional columns kept in the cache (the alternative weights of the nominal variation)
+def cache_dtype(_extraColumns=[]):
+    return [(f, np.float64) for f in ["CMS_higgs_mass", "weight"] + _extraColumns]
+
+
+# Function to build the cache array of the events of one frame, in the same mass range as the RooDataSets
+def cache_part(_df, _weightColumn, _xvar, _extraColumns=[]):
+    m = _df["CMS_higgs_mass"].values
+    inRange = (m >= _xvar.getMin()) & (m <= _xvar.getMax())
+    part = np.empty(np.count_nonzero(inRange), dtype=cache_dtype(_extraColumns))
+    part["CMS_higgs_mass"] = m[inRange]
+    part["weight"] = _df[_weightColumn].values[inRange]
+    for c in _extraColumns:
+        part[c] = _df[c].values[inRange]
+    return part
+
+
+# Function to build the cache array of one variation from per-category frames, events sorted by category
+def cache_array(_cframes, _weightColumn, _xvar, _extraColumns=[]):
+    parts, catIndex, start = [], od(), 0
+    for cat, df in _cframes.items():
+        part = cache_part(df, _weightColumn, _xvar, _extraColumns)
+        parts.append(part)
+        catIndex[cat] = (start, start + len(part))
+        start += len(part)
+    return np.concatenate(parts), catIndex
+
+
+# Function to list the columns kept in the cache besides mass and weight
+def cache_columns(_variation):
+    return systWeis if (_variation == "nominal" and doSystematics) else []
 
-    # For systematics trees: only for events in experimental phase space
-    rate_syst_list = []
+
+# Function to list the variations filled from each input tree: {tree name: [(variation, weight column)]}
+# * the nominal tree also provides the weight variations, unless they are stored as sums of weights
+def tree_variations():
+    variations = od()
+    variations[inputTreeName] = [("nominal", "weight")]
     if doSystematics:
-        sdf = pd.DataFrame()
+        if not weightColumns:
+            variations[inputTreeName] += [(sw.replace("weight_", ""), sw) for sw in systWeis]
         for s in systematics:
-            streeName = "{}_{}".format(inputTreeName, s)
-            sdf = read_root(inputTreeFile, streeName, columns=TreeVars)
-            sdf["type"] = s
-            sdata = pd.concat([sdata, sdf], ignore_index=True, axis=0, sort=False)
-
-        for sw in systWeis:
-            sdf = read_root(inputTreeFile, inputTreeName, columns=TreeVars+[sw]).drop("weight", axis=1).rename(columns={sw: "weight"})
-            rate_syst = sw.replace("weight_", "")
-            rate_syst_list.append(rate_syst)
-            sdf["type"] = rate_syst
-            sdata = pd.concat([sdata, sdf], ignore_index=True, axis=0, sort=False)
+            variations["{}_{}".format(inputTreeName, s)] = [(s, "weight")]
+    return variations
 
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # 2) Convert pandas dataframe to RooWorkspace
-    # Define output workspace file
+
+# Function to get the kind of a variation in the entries sidecar: nominal, weight (nominal tree) or shape (shifted tree)
+def variation_kind(_treeName, _variation):
+    if _variation == "nominal":
+        return "nominal"
+    return "weight" if _treeName == inputTreeName else "shape"
+
+
+# Function to make an empty record of the entries of the datasets: {kind: {variation: {cat: entries}}}
+def empty_entries():
+    return od([(kind, od()) for kind in ["nominal", "weight", "shape"]])
+
+
+# Function to open the input files (once per session)
+def open_files(_inputTreeFiles):
+    if not isinstance(_inputTreeFiles, list):
+        _inputTreeFiles = [_inputTreeFiles]
+    fins = []
+    for fname in _inputTreeFiles:
+        fin = ROOT.TFile.Open(fname, "READ")
+        if (not fin) or fin.IsZombie():
+            print("[ERROR] Fail to open file {}".format(fname))
+            sys.exit(1)
+        fins.append(fin)
+    return fins
+
+
+# Function to get a tree from an input file
+def get_tree(_fin, _treeName):
+    tree = _fin.Get(_treeName)
+    if not tree:
+        print("[ERROR] Fail to get tree {} from {}".format(_treeName, _fin.GetName()))
+        sys.exit(1)
+    return tree
+
+
+# Function to iterate over a tree in chunks of fixed size
+def iterate_tree(_tree, _branches, _chunkSize):
+    for start in range(0, _tree.GetEntries(), _chunkSize):
+        yield pd.DataFrame(tree2array(_tree, branches=_branches, start=start, stop=start + _chunkSize))
+
+
+# Function to create the output file and the workspace
+def open_workspace():
     outputWSDir = os.path.dirname(outputWSFile)
     if not os.path.exists(outputWSDir):
         os.system("mkdir -p %s" %outputWSDir)
@@ -98,97 +190,185 @@ def main():
     foutdir = fout.mkdir(inputWSName__.split("/")[0])
     foutdir.cd()
     ws = ROOT.RooWorkspace(inputWSName__.split("/")[1], inputWSName__.split("/")[1])
+    return fout, ws
 
-    # Add variables to workspace
-    varNames = add_vars_to_workspace(ws, data.columns)
-
-    # Loop over cats
-    for cat in category__:
-        # a) make RooDataSets:
-        mask = category__[cat]
-        # Convert dataframe to structured array, then to ROOT tree
-        sa = data.query(mask).drop("type", axis=1).to_records()
-        t = array2tree(sa)
-        # Add dataset to worksapce
-        dname = "set_%d_%s" %(mass, cat)
-
-        # Make argset
-        aset = make_argset(ws, varNames)
-
-        # Convert tree to RooDataset and add to workspace
-        dset = ROOT.RooDataSet(dname, dname, t, aset, "", "weight")
-        getattr(ws, "import")(dset)
-
-        # Delete trees and RooDataSet from heap
-        t.Delete()
-        dset.Delete()
-        del sa
-
-        if doSystematics:
-            for s in systematics:
-                # Create mask for systematic variation
-                sa = sdata[sdata["type"] == s].query(category__[cat]).drop("type", axis=1).to_records()
-                t = array2tree(sa)
-
-                # Make argset
-                aset_unc = make_argset(ws, systematicsVars)
-                dname_unc = "set_%d_%s_%s" %(mass, cat, s)
-                dset_unc = ROOT.RooDataSet(dname_unc, dname_unc, t, aset_unc, "", "weight")
-
-                # Add to workspace
-                getattr(ws, "import")(dset_unc)
-
-                # Delete trees and RooDataHist
-                t.Delete()
-                dset_unc.Delete()
-                del sa
-
-            for sw in rate_syst_list:
-                # Create mask for systematic variation
-                sa = sdata[sdata["type"] == sw].query(category__[cat]).drop("type", axis=1).to_records()
-                t = array2tree(sa)
-
-                # Make argset
-                aset_unc = make_argset(ws, systematicsVars)
-                dname_unc = "set_%d_%s_%s" %(mass, cat, sw)
-                dset_unc = ROOT.RooDataSet(dname_unc, dname_unc, t, aset_unc, "", "weight")
-
-                # Add to workspace
-                getattr(ws, "import")(dset_unc)
-
-                # Delete trees and RooDataHist
-                t.Delete()
-                dset_unc.Delete()
-                del sa
 
-    # Write WS to file
-    ws.Write()
-    fout.Close()
-    ws.Delete()
+# Function to write the workspace and close the output file
+def close_workspace(_fout, _ws):
+    _fout.cd(inputWSName__.split("/")[0])
+    _ws.Write()
+    _fout.Close()
+    _ws.Delete()
 
 
-if __name__ == "__main__" :
-    print(" ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ HLLG TREE 2 WS ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ")
-    # Extract information from config file:
-    parser = get_parser()
-    args = parser.parse_args()
+# Function to read several trees from the input files in one session
+# * each input file is opened only once and every requested tree is read columnar
+# * _treeColumns: {tree name: list of branches to read}
+def read_trees(_inputTreeFiles, _treeColumns):
+    arrays = od([(t, []) for t in _treeColumns.keys()])
+    for fin in open_files(_inputTreeFiles):
+        for t, columns in _treeColumns.items():
+            arrays[t].append(tree2array(get_tree(fin, t), branches=columns))
+        fin.Close()
+
+    return od([(t, pd.DataFrame(a[0] if len(a) == 1 else np.concatenate(a))) for t, a in arrays.items()])
+
+
+# Function to split a dataframe into per-category frames
+# * one stable sort on the category codes, each category is a contiguous slice afterwards
+def split_by_category(_df):
+    order, catSlices = partition_by_category(_df["category"].values, categoryCode__)
+    _df = _df.iloc[order]
+    return od([(cat, _df.iloc[sl]) for cat, sl in catSlices.items()])
 
-    if args.config is None:
-        print("Please specify the config file! eg. config")
-        parser.print_help()
-        sys.exit(1)
 
-    # Extract arguments
-    mass            = args.mass
-    year            = args.year
-    productionMode  = args.productionMode
-    doSystematics   = args.doSystematics
+def main():
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # 1) Convert trees to pandas dataframes
+    # Read the nominal tree (with all the weight variations) and the shifted trees in one pass
+    # * one columnar block per tree, the blocks are never concatenated
+    variations = tree_variations()
+    treeColumns = od()
+    for treeName in variations.keys():
+        treeColumns[treeName] = TreeVars + systWeis if (treeName == inputTreeName and doSystematics) else TreeVars
+    print("[INFO] Read file:")
+    pprint(inputTreeFile)
+    blocks = read_trees(inputTreeFile, treeColumns)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # 2) Convert pandas dataframes to RooWorkspace
+    # Define output workspace file
+    fout, ws = open_workspace()
+
+    # Add variables to workspace
+    varNames = add_vars_to_workspace(ws, TreeVars)
+    xvar = ws.var("CMS_higgs_mass")
+
+    # Loop over blocks: partition by category, make the RooDataSets of every variation and free the block
+    # * weight variations share the events of the nominal block, only the weight column differs
+    entries = empty_entries()
+    for treeName, treeVariations in variations.items():
+        cblock = split_by_category(blocks.pop(treeName))
+        for v, wcol in treeVariations:
+            entries[variation_kind(treeName, v)][v] = od([(cat, len(df)) for cat, df in cblock.items()])
+            dvars = varNames if v == "nominal" else systematicsVars
+            for cat, df in cblock.items():
+                dset = make_dataset(ws, dataset_name(v, cat), dvars, df, wcol)
+                getattr(ws, "import")(dset)
+
+                # Delete RooDataSet from heap
+                dset.Delete()
+
+            if writeCache:
+                write_cache(outputWSFile, v, *cache_array(cblock, wcol, xvar, cache_columns(v)))
+
+        # Sum of alternative weights per category in the same mass range as the nominal dataset
+        if treeName == inputTreeName and doSystematics and weightColumns:
+            for cat, df in cblock.items():
+                for sw, val in sum_of_weights(df, xvar).items():
+                    import_sum_of_weights(ws, cat, sw, val)
+        del cblock
+
+    # Write WS to file
+    close_workspace(fout, ws)
+    return entries
+
+
+def main_streaming():
+    # Streaming mode: read the trees in chunks of chunkSize entries and fill the per-category
+    # slices of every chunk straight into the datasets of the workspace
+    # * bounded by chunkSize: the input arrays, and the cache (appended to part files on disk chunk by chunk)
+    # * not bounded: the workspace, it holds the only copy of the datasets until it is written
+    print("[INFO] Read file in chunks of {} entries:".format(chunkSize))
+    pprint(inputTreeFile)
+    fins = open_files(inputTreeFile)
+
+    fout, ws = open_workspace()
+    varNames = add_vars_to_workspace(ws, TreeVars)
+    xvar = ws.var("CMS_higgs_mass")
+    sumw = od([((cat, sw), 0.) for cat in category__ for sw in systWeis]) if (doSystematics and weightColumns) else od()
+    entries = empty_entries()
+
+    for treeName, variations in tree_variations().items():
+        nominalTree = (treeName == inputTreeName)
+        branches = TreeVars + systWeis if (nominalTree and doSystematics) else TreeVars
+
+        # Datasets of the variations in this tree, imported empty and filled in the workspace
+        dsets, dvars = od(), od()
+        for v, _ in variations:
+            dvars[v] = varNames if v == "nominal" else systematicsVars
+            aset = make_argset(ws, dvars[v])
+            entries[variation_kind(treeName, v)][v] = od([(cat, 0) for cat in category__])
+            for cat in category__:
+                dname = dataset_name(v, cat)
+                dset = ROOT.RooDataSet(dname, dname, aset, "weight")
+                getattr(ws, "import")(dset)
+                dset.Delete()
+                dsets[(v, cat)] = ws.data(dname)
+
+        for fin in fins:
+            for chunk in iterate_tree(get_tree(fin, treeName), branches, chunkSize):
+                for cat, df in split_by_category(chunk).items():
+                    for v, wcol in variations:
+                        columns = od([(var, df[var].values) for var in dvars[v] if var != "weight"])
+                        fill_dataset(dsets[(v, cat)], columns, df[wcol].values)
+                        entries[variation_kind(treeName, v)][v][cat] += len(df)
+                        if writeCache:
+                            append_cache_part(outputWSFile, v, cat, cache_part(df, wcol, xvar, cache_columns(v)))
+                    if nominalTree and doSystematics and weightColumns:
+                        for sw, val in sum_of_weights(df, xvar).items():
+                            sumw[(cat, sw)] += val
+
+        # Cache of the variations in this tree, merged from the part files
+        if writeCache:
+            for v, _ in variations:
+                merge_cache_parts(outputWSFile, v, category__, cache_dtype(cache_columns(v)))
+
+    for (cat, sw), val in sumw.items():
+        import_sum_of_weights(ws, cat, sw, val)
+
+    for fin in fins:
+        fin.Close()
+    close_workspace(fout, ws)
+    return entries
+
+
+# Function to compute the fingerprint of the workspace of one (year, productionMode, mass)
+# * _cfg: config entry trees2ws_cfg[mass][year]; the read mode (chunkSize) does not change the output
+def output_fingerprint(_cfg, _productionMode, _mass, _doSystematics, _weightColumns, _writeCache=False):
+    payload = od()
+    payload["inputTreeName"]    = _cfg["inputTreeName"]
+    payload["TreeVars"]         = _cfg["TreeVars"]
+    payload["systWeis"]         = _cfg["systWeis"]
+    payload["systematicsVars"]  = _cfg["systematicsVars"]
+    payload["systematics"]      = _cfg["systematics"]
+    payload["category"]         = list(category__.items())
+    payload["mass"]             = int(_mass)
+    payload["doSystematics"]    = _doSystematics
+    payload["weightColumns"]    = _weightColumns
+    payload["writeCache"]       = _writeCache
+    return conversion_fingerprint(_cfg["inputTreeFiles"][_productionMode], payload)
+
+
+# Function to convert the tree of one (year, productionMode, mass) to a workspace
+# * reusable in-process entry point (e.g. from a persistent worker pool in runTree2WS.py)
+def convert(_config, _year, _productionMode, _mass, _doSystematics=False, _weightColumns=False, _chunkSize=0, _writeCache=False):
+    global mass, year, productionMode, doSystematics, weightColumns, chunkSize, writeCache
+    global inputTreeFile, inputTreeName, outputWSFile, TreeVars, systWeis, systematicsVars, systematics
+
+    mass            = int(_mass)
+    year            = int(_year)
+    productionMode  = _productionMode
+    doSystematics   = _doSystematics
+    weightColumns   = _weightColumns
+    chunkSize       = _chunkSize
+    writeCache      = _writeCache
     if productionMode not in productionModes:
         print("Available modes: {}".format(productionModes))
         sys.exit(1)
 
     # Import config options
-    cfg = import_module(re.sub(".py","", args.config)).trees2ws_cfg[mass][year]
+    cfg = import_module(re.sub(".py","", _config)).trees2ws_cfg[mass][year]
     inputTreeFile    = cfg["inputTreeFiles"][productionMode]
     inputTreeName    = cfg["inputTreeName"]
     outputWSFile     = cfg["outputWSFiles"][productionMode]
@@ -198,5 +378,27 @@ if __name__ == "__main__" :
     systematics      = cfg["systematics"]
 
     print(color.GREEN + "Converting {} {} @ {}GeV tree to workspace".format(year, productionMode, mass) + color.END)
-    main()
-    print(" ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ HLLG TREE 2 WS (END) ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
\ No newline at end of file
+    fingerprint = output_fingerprint(cfg, productionMode, mass, doSystematics, weightColumns, writeCache)
+    clear_fingerprint(outputWSFile)
+    clear_cache(outputWSFile)
+    if chunkSize > 0:
+        entries = main_streaming()
+    else:
+        entries = main()
+    write_entries(outputWSFile, entries)
+    write_fingerprint(outputWSFile, fingerprint)
+
+
+if __name__ == "__main__" :
+    print(" ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ HLLG TREE 2 WS ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ")
+    # Extract information from config file:
+    parser = get_parser()
+    args = parser.parse_args()
+
+    if args.config is None:
+        print("Please specify the config file! eg. config")
+        parser.print_help()
+        sys.exit(1)
+
+    convert(args.config, args.year, args.productionMode, args.mass, args.doSystematics, args.weightColumns, args.chunkSize, args.writeCache)
+    print(" ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ HLLG TREE 2 WS (END) ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
@@ -2,16 +2,22 @@ import ROOT
 import sys
 import os
 import re
+import numpy as np
 from pprint import pprint
 from argparse import ArgumentParser
+from multiprocessing import Pool
 from collections import OrderedDict as od
-from root_numpy import array2tree, tree2array
+from root_numpy import root2array, tree2array
 from importlib import import_module
-from commonObjects import inputWSName__, category__, productionModes
+from commonObjects import inputWSName__, category__, categoryCode__, productionModes
+from commonTools import partition_by_category, fill_dataset
+from commonTools import conversion_fingerprint, write_fingerprint, clear_fingerprint
 
 def get_parser():
     parser = ArgumentParser(description="Script to convert data trees to RooWorkspace (compatible for finalFits)")
-    parser.add_argument("-c", "--config", help="Input config: specify list of variables/analysis categories", default=None, type=str)
+    parser.add_argument("-c",  "--config",   help="Input config: specify list of variables/analysis categories", default=None, type=str)
+    parser.add_argument("-nw", "--nWorkers", help="Number of processes used to read the input files in parallel", default=1,    type=int)
+    parser.add_argument("-cs", "--chunkSize",help="Stream the input trees in chunks of N entries, bounds the input arrays, the datasets are filled in the workspace (0: read at once)", default=0,  type=int)
     return parser
 
 
@@ -42,13 +48,56 @@ def make_argset(_ws, _varNames):
     return _aset
 
 
+# Function to read the branches of one input file (worker of the parallel read)
+def read_file(_args):
+    fname, treeName, branches = _args
+    return root2array(fname, treeName, branches=branches)
+
+
+# Function to read the whole chain once
+# * with _nWorkers > 1 the input files are read by a pool of processes
+def read_chain(_inputTreeFiles, _inputTreeName, _branches, _nWorkers=1):
+    if _nWorkers <= 1:
+        return root2array(_inputTreeFiles, _inputTreeName, branches=_branches)
+
+    pool = Pool(_nWorkers)
+    arrays = pool.map(read_file, [(f, _inputTreeName, _branches) for f in _inputTreeFiles])
+    pool.close()
+    pool.join()
+    return np.concatenate(arrays)
+
+
+# Function to iterate over the input files in chunks of fixed size (streaming mode)
+def iterate_chain(_inputTreeFiles, _inputTreeName, _branches, _chunkSize):
+    for fname in _inputTreeFiles:
+        fin = ROOT.TFile.Open(fname, "READ")
+        if (not fin) or fin.IsZombie():
+            print("[ERROR] Fail to open file {}".format(fname))
+            sys.exit(1)
+        tree = fin.Get(_inputTreeName)
+        for start in range(0, tree.GetEntries(), _chunkSize):
+            yield tree2array(tree, branches=_branches, start=start, stop=start + _chunkSize)
+        fin.Close()
+
+
+# Function to compute the fingerprint of the data workspace (_cfg: trees2ws_cfg of the data config)
+def output_fingerprint(_cfg):
+    payload = od()
+    payload["inputTreeName"]    = _cfg["inputTreeName"]
+    payload["TreeVars"]         = _cfg["TreeVars"]
+    payload["category"]         = list(category__.items())
+    return conversion_fingerprint(_cfg["inputTreeFiles"], payload)
+
+
 def main():
-    # Read the input ROOT files
+    # Read the input ROOT files: one columnar read of the chain (or chunk by chunk in streaming mode)
     print("[INFO] Read file:")
     pprint(inputTreeFiles)
-    chain = ROOT.TChain(inputTreeName)
-    for i in inputTreeFiles:
-        chain.Add(i)
+    branches = TreeVars if "category" in TreeVars else TreeVars + ["category"]
+    if args.chunkSize > 0:
+        chunks = iterate_chain(inputTreeFiles, inputTreeName, branches, args.chunkSize)
+    else:
+        chunks = [read_chain(inputTreeFiles, inputTreeName, branches, args.nWorkers)]
 
     # Open output ROOT file and initiate workspace to store RooDataSets
     outputWSDir = os.path.dirname(outputWSFile)
@@ -63,28 +112,27 @@ def main():
     # Add variables to workspace
     varNames = add_vars_to_workspace(ws, TreeVars) # Add variables to workspace
 
-    # Make argset
+    # Make argset and define dataset per cat, imported empty and filled in the workspace
     aset = make_argset(ws, varNames)
+    dsets = od()
     for cat in category__:
-        array_cat = tree2array(chain, branches=TreeVars, selection=category__[cat])
-        tree_cat = array2tree(array_cat)
-
-        # Define dataset for cat
         dname = "data_obs_{}".format(cat)
         dset = ROOT.RooDataSet(dname, dname, aset, "weight")
-
-        # Loop over events in tree and add to dataset with weight 1
-        for ev in range(tree_cat.GetEntries()):
-            tree_cat.GetEntry(ev)
-            for var in TreeVars:
-                if var != "weight":
-                    ws.var(var).setVal(getattr(tree_cat, var))
-            dset.add(aset, 1.)
-
-        # Add dataset to worksapce
         getattr(ws, "import")(dset)
+        dset.Delete()
+        dsets[cat] = ws.data(dname)
+
+    # Split the events by category and bulk-insert them with weight 1
+    for events in chunks:
+        order, catSlices = partition_by_category(events["category"], categoryCode__)
+        events = events[order]
+        for cat, dset in dsets.items():
+            events_cat = events[catSlices[cat]]
+            columns = od([(var, events_cat[var]) for var in varNames if var != "weight"])
+            fill_dataset(dset, columns, np.ones(len(events_cat)))
 
     # Write workspace to file
+    foutdir.cd()
     ws.Write()
     ws.Delete()
     fout.Close()
@@ -108,5 +156,8 @@ if __name__ == "__main__" :
     outputWSFile     = cfg["outputWSFile"]
     TreeVars         = cfg["TreeVars"]
 
+    fingerprint = output_fingerprint(cfg)
+    clear_fingerprint(outputWSFile)
     main()
+    write_fingerprint(outputWSFile, fingerprint)
     print(" ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ HLLG TREES 2 WS (END) ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
\ No newline at end of file
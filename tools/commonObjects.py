@@ -30,6 +30,8 @@ yearsStr = [
     "2017",
     "2018"
 ]
+# Label of the year-merged signal models: one fit of the concatenated datasets of yearsStr (signalFit.py --year combined)
+mergedYear = "combined"
 eras = ["UL2016preVFP", "UL2016postVFP", "UL2017", "UL2018"]
 
 # Constants
@@ -72,6 +74,9 @@ category__["Merged1Gsf_EBLR9"]  = "category == 11"
 category__["Merged1Gsf_EE"]     = "category == 12"
 category__["Resolved"]          = "category == 13"
 
+# Precompiled category codes of the "category" branch: {cat: code}
+categoryCode__ = od([(cat, int(mask.split("==")[-1])) for cat, mask in category__.items()])
+
 categoryTag = od()
 categoryTag["M2Untag"] = ["Merged2Gsf_EBHR9", "Merged2Gsf_EBLR9", "Merged2Gsf_EE"]
 categoryTag["M1Untag"] = ["Merged1Gsf_EBHR9", "Merged1Gsf_EBLR9", "Merged1Gsf_EE"]
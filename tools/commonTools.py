@@ -2,6 +2,10 @@ import os, sys
 import re
 import ROOT
 import math
+import json
+import hashlib
+import tempfile
+import numpy as np
 from glob import glob
 from collections import OrderedDict as ods
 
@@ -28,6 +32,320 @@ def rooiter(x):
         ret = iter.Next()
 
 
+# Function to get the values of the vars in a RooArgSet (e.g. RooFitResult.floatParsFinal()) as {name: value}
+def argset_to_dict(_argset):
+    return ods([(v.GetName(), v.getVal()) for v in rooiter(_argset)])
+
+
+# Function to get the errors of the vars in a RooArgSet as {name: error}
+def argset_errors_to_dict(_argset):
+    return ods([(v.GetName(), v.getError()) for v in rooiter(_argset)])
+
+
+# Function to partition events by analysis category with a single stable sort
+# * _codes: array of the "category" branch, _categoryCodes: {cat: code} (commonObjects.categoryCode__)
+# * returns the sorting order and a slice of the sorted events per category
+def partition_by_category(_codes, _categoryCodes):
+    _codes = np.asarray(_codes)
+    order = np.argsort(_codes, kind="mergesort")
+    sortedCodes = _codes[order]
+    codes = np.array(list(_categoryCodes.values()))
+    lo = np.searchsorted(sortedCodes, codes, side="left")
+    hi = np.searchsorted(sortedCodes, codes, side="right")
+    return order, ods([(cat, slice(l, h)) for cat, l, h in zip(_categoryCodes.keys(), lo, hi)])
+
+
+# C++ helpers for bulk transfers between NumPy buffers and RooDataSets
+# * the per-event loop runs in compiled code, one PyROOT call per dataset
+# * arrays are column-major: values[j * nEntries + i] is var j of event i
+_bulkHelpersCode = """
+#include "RooArgList.h"
+#include "RooArgSet.h"
+#include "RooDataSet.h"
+#include "RooRealVar.h"
+#include <vector>
+
+void hllgFillDataSet(RooDataSet& ds, RooArgList& vars, const double* values, const double* weights, Long64_t nEntries)
+{
+    const int nVars = vars.getSize();
+    RooArgSet row(vars);
+    for (Long64_t i = 0; i < nEntries; ++i) {
+        for (int j = 0; j < nVars; ++j)
+            static_cast<RooRealVar&>(vars[j]).setVal(values[j * nEntries + i]);
+        ds.add(row, weights[i]);
+    }
+}
+
+void hllgDataSetToArrays(const RooDataSet& ds, const RooArgList& vars, double* values, double* weights)
+{
+    const Long64_t nEntries = ds.numEntries();
+    const int nVars = vars.getSize();
+    // the dataset loads every entry into the same row, resolve the vars once
+    const RooArgSet* row = ds.get();
+    std::vector<const RooAbsReal*> cols(nVars);
+    for (int j = 0; j < nVars; ++j)
+        cols[j] = static_cast<const RooAbsReal*>(row->find(vars[j].GetName()));
+    for (Long64_t i = 0; i < nEntries; ++i) {
+        ds.get(i);
+        for (int j = 0; j < nVars; ++j)
+            values[j * nEntries + i] = cols[j]->getVal();
+        weights[i] = ds.weight();
+    }
+}
+"""
+_bulkHelpersDeclared = False
+
+
+def _declare_bulk_helpers():
+    global _bulkHelpersDeclared
+    if not _bulkHelpersDeclared:
+        ROOT.gInterpreter.Declare(_bulkHelpersCode)
+        _bulkHelpersDeclared = True
+
+
+# Function to append NumPy buffers to a weighted RooDataSet in one bulk call
+# * _columns: {var name: array}, _weights: array of event weights
+# * events outside the var ranges are dropped, as in the RooDataSet(TTree) constructor
+def fill_dataset(_dset, _columns, _weights):
+    _declare_bulk_helpers()
+    row = _dset.get()
+    names = list(_columns.keys())
+    mask = np.ones(len(_weights), dtype=bool)
+    for name in names:
+        var = row.find(name)
+        mask &= (_columns[name] >= var.getMin()) & (_columns[name] <= var.getMax())
+
+    nEntries = int(np.count_nonzero(mask))
+    values = np.empty((len(names), nEntries), dtype=np.float64)
+    for j, name in enumerate(names):
+        values[j] = np.asarray(_columns[name])[mask]
+    weights = np.ascontiguousarray(np.asarray(_weights, dtype=np.float64)[mask])
+
+    vars = ROOT.RooArgList()
+    for name in names:
+        vars.add(row.find(name))
+    ROOT.hllgFillDataSet(_dset, vars, values.ravel(), weights, nEntries)
+    return _dset
+
+
+# Function to build a weighted RooDataSet (vector store) straight from NumPy buffers
+# * _argset must contain the vars in _columns and the weight var _weightVarName
+def numpy_to_dataset(_name, _argset, _columns, _weights, _weightVarName="weight"):
+    dset = ROOT.RooDataSet(_name, _name, _argset, _weightVarName)
+    return fill_dataset(dset, _columns, _weights)
+
+
+# Function to write a JSON file atomically (temporary file in the same directory + rename),
+# an interrupted job never leaves a truncated file behind and concurrent writers never share a temporary file
+def write_json(_fname, _obj):
+    outDir = os.path.dirname(_fname) or "."
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    fd, tmp = tempfile.mkstemp(dir=outDir, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(_obj, f, indent=2)
+    os.rename(tmp, _fname)
+
+
+# Function to read a JSON file written by write_json, an empty dict if the file is missing or unreadable
+def read_json(_fname):
+    if not os.path.exists(_fname):
+        return ods()
+    try:
+        with open(_fname) as f:
+            return json.load(f, object_pairs_hook=ods)
+    except ValueError:
+        print("[WARNING] Ignore the unreadable JSON file {}".format(_fname))
+        return ods()
+
+
+# Function to compute the fingerprint of a conversion (incremental rebuilds)
+# * covers path, size and mtime of the input files plus a json-serialisable payload (config entries, options)
+def conversion_fingerprint(_inputFiles, _payload):
+    if not isinstance(_inputFiles, list):
+        _inputFiles = [_inputFiles]
+    files = []
+    for fname in _inputFiles:
+        st = os.stat(fname)
+        files.append([fname, st.st_size, int(st.st_mtime)])
+    content = json.dumps({"inputFiles": files, "payload": _payload}, sort_keys=True)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+# The fingerprint of an output file is stored in a sidecar "<output>.fingerprint"
+def fingerprint_file(_outputFile):
+    return "{}.fingerprint".format(_outputFile)
+
+
+# Function to check if an output file exists and was produced from the inputs with this fingerprint
+def is_up_to_date(_outputFile, _fingerprint):
+    if not (os.path.exists(_outputFile) and os.path.exists(fingerprint_file(_outputFile))):
+        return False
+    with open(fingerprint_file(_outputFile)) as f:
+        return f.read().strip() == _fingerprint
+
+
+# Function to record the fingerprint once the output file is written
+def write_fingerprint(_outputFile, _fingerprint):
+    with open(fingerprint_file(_outputFile), "w") as f:
+        f.write(_fingerprint + "\n")
+
+
+# Function to invalidate the fingerprint before an output file is rewritten
+def clear_fingerprint(_outputFile):
+    if os.path.exists(fingerprint_file(_outputFile)):
+        os.remove(fingerprint_file(_outputFile))
+
+
+# Entries of the datasets of a Tree2WS workspace, stored in a sidecar "<output>.entries.json"
+# * {kind: {variation: {cat: entries}}}, kind: nominal, weight (alternative weights) or shape (shifted trees)
+# * the runners estimate the cost of the jobs from it without opening the workspaces
+def entries_file(_outputFile):
+    return "{}.entries.json".format(_outputFile)
+
+
+def write_entries(_outputFile, _entries):
+    write_json(entries_file(_outputFile), _entries)
+
+
+# Function to read the entries of a workspace, an empty dict if the sidecar is missing
+def read_entries(_outputFile):
+    return read_json(entries_file(_outputFile))
+
+
+# Columnar cache written next to a Tree2WS workspace ("<output without .root>_cache/")
+# * one structured .npy per variation (CMS_higgs_mass, weight, ...), events sorted by category
+# * index.json: {variation: {cat: [start, stop]}}
+# * arrays are loaded memory-mapped, no ROOT needed downstream
+def cache_dir(_outputWSFile):
+    return "{}_cache".format(re.sub(".root$", "", _outputWSFile))
+
+
+def _read_cache_index(_cacheDir):
+    return read_json("{}/index.json".format(_cacheDir))
+
+
+# Function to remove the cache of an output file before it is rewritten
+def clear_cache(_outputWSFile):
+    cdir = cache_dir(_outputWSFile)
+    if os.path.isdir(cdir):
+        for fname in glob("{}/*".format(cdir)):
+            os.remove(fname)
+        os.rmdir(cdir)
+
+
+def _write_cache_index(_cacheDir, _variation, _catIndex):
+    index = _read_cache_index(_cacheDir)
+    index[_variation] = ods([(cat, [int(lo), int(hi)]) for cat, (lo, hi) in _catIndex.items()])
+    write_json("{}/index.json".format(_cacheDir), index)
+
+
+# Function to write the events of one variation to the cache
+# * _array: structured array sorted by category, _catIndex: {cat: (start, stop)}
+def write_cache(_outputWSFile, _variation, _array, _catIndex):
+    cdir = cache_dir(_outputWSFile)
+    if not os.path.isdir(cdir):
+        os.makedirs(cdir)
+    np.save("{}/{}.npy".format(cdir, _variation), _array)
+    _write_cache_index(cdir, _variation, _catIndex)
+
+
+# Raw part file of one variation and category, filled chunk by chunk ("<variation>_<cat>.part")
+def _cache_part_file(_cacheDir, _variation, _cat):
+    return "{}/{}_{}.part".format(_cacheDir, _variation, _cat)
+
+
+# Function to append the events of one chunk to the part file of a variation and category
+# * _array: structured array, all the parts of a variation must share its dtype
+def append_cache_part(_outputWSFile, _variation, _cat, _array):
+    cdir = cache_dir(_outputWSFile)
+    if not os.path.isdir(cdir):
+        os.makedirs(cdir)
+    with open(_cache_part_file(cdir, _variation, _cat), "ab") as f:
+        _array.tofile(f)
+
+
+# Function to merge the part files of one variation into its cache array, the parts are removed
+# * the .npy is filled memory-mapped, one category at a time: the events are never all in memory
+def merge_cache_parts(_outputWSFile, _variation, _cats, _dtype):
+    cdir = cache_dir(_outputWSFile)
+    if not os.path.isdir(cdir):
+        os.makedirs(cdir)
+    dtype = np.dtype(_dtype)
+    sizes = ods()
+    for cat in _cats:
+        fname = _cache_part_file(cdir, _variation, cat)
+        sizes[cat] = os.path.getsize(fname) // dtype.itemsize if os.path.exists(fname) else 0
+
+    catIndex, start = ods(), 0
+    for cat, n in sizes.items():
+        catIndex[cat] = (start, start + n)
+        start += n
+
+    fname = "{}/{}.npy".format(cdir, _variation)
+    if start == 0:
+        np.save(fname, np.empty(0, dtype=dtype))
+    else:
+        array = np.lib.format.open_memmap(fname, mode="w+", dtype=dtype, shape=(start,))
+        for cat, (lo, hi) in catIndex.items():
+            if hi > lo:
+                array[lo:hi] = np.memmap(_cache_part_file(cdir, _variation, cat), dtype=dtype, mode="r")
+        array.flush()
+        del array
+    for cat in _cats:
+        if os.path.exists(_cache_part_file(cdir, _variation, cat)):
+            os.remove(_cache_part_file(cdir, _variation, cat))
+    _write_cache_index(cdir, _variation, catIndex)
+
+
+# Function to list the variations stored in the cache of an output file
+def cache_variations(_outputWSFile):
+    return list(_read_cache_index(cache_dir(_outputWSFile)).keys())
+
+
+# Function to load the events of one variation from the cache (memory-mapped)
+# * _cat: return only the events of this category (a view of the mapped array)
+def load_cache(_outputWSFile, _variation="nominal", _cat=None):
+    cdir = cache_dir(_outputWSFile)
+    index = _read_cache_index(cdir)
+    if _variation not in index:
+        print("[ERROR] No variation {} in cache {}".format(_variation, cdir))
+        sys.exit(1)
+    array = np.load("{}/{}.npy".format(cdir, _variation), mmap_mode="r")
+    if _cat is None:
+        return array
+    lo, hi = index[_variation][_cat]
+    return array[lo:hi]
+
+
+# Function to extract whole columns of a RooDataSet in one bulk call
+# * _vars: names (or RooAbsArgs) of the vars to extract
+# * returns {var name: array} of contiguous arrays, plus the event weights as "weight" if _weight
+def dataset_to_numpy(_dset, _vars, _weight=True):
+    _declare_bulk_helpers()
+    if not isinstance(_vars, (list, tuple)):
+        _vars = [_vars]
+    names = [v if isinstance(v, str) else v.GetName() for v in _vars]
+    row = _dset.get()
+    vars = ROOT.RooArgList()
+    for name in names:
+        var = row.find(name)
+        if not var:
+            print("[ERROR] No var {} in dataset {}".format(name, _dset.GetName()))
+            sys.exit(1)
+        vars.add(var)
+
+    nEntries = _dset.numEntries()
+    values = np.empty(len(names) * nEntries, dtype=np.float64)
+    weights = np.empty(nEntries, dtype=np.float64)
+    ROOT.hllgDataSetToArrays(_dset, vars, values, weights)
+
+    columns = ods([(name, values[j * nEntries:(j + 1) * nEntries]) for j, name in enumerate(names)])
+    if _weight:
+        columns["weight"] = weights
+    return columns
+
+
 def extractWSFileNames(_inputWSDir):
     state = False
     if not os.path.isdir(_inputWSDir):
@@ -0,0 +1,113 @@
+import os
+import re
+import sys
+import time
+import traceback
+import numpy as np
+from tqdm import tqdm
+from multiprocessing import Pool
+from collections import OrderedDict as od
+from commonTools import read_json, write_json
+
+# Cost-aware dispatch of the job queues of the runners (runSignal.py, runTree2WS.py)
+# * a job: {key, task, size}, the key identifies the job across runs, the task is passed to the job function
+# * history of the previous runs: {key: {wallTime, size}} in <logDir>/<name>_history.json
+# * cost estimate of a job, in seconds when a history exists:
+#   1. wall time of the job in the last run, scaled by the ratio of the input sizes
+#   2. input size x median wall time per size unit of the history
+#   3. input size only (first run, only the ordering matters)
+# * the longest jobs are dispatched first, one job per worker at a time: the short jobs fill the gaps at the end
+# * the estimates and the measured wall times are written to <logDir>/<name>_report.json
+
+
+# Function to make the job of a shell command, the key is the name of its log file (&> ./logger/<key>.txt)
+def shell_job(_cmd, _size=0):
+    match = re.search(r"&>\s*\S*/([^/\s]+)\.txt", _cmd)
+    return od([("key", match.group(1) if match else _cmd), ("task", _cmd), ("size", _size)])
+
+
+# Function to get the total size in bytes of the existing files in a list
+def files_size(_fnames):
+    return sum([os.path.getsize(f) for f in _fnames if os.path.exists(f)])
+
+
+# Function to estimate the cost of the jobs, returns {key: (estimate, source)}
+def estimate_costs(_jobs, _history):
+    rates = [h["wallTime"] / h["size"] for h in _history.values() if h["size"] > 0]
+    rate = float(np.median(rates)) if len(rates) > 0 else None
+    costs = od()
+    for job in _jobs:
+        past = _history.get(job["key"])
+        if past is not None:
+            scale = float(job["size"]) / past["size"] if past["size"] > 0 and job["size"] > 0 else 1.
+            costs[job["key"]] = (past["wallTime"] * scale, "history")
+        elif rate is not None:
+            costs[job["key"]] = (rate * job["size"], "rate")
+        else:
+            costs[job["key"]] = (float(job["size"]), "size")
+    return costs
+
+
+# Function to run a job in a worker and measure its wall time
+# * a failing job returns its traceback instead of raising, its wall time is still recorded
+def _timed_call(_args):
+    func, key, task = _args
+    start = time.time()
+    try:
+        result, error = func(task), None
+    except (Exception, SystemExit):
+        result, error = None, traceback.format_exc()
+    return key, time.time() - start, result, error
+
+
+# Function to run the jobs longest first with _nCPUs workers, returns [(key, result of _func)] in completion order
+# * _name: name of the history and report files (e.g. runSignal_signalFit)
+# * _maxTasksPerChild: recycle the workers after N jobs (None: never)
+# * the history and the report are written even if the run is interrupted, exit 1 once written if a job failed
+def run_jobs(_name, _jobs, _func, _nCPUs, _maxTasksPerChild=None, _logDir="./logger"):
+    if not os.path.exists(_logDir):
+        os.makedirs(_logDir)
+    historyName = "{}/{}_history.json".format(_logDir, _name)
+    history = read_json(historyName)
+    costs = estimate_costs(_jobs, history)
+    jobs = sorted(_jobs, key=lambda j: costs[j["key"]][0], reverse=True)
+
+    print("[INFO] Dispatch {} jobs longest first ({} workers)".format(len(jobs), _nCPUs))
+    for job in jobs:
+        print("  {:<60} estimate {:>12.1f} ({})".format(job["key"], costs[job["key"]][0], costs[job["key"]][1]))
+
+    start = time.time()
+    results, wallTimes, errors = [], od(), od()
+    pool = Pool(_nCPUs, maxtasksperchild=_maxTasksPerChild)
+    try:
+        for key, wallTime, result, error in tqdm(pool.imap_unordered(_timed_call, [(_func, j["key"], j["task"]) for j in jobs], 1), total=len(jobs)):
+            wallTimes[key] = wallTime
+            if error is None:
+                results.append((key, result))
+            else:
+                errors[key] = error
+    finally:
+        pool.terminate()
+        pool.join()
+        makespan = time.time() - start
+
+        # update the history with the wall times of the jobs that succeeded
+        for job in jobs:
+            if job["key"] in wallTimes and job["key"] not in errors:
+                history[job["key"]] = od([("wallTime", wallTimes[job["key"]]), ("size", job["size"])])
+        write_json(historyName, history)
+
+        reportName = "{}/{}_report.json".format(_logDir, _name)
+        write_json(reportName, od([
+            ("name", _name), ("nCPUs", _nCPUs), ("makespan", makespan), ("totalWallTime", sum(wallTimes.values())),
+            ("jobs", [od([("key", j["key"]), ("size", j["size"]), ("estimate", costs[j["key"]][0]), ("source", costs[j["key"]][1]),
+                          ("wallTime", wallTimes.get(j["key"])), ("error", errors.get(j["key"]))]) for j in jobs])
+        ]))
+        print("[INFO] Ran {} of {} jobs in {:.1f}s, report: {}".format(len(wallTimes), len(jobs), makespan, reportName))
+
+    for key, error in errors.items():
+        print("[ERROR] Job {} failed:".format(key))
+        print(error)
+    if len(errors) > 0:
+        sys.exit(1)
+    return results